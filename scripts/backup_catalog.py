@@ -0,0 +1,331 @@
+import sqlite3
+from pathlib import Path
+from datetime import datetime, timedelta
+
+# バックアップカタログ（SQLite）の配置先
+CATALOG_PATH = Path('/backup/catalog.db')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,              -- 'postgres', 'basebackup' など
+    tier TEXT NOT NULL,              -- 'daily', 'weekly', 'monthly', 'manual' など
+    engine TEXT,                     -- 'dumpall', 'directory', 'dedup' など
+    path TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    size INTEGER,
+    raw_bytes INTEGER,
+    duration REAL,
+    codec TEXT,
+    sha256 TEXT,
+    source_db_size INTEGER,
+    promoted_from TEXT,
+    predicted_size INTEGER,
+    deleted_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_backups_live
+    ON backups (kind, tier, created_at) WHERE deleted_at IS NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_backups_live_path
+    ON backups (path) WHERE deleted_at IS NULL;
+-- pg_repackの対象ごとの処理時間（遅いテーブルを継続して追跡するため）
+CREATE TABLE IF NOT EXISTS repack_timings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dbname TEXT NOT NULL,
+    name TEXT NOT NULL,              -- 'public.note' のようなスキーマ付きの名前
+    kind TEXT NOT NULL,              -- 'table' または 'index'
+    started_at TEXT NOT NULL,
+    duration REAL NOT NULL,
+    reclaimed INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_repack_timings_started
+    ON repack_timings (started_at);
+-- PGroongaインデックスの健全性の確認結果（再構築した直後の値を次回の判断の基準にする）
+CREATE TABLE IF NOT EXISTS pgroonga_health (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    checked_at TEXT NOT NULL,
+    decision TEXT NOT NULL,          -- 'skip', 'rebuild', 'rebuilt'（再構築後の計測）
+    reason TEXT,
+    index_bytes INTEGER,
+    table_bytes INTEGER,
+    n_records INTEGER,
+    live_tuples INTEGER,
+    dead_tuples INTEGER,
+    bytes_saved INTEGER              -- 再構築を省いたことで書き込まずに済んだバイト数
+);
+"""
+
+
+def _connect(catalog_path=CATALOG_PATH):
+    catalog_path = Path(catalog_path)
+    catalog_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(catalog_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # 後から追加した列を既存のカタログにも追加する
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(backups)")}
+    if 'predicted_size' not in columns:
+        conn.execute("ALTER TABLE backups ADD COLUMN predicted_size INTEGER")
+    return conn
+
+
+def record_backup(kind, tier, path, engine=None, size=None, raw_bytes=None, duration=None, codec=None,
+                  sha256=None, source_db_size=None, promoted_from=None, created_at=None,
+                  catalog_path=CATALOG_PATH):
+    """
+    バックアップをカタログに登録する
+    同じパスの登録が残っている場合（ファイルを上書きした場合）は、古い登録を削除済みにしてから登録する
+
+    Returns:
+        int: 登録したバックアップのID
+    """
+    conn = _connect(catalog_path)
+    try:
+        with conn:
+            conn.execute("UPDATE backups SET deleted_at = ? WHERE path = ? AND deleted_at IS NULL",
+                         (datetime.now().isoformat(), str(path)))
+            cursor = conn.execute(
+                """
+                INSERT INTO backups (kind, tier, engine, path, created_at, size, raw_bytes, duration,
+                                     codec, sha256, source_db_size, promoted_from)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (kind, tier, engine, str(path), (created_at or datetime.now()).isoformat(), size, raw_bytes,
+                 duration, codec, sha256, source_db_size, promoted_from)
+            )
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def has_backups(kind, tier, catalog_path=CATALOG_PATH):
+    """
+    指定した種類・タイプのバックアップが1件でも登録されているかを返す（削除済みを含む）
+    """
+    conn = _connect(catalog_path)
+    try:
+        return conn.execute("SELECT 1 FROM backups WHERE kind = ? AND tier = ? LIMIT 1",
+                            (kind, tier)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def is_cataloged(path, catalog_path=CATALOG_PATH):
+    """
+    指定したパスのバックアップが削除されずに登録されているかを返す
+    """
+    conn = _connect(catalog_path)
+    try:
+        return conn.execute("SELECT 1 FROM backups WHERE path = ? AND deleted_at IS NULL LIMIT 1",
+                            (str(path),)).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def expired_backups(kind, tier, retention_count, catalog_path=CATALOG_PATH):
+    """
+    保持数を超えた古いバックアップを返す（新しいものからretention_count件を除いた残り）
+    """
+    conn = _connect(catalog_path)
+    try:
+        return [dict(row) for row in conn.execute(
+            """
+            SELECT * FROM backups
+            WHERE kind = ? AND tier = ? AND deleted_at IS NULL
+            ORDER BY created_at DESC
+            LIMIT -1 OFFSET ?
+            """,
+            (kind, tier, retention_count)
+        )]
+    finally:
+        conn.close()
+
+
+def mark_deleted(backup_id, catalog_path=CATALOG_PATH):
+    """
+    バックアップを削除済みとして記録する（履歴として行は残す）
+    """
+    conn = _connect(catalog_path)
+    try:
+        with conn:
+            conn.execute("UPDATE backups SET deleted_at = ? WHERE id = ?",
+                         (datetime.now().isoformat(), backup_id))
+    finally:
+        conn.close()
+
+
+def compression_history(kind, engine, codec, limit=10, catalog_path=CATALOG_PATH):
+    """
+    同じ方式・コーデックで作成された直近のバックアップについて、元のデータベースサイズに対する出力サイズの比率を返す
+    昇格で作成したものなど、元のデータベースサイズが記録されていないバックアップは含まない（削除済みは含む）
+    """
+    conn = _connect(catalog_path)
+    try:
+        return [row['ratio'] for row in conn.execute(
+            """
+            SELECT CAST(size AS REAL) / source_db_size AS ratio FROM backups
+            WHERE kind = ? AND engine = ? AND codec IS ? AND size IS NOT NULL AND source_db_size > 0
+            ORDER BY created_at DESC
+            LIMIT ?
+            """,
+            (kind, engine, codec, limit)
+        )]
+    finally:
+        conn.close()
+
+
+def record_prediction(path, predicted_size, catalog_path=CATALOG_PATH):
+    """
+    事前に予測した出力サイズをバックアップに記録する（予測誤差の追跡用）
+    """
+    conn = _connect(catalog_path)
+    try:
+        with conn:
+            conn.execute("UPDATE backups SET predicted_size = ? WHERE path = ? AND deleted_at IS NULL",
+                         (predicted_size, str(path)))
+    finally:
+        conn.close()
+
+
+def list_backups(kind=None, tier=None, include_deleted=False, limit=None, catalog_path=CATALOG_PATH):
+    """
+    登録されているバックアップを新しい順に返す
+    """
+    conditions = []
+    params = []
+    if kind:
+        conditions.append("kind = ?")
+        params.append(kind)
+    if tier:
+        conditions.append("tier = ?")
+        params.append(tier)
+    if not include_deleted:
+        conditions.append("deleted_at IS NULL")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"SELECT * FROM backups {where} ORDER BY created_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    conn = _connect(catalog_path)
+    try:
+        return [dict(row) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+
+
+def record_repack_timing(dbname, name, kind, started_at, duration, reclaimed=None, catalog_path=CATALOG_PATH):
+    """
+    pg_repackの対象1件の処理時間を記録する
+    """
+    conn = _connect(catalog_path)
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO repack_timings (dbname, name, kind, started_at, duration, reclaimed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (dbname, name, kind, started_at.isoformat(), duration, reclaimed)
+            )
+    finally:
+        conn.close()
+
+
+def slowest_repack_targets(days=30, limit=5, catalog_path=CATALOG_PATH):
+    """
+    直近の期間でpg_repackに時間がかかった対象を、最長の処理時間の順に返す
+
+    Returns:
+        list: name, kind, runs, avg_duration, max_duration, last_duration を含む辞書のリスト
+    """
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = _connect(catalog_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT name, kind, count(*) AS runs, avg(duration) AS avg_duration, max(duration) AS max_duration,
+                   (SELECT t2.duration FROM repack_timings t2 WHERE t2.name = t.name AND t2.dbname = t.dbname
+                    ORDER BY t2.started_at DESC LIMIT 1) AS last_duration
+            FROM repack_timings t
+            WHERE started_at >= ?
+            GROUP BY dbname, name, kind
+            ORDER BY max_duration DESC
+            LIMIT ?
+            """,
+            (since, limit)
+        )
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def record_pgroonga_health(decision, health, reason=None, bytes_saved=None, checked_at=None,
+                           catalog_path=CATALOG_PATH):
+    """
+    PGroongaインデックスの健全性の確認結果を記録する
+    """
+    conn = _connect(catalog_path)
+    try:
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO pgroonga_health (checked_at, decision, reason, index_bytes, table_bytes, n_records,
+                                             live_tuples, dead_tuples, bytes_saved)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                ((checked_at or datetime.now()).isoformat(), decision, reason, health.get('index_bytes'),
+                 health.get('table_bytes'), health.get('n_records'), health.get('live_tuples'),
+                 health.get('dead_tuples'), bytes_saved)
+            )
+    finally:
+        conn.close()
+
+
+def last_pgroonga_rebuild(catalog_path=CATALOG_PATH):
+    """
+    最後に再構築した直後の計測値を返す。記録がない場合はNone
+    """
+    conn = _connect(catalog_path)
+    try:
+        row = conn.execute("SELECT * FROM pgroonga_health WHERE decision = 'rebuilt' "
+                           "ORDER BY checked_at DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def pgroonga_bytes_saved(days=30, catalog_path=CATALOG_PATH):
+    """
+    直近の期間で再構築を省いた回数と、書き込まずに済んだ合計のバイト数を返す
+    """
+    since = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = _connect(catalog_path)
+    try:
+        row = conn.execute("SELECT count(*), coalesce(sum(bytes_saved), 0) FROM pgroonga_health "
+                           "WHERE decision = 'skip' AND checked_at >= ?", (since,)).fetchone()
+        return row[0], row[1]
+    finally:
+        conn.close()
+
+
+def backup_summary(catalog_path=CATALOG_PATH):
+    """
+    種類・タイプごとに、保持しているバックアップの数と合計サイズ、最新のバックアップの情報を返す
+    """
+    conn = _connect(catalog_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT b.kind, b.tier, count(*) AS count, sum(b.size) AS total_size,
+                   latest.created_at, latest.size, latest.raw_bytes, latest.duration
+            FROM backups b
+            JOIN backups latest ON latest.id = (
+                SELECT id FROM backups WHERE kind = b.kind AND tier = b.tier AND deleted_at IS NULL
+                ORDER BY created_at DESC LIMIT 1)
+            WHERE b.deleted_at IS NULL
+            GROUP BY b.kind, b.tier
+            """
+        )
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
@@ -0,0 +1,164 @@
+from pathlib import Path
+from backup_catalog import compression_history, expired_backups, list_backups
+from dedup_store import DEFAULT_REPO_DIR, reclaimable_bytes
+from system_check import get_disk_usage
+
+# バックアップの保存先（空き容量はこのボリュームで判定する）
+BACKUP_ROOT = Path('/backup')
+
+# 履歴がない場合に使う、元のデータベースサイズに対する出力サイズの比率
+# pg_database_sizeはインデックスを含むため、圧縮したダンプはこれより十分小さくなる
+DEFAULT_RATIOS = {
+    'dumpall': 0.5,
+    'directory': 0.5,
+    'dedup': 0.5,
+}
+
+# 予測に使う直近のバックアップ数
+HISTORY_LIMIT = 10
+
+
+def _existing_parent(path):
+    """
+    存在する一番近い親ディレクトリを返す（初回実行でバックアップ先がまだない場合のため）
+    """
+    path = Path(path)
+    while not path.exists() and path != path.parent:
+        path = path.parent
+    return path
+
+
+def _reclaimable_size(backups, repo_dir):
+    """
+    古い世代を削除した場合に解放される見込みのバイト数を返す
+    重複排除リポジトリのカタログ上のサイズは保存時に新しく書き込んだチャンクの量で、削除しても
+    他の世代と共有しているチャンクは残るため、参照カウントが0になるチャンクから見積もる
+    """
+    dedup = [(backup['tier'], Path(backup['path']).stem) for backup in backups if backup['engine'] == 'dedup']
+    others = sum(backup['size'] or 0 for backup in backups if backup['engine'] != 'dedup')
+    return others + (reclaimable_bytes(repo_dir, dedup) if dedup else 0)
+
+
+def estimate_backup_size(source_db_size, engine, codec, margin=1.2):
+    """
+    元のデータベースサイズと過去の圧縮率から、次のバックアップの出力サイズを予測する
+    ストリーミングで.partへ直接書き出すため、一時的に必要な容量のピークは出力サイズと同じになる
+
+    Args:
+        source_db_size (int): pg_database_sizeの合計（バイト）
+        engine (str): バックアップ方式 ('dumpall', 'directory', 'dedup')
+        codec (str): 圧縮コーデック（dedupの場合はNone）
+        margin (float): 予測に掛ける安全率
+
+    Returns:
+        dict: 以下の情報を含む辞書:
+            - predicted_size: 予測した出力サイズ（バイト）
+            - peak_bytes: 安全率を含めた、実行中に必要な最大の空き容量（バイト）
+            - ratio: 予測に使った比率
+            - samples: 予測に使った履歴の件数（0の場合は既定の比率）
+    """
+    ratios = compression_history('postgres', engine, codec, limit=HISTORY_LIMIT)
+    # 直近で一番圧縮が効かなかった比率を使い、少なめの予測で容量不足になるのを避ける
+    ratio = max(ratios) if ratios else DEFAULT_RATIOS.get(engine, 1.0)
+    predicted_size = int(source_db_size * ratio)
+    return {
+        'predicted_size': predicted_size,
+        'peak_bytes': int(predicted_size * margin),
+        'ratio': ratio,
+        'samples': len(ratios),
+    }
+
+
+def plan_backup(backup_type, source_db_size, engine, codec, retention_count, logger,
+                margin=1.2, reserve_percent=5, backup_root=BACKUP_ROOT, known_size=None,
+                repo_dir=DEFAULT_REPO_DIR):
+    """
+    バックアップを実行する前に、出力が保存先に収まるかを予測して実行方法を決める
+
+    Args:
+        backup_type (str): バックアップタイプ ('daily', 'weekly', 'monthly', 'manual')
+        source_db_size (int): pg_database_sizeの合計（バイト）。取得できなかった場合はNone
+        engine (str): バックアップ方式 ('dumpall', 'directory', 'dedup')
+        codec (str): 圧縮コーデック（dedupの場合はNone）
+        retention_count (int): このタイプの保持世代数。Noneの場合は世代管理を行わない
+        logger: ロガーインスタンス
+        margin (float): 予測に掛ける安全率
+        reserve_percent (float): バックアップ後も残しておく空き容量（ボリューム全体に対する%）
+        backup_root (Path): バックアップの保存先
+        known_size (int): 出力サイズが予測ではなく分かっている場合のサイズ（昇格でdailyバックアップをコピーする場合など）
+            指定した場合はsource_db_sizeと安全率を使わない
+        repo_dir (Path): 重複排除リポジトリのディレクトリ
+
+    Returns:
+        dict: 以下の情報を含む辞書:
+            - decision: 'run'（そのまま実行）, 'prune'（先に古い世代を削除してから実行）, 'skip'（実行しない）
+            - predicted_size: 予測した出力サイズ（バイト）。予測できない場合はNone
+            - peak_bytes: 実行中に必要な最大の空き容量（バイト）。予測できない場合はNone
+            - free: 保存先の空き容量（バイト）
+            - reclaimable: 先に削除できる古い世代の合計サイズ（バイト）
+            - disk: 保存先のディスク使用状況
+    """
+    disk = get_disk_usage(str(_existing_parent(backup_root)))
+    reserve = int(disk['total'] * reserve_percent / 100)
+    plan = {
+        'decision': 'run',
+        'predicted_size': None,
+        'peak_bytes': None,
+        'free': disk['free'],
+        'reclaimable': 0,
+        'disk': disk,
+    }
+
+    if known_size is not None:
+        plan['predicted_size'] = known_size
+        plan['peak_bytes'] = known_size
+    elif source_db_size is None:
+        # データベースサイズが取得できない場合は、前回の同じタイプのバックアップサイズから見積もる
+        previous = list_backups('postgres', backup_type, include_deleted=True, limit=1)
+        if not previous or previous[0]['size'] is None:
+            logger.warning("Could not estimate backup size. Falling back to the disk usage threshold.")
+            if disk['percent'] > 100 - reserve_percent:
+                plan['decision'] = 'skip'
+            return plan
+        plan['predicted_size'] = previous[0]['size']
+        plan['peak_bytes'] = int(previous[0]['size'] * margin)
+    else:
+        estimate = estimate_backup_size(source_db_size, engine, codec, margin)
+        plan['predicted_size'] = estimate['predicted_size']
+        plan['peak_bytes'] = estimate['peak_bytes']
+        logger.info(
+            f"Preflight: source {source_db_size} bytes x ratio {estimate['ratio']:.3f} "
+            f"({estimate['samples']} sample(s)) -> predicted {estimate['predicted_size']} bytes"
+        )
+
+    needed = plan['peak_bytes'] + reserve
+    if disk['free'] >= needed:
+        return plan
+
+    # バックアップが成功すれば世代管理で削除される古い世代を、先に削除すれば収まるか確認する
+    if retention_count:
+        reclaimable = expired_backups('postgres', backup_type, max(retention_count - 1, 0))
+        plan['reclaimable'] = _reclaimable_size(reclaimable, repo_dir)
+        if disk['free'] + plan['reclaimable'] >= needed:
+            plan['decision'] = 'prune'
+            logger.warning(
+                f"Preflight: {disk['free']} bytes free, {needed} bytes needed. "
+                f"Pruning {len(reclaimable)} old backup(s) first ({plan['reclaimable']} bytes)."
+            )
+            return plan
+
+    plan['decision'] = 'skip'
+    logger.warning(
+        f"Preflight: {disk['free']} bytes free, {needed} bytes needed "
+        f"(reclaimable: {plan['reclaimable']} bytes). Skipping backup."
+    )
+    return plan
+
+
+def prediction_error(plan, actual_size):
+    """
+    予測した出力サイズと実際のサイズの誤差（%）を返す。予測していない場合はNone
+    """
+    if not plan or not plan.get('predicted_size') or actual_size is None:
+        return None
+    return (actual_size - plan['predicted_size']) / plan['predicted_size'] * 100
@@ -0,0 +1,218 @@
+import os
+import hashlib
+import logging
+import queue
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from compression import open_compressor
+
+# パイプから一度に読み込むサイズ
+STREAM_CHUNK_SIZE = 1024 * 1024  # 1MB
+# 読み込みスレッドと圧縮処理の間に溜めておけるチャンク数の上限
+STREAM_BUFFER_CHUNKS = 16
+# 失敗時のエラーメッセージに含める出力の末尾の行数
+OUTPUT_TAIL_LINES = 50
+
+
+class _HashingWriter:
+    """
+    書き込まれたデータのSHA-256を計算しながら下位のファイルへ書き込む
+    """
+
+    def __init__(self, raw, mirror=None):
+        self.raw = raw
+        self.mirror = mirror
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        if self.mirror is not None:
+            self.mirror.write(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+
+def stream_command_to_file(cmd, env, dest_path, logger, codec='gzip', level=None, threads=None, inspector=None,
+                           mirror=None, governor=None):
+    """
+    コマンドの標準出力を中間ファイルを作らずに圧縮してファイルへ書き出す
+    書き込みは一時ファイル(.part)に対して行い、成功した場合のみリネームで確定させる
+
+    Args:
+        cmd (list): 実行するコマンド
+        env (dict): コマンドに渡す環境変数
+        dest_path (Path): 最終的な出力ファイルのパス
+        logger: ロガーインスタンス
+        codec (str): 圧縮コーデック ('gzip', 'pgzip', 'zstd')
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        threads (int): 圧縮スレッド数。Noneの場合はCPUコア数
+        inspector: 圧縮前のデータを受け取るfeed(data)メソッドを持つオブジェクト（行数の集計などに使う）
+        mirror: 圧縮後のデータを同時に受け取るwrite(data)/abort()メソッドを持つオブジェクト（リモートへのアップロードなど）
+            完了処理は呼び出し側で行い、失敗した場合はここでabort()を呼ぶ
+        governor (LoadGovernor): 指定した場合は負荷に応じてコマンドの優先度を下げ、一時停止する
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+            統計情報の辞書には以下が含まれる:
+            - path: 出力ファイルのパス
+            - size: 圧縮後のサイズ（バイト）
+            - raw_bytes: 圧縮前のサイズ（バイト）
+            - elapsed: 処理時間（秒）
+            - throughput: 圧縮前データの処理速度（バイト/秒）
+            - peak_rss: 本プロセスのピークメモリ使用量（バイト）
+            - child_peak_rss: コマンドのピークメモリ使用量（バイト）
+            - sha256: 出力ファイルのSHA-256
+            - paused: 負荷のためにコマンドを一時停止していた時間（秒）
+            - row_counts: inspectorが集計した行数（inspectorを指定した場合のみ）
+    """
+    dest_path = Path(dest_path)
+    part_path = dest_path.with_name(dest_path.name + '.part')
+    chunks = queue.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    stop = threading.Event()
+    raw_bytes = 0
+
+    with tempfile.TemporaryFile() as stderr_file:
+        start_time = time.time()
+        # stderrはパイプにするとstdoutの読み込みと競合してデッドロックし得るため一時ファイルに逃がす
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=stderr_file)
+
+        def _reader():
+            # stdoutを一定サイズずつ読み込み、上限付きキューに渡す
+            while not stop.is_set():
+                chunk = proc.stdout.read(STREAM_CHUNK_SIZE)
+                while not stop.is_set():
+                    try:
+                        chunks.put(chunk, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if not chunk:
+                    return
+
+        reader = threading.Thread(target=_reader, name='stream-reader', daemon=True)
+        reader.start()
+        if governor is not None:
+            governor.attach(proc.pid, pausable=True)
+        paused = 0.0
+
+        try:
+            with open(part_path, 'wb') as raw_out:
+                # 書き込みと同時にチェックサムを計算し、後から読み直さずに済むようにする
+                hashing_out = _HashingWriter(raw_out, mirror)
+                with open_compressor(codec, hashing_out, level=level, threads=threads,
+                                     filename=dest_path.name) as compressed_out:
+                    while True:
+                        chunk = chunks.get()
+                        if not chunk:
+                            break
+                        raw_bytes += len(chunk)
+                        if inspector is not None:
+                            inspector.feed(chunk)
+                        compressed_out.write(chunk)
+                raw_out.flush()
+                os.fsync(raw_out.fileno())
+        except BaseException:
+            # 書き込みに失敗した場合はコマンドを止めて一時ファイルを片付ける
+            stop.set()
+            if governor is not None:
+                governor.detach(proc.pid)
+            proc.kill()
+            reader.join()
+            proc.stdout.close()
+            proc.wait()
+            part_path.unlink(missing_ok=True)
+            if mirror is not None:
+                mirror.abort()
+            raise
+
+        reader.join()
+        proc.stdout.close()
+        if governor is not None:
+            paused = governor.detach(proc.pid)
+
+        # wait4でコマンド自体のリソース使用量を取得する
+        _, status, child_usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.time() - start_time
+
+        if proc.returncode != 0:
+            stderr_file.seek(0)
+            stderr_text = stderr_file.read().decode('utf-8', errors='replace')
+            part_path.unlink(missing_ok=True)
+            if mirror is not None:
+                mirror.abort()
+            return False, f"Command exited with status {proc.returncode}: {stderr_text}"
+
+    # 成功した場合のみ最終的なファイル名に置き換える
+    os.replace(part_path, dest_path)
+
+    stats = {
+        'path': dest_path,
+        'codec': codec,
+        'size': dest_path.stat().st_size,
+        'raw_bytes': raw_bytes,
+        'elapsed': elapsed,
+        'throughput': raw_bytes / elapsed if elapsed > 0 else 0,
+        # Linuxではru_maxrssはKB単位
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'child_peak_rss': child_usage.ru_maxrss * 1024,
+        'sha256': hashing_out.sha256.hexdigest(),
+        'paused': paused,
+    }
+    if inspector is not None:
+        stats['row_counts'] = inspector.row_counts
+    logger.info(
+        f"Stream completed: {raw_bytes} bytes -> {stats['size']} bytes "
+        f"in {elapsed:.1f}s ({stats['throughput'] / (1024 * 1024):.2f} MB/s)"
+    )
+    return True, stats
+
+
+def run_command_streaming(cmd, env, logger, on_line=None, log_level=logging.INFO, governor=None, pausable=False):
+    """
+    コマンドを実行し、標準出力と標準エラー出力を1行ずつログに書き出す
+    出力をすべてメモリに溜めないよう、手元には末尾の数行だけを残す
+
+    Args:
+        cmd (list): 実行するコマンド
+        env (dict): コマンドに渡す環境変数
+        logger: ロガーインスタンス
+        on_line (callable): 1行ごとに呼び出す関数（進捗の解析などに使う）
+        log_level (int): 出力を書き出すログレベル
+        governor (LoadGovernor): 指定した場合は負荷に応じてコマンドの優先度を下げる
+        pausable (bool): 負荷が高い場合にコマンドを一時停止してよいかどうか
+
+    Returns:
+        tuple: (終了コード, 出力の末尾の行を連結した文字列)
+    """
+    tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    # stderrをstdoutにまとめ、1本のパイプを行単位で読む
+    proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, errors='replace', bufsize=1)
+    if governor is not None:
+        governor.attach(proc.pid, pausable=pausable)
+    try:
+        for line in proc.stdout:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            tail.append(line)
+            logger.log(log_level, f"[{Path(cmd[0]).name}] {line}")
+            if on_line is not None:
+                on_line(line)
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        if governor is not None:
+            governor.detach(proc.pid)
+        proc.stdout.close()
+        proc.wait()
+    return proc.returncode, '\n'.join(tail)
@@ -0,0 +1,341 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:  # zstdはオプション（pip install zstandard）
+    zstandard = None
+
+# 検証用の一時PostgreSQLのバイナリの場所とポート
+PG_BIN_DIR = Path('/usr/lib/postgresql/16/bin')
+VERIFY_PORT = 54329
+
+# 検証時に復元ストリームへ一度に書き込むサイズ
+RESTORE_CHUNK_SIZE = 1024 * 1024  # 1MB
+
+# バックアップ本体の横に置く検証用マニフェストの拡張子
+MANIFEST_SUFFIX = '.manifest.json'
+
+# 空の一時クラスタへの復元で避けられないエラー（これ以外のエラーがあれば検証失敗とする）
+# 既存ロール(postgres)の作成と、一時クラスタに入っていないPGroonga拡張とそのインデックス
+ALLOWED_RESTORE_ERRORS = (
+    re.compile(r'role "postgres" already exists'),
+    re.compile(r'extension "pgroonga"|pgroonga\.control'),
+    re.compile(r'(access method|operator class|operator family) "pgroonga'),
+)
+
+
+class DumpInspector:
+    """
+    pg_dumpallのSQL出力を流れてくるままに解析し、テーブルごとの行数を数える
+    COPY ... FROM stdin; から \\. までの行数をテーブルの行数とし、
+    \\connect でデータベースの切り替えを追跡する
+    row_counts は {データベース名: {テーブル名: 行数}} の形になる
+    """
+
+    def __init__(self):
+        self.database = 'postgres'
+        self.table = None
+        self.carry = b''
+        self.row_counts = {}
+
+    def feed(self, data):
+        # 行の途中で切れている部分は次回に持ち越し、常に完結した行だけを解析する
+        data = self.carry + data
+        last_newline = data.rfind(b'\n')
+        if last_newline == -1:
+            self.carry = data
+            return
+        self.carry = data[last_newline + 1:]
+        self._parse(data, last_newline + 1)
+
+    def _parse(self, data, end):
+        pos = 0
+        while pos < end:
+            if self.table is not None:
+                # COPYのデータ部分: 終端行 \. までの改行数を数える
+                if data.startswith(b'\\.\n', pos):
+                    terminator = pos
+                else:
+                    found = data.find(b'\n\\.\n', pos, end)
+                    terminator = found + 1 if found != -1 else -1
+                counts = self.row_counts[self.database]
+                if terminator == -1:
+                    counts[self.table] += data.count(b'\n', pos, end)
+                    return
+                counts[self.table] += data.count(b'\n', pos, terminator)
+                self.table = None
+                pos = terminator + 3
+                continue
+
+            # COPYまたは\connectで始まる次の行を探す
+            candidates = []
+            for token in (b'COPY ', b'\\connect '):
+                if data.startswith(token, pos):
+                    candidates.append(pos)
+                else:
+                    found = data.find(b'\n' + token, pos, end)
+                    if found != -1:
+                        candidates.append(found + 1)
+            if not candidates:
+                return
+            line_start = min(candidates)
+            line_end = data.find(b'\n', line_start, end)
+            line = data[line_start:line_end].decode('utf-8', errors='replace')
+            pos = line_end + 1
+
+            if line.startswith('\\connect '):
+                self.database = _parse_connect_line(line)
+            elif line.endswith('FROM stdin;'):
+                self.table = line.split()[1]
+                self.row_counts.setdefault(self.database, {}).setdefault(self.table, 0)
+
+
+def _parse_connect_line(line):
+    """
+    \\connect 行から接続先のデータベース名を取り出す
+    例: \\connect -reuse-previous=on "dbname='misskey'" / \\connect misskey
+    """
+    if "dbname='" in line:
+        return line.split("dbname='", 1)[1].split("'", 1)[0]
+    return line.split()[-1].strip('"')
+
+
+def write_manifest(artifact_path, stats):
+    """
+    バックアップ本体の横に検証用マニフェスト（チェックサムと行数）を書き出す
+    """
+    manifest = {
+        'artifact': Path(artifact_path).name,
+        'created_at': datetime.now().isoformat(),
+        'sha256': stats.get('sha256'),
+        'size': stats.get('size'),
+        'raw_bytes': stats.get('raw_bytes'),
+        'row_counts': stats.get('row_counts', {}),
+    }
+    manifest_path = Path(artifact_path).with_name(Path(artifact_path).name + MANIFEST_SUFFIX)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def read_manifest(artifact_path):
+    """
+    検証用マニフェストを読み込む。存在しない場合はNone
+    """
+    manifest_path = Path(artifact_path).with_name(Path(artifact_path).name + MANIFEST_SUFFIX)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _run_as_postgres(cmd, **kwargs):
+    """
+    rootで実行されている場合はpostgresユーザーとしてコマンドを実行する（initdbはrootで動かないため）
+    """
+    if os.geteuid() == 0:
+        cmd = ['runuser', '-u', 'postgres', '--'] + cmd
+    return subprocess.run(cmd, capture_output=True, text=True, **kwargs)
+
+
+def _count_rows(socket_dir, row_counts, logger):
+    """
+    復元先のデータベースでテーブルごとの行数を数える
+    """
+    restored = {}
+    for database, tables in row_counts.items():
+        if not tables:
+            continue
+        selects = []
+        for table in tables:
+            label = table.replace("'", "''")
+            selects.append(f"SELECT '{label}', count(*) FROM {table}")
+        query = " UNION ALL ".join(selects)
+        result = subprocess.run(
+            ['psql', f'--host={socket_dir}', f'--port={VERIFY_PORT}', '--username=postgres',
+             f'--dbname={database}', '--no-psqlrc', '--tuples-only', '--no-align', '--field-separator=|',
+             '-c', query],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            logger.error(f"Failed to count rows in {database}: {result.stderr}")
+            continue
+        for line in result.stdout.splitlines():
+            table, _, count = line.rpartition('|')
+            restored.setdefault(database, {})[table] = int(count)
+    return restored
+
+
+def verify_backup(artifact_path, logger, stream_writer=None, manifest=None):
+    """
+    バックアップを一時的なローカルPostgreSQLへ復元し、チェックサムとテーブルの行数を検証する
+
+    Args:
+        artifact_path (Path): 検証するバックアップファイル（マニフェストの場所としても使う）
+        logger: ロガーインスタンス
+        stream_writer (callable): 復元データを書き込む関数 (fileobj) -> 書き込んだバイト数
+            Noneの場合はartifact_pathを展開しながら書き込む
+        manifest (dict): 期待値（sha256, row_counts）。Noneの場合はartifact_pathの横のマニフェストを読む
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 結果の辞書またはエラーメッセージ)
+            - checksum_ok: チェックサムが一致したかどうか
+            - mismatched_tables: 行数が一致しなかったテーブルの一覧
+            - restore_errors: 復元時のエラーの件数
+            - unexpected_errors: ALLOWED_RESTORE_ERRORSに当てはまらない復元時のエラー（最大20件）
+            - restore_returncode: psqlの終了コード
+            - restored_bytes: 復元したデータ量（バイト）
+            - restore_seconds: 復元にかかった時間（秒）
+            - throughput: 復元速度（バイト/秒）
+    """
+    if manifest is None:
+        manifest = read_manifest(artifact_path)
+    if manifest is None and stream_writer is None:
+        return False, f"No manifest found for {artifact_path}"
+
+    work_dir = Path(tempfile.mkdtemp(prefix='mensis_verify_'))
+    data_dir = work_dir / 'data'
+    socket_dir = work_dir
+    started = False
+    try:
+        if os.geteuid() == 0:
+            shutil.chown(work_dir, user='postgres', group='postgres')
+
+        # 1. 一時クラスタを作成して起動（UNIXソケットのみで待ち受ける）
+        result = _run_as_postgres([str(PG_BIN_DIR / 'initdb'), f'--pgdata={data_dir}',
+                                   '--username=postgres', '--auth=trust', '--no-sync'])
+        if result.returncode != 0:
+            return False, f"initdb failed: {result.stderr}"
+        options = f"-c listen_addresses='' -c unix_socket_directories='{socket_dir}' -p {VERIFY_PORT} -c fsync=off"
+        result = _run_as_postgres([str(PG_BIN_DIR / 'pg_ctl'), f'--pgdata={data_dir}', '-o', options,
+                                   '-w', 'start', f'--log={work_dir / "postgres.log"}'])
+        if result.returncode != 0:
+            return False, f"Failed to start verification cluster: {result.stderr}"
+        started = True
+
+        # 2. バックアップを展開しながらpsqlへ流し込む（チェックサムも同時に計算する）
+        logger.info(f"Restoring {artifact_path} into verification cluster")
+        start_time = time.time()
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(
+                ['psql', f'--host={socket_dir}', f'--port={VERIFY_PORT}', '--username=postgres',
+                 '--dbname=postgres', '--no-psqlrc', '--quiet'],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file
+            )
+            checksum = hashlib.sha256()
+            try:
+                if stream_writer is not None:
+                    restored_bytes = stream_writer(proc.stdin)
+                else:
+                    restored_bytes = _stream_artifact(artifact_path, proc.stdin, checksum)
+            except BrokenPipeError:
+                restored_bytes = 0
+            finally:
+                proc.stdin.close()
+            proc.wait()
+            stderr_file.seek(0)
+            errors = [line for line in stderr_file.read().decode('utf-8', errors='replace').splitlines()
+                      if 'ERROR' in line]
+        restore_seconds = time.time() - start_time
+
+        # 空のクラスタでは避けられないエラーは記録だけ行い、それ以外は検証失敗とする
+        unexpected = unexpected_restore_errors(errors)
+        for line in errors[:20]:
+            logger.warning(f"Restore error: {line}")
+
+        # 3. チェックサムと行数を比較
+        checksum_ok = None
+        expected_rows = {}
+        if manifest is not None:
+            expected_rows = manifest.get('row_counts', {})
+            if stream_writer is None and manifest.get('sha256'):
+                checksum_ok = checksum.hexdigest() == manifest['sha256']
+        restored_rows = _count_rows(socket_dir, expected_rows, logger)
+        mismatched = [
+            {'table': f"{database}.{table}", 'expected': expected,
+             'restored': restored_rows.get(database, {}).get(table)}
+            for database, tables in expected_rows.items()
+            for table, expected in tables.items()
+            if restored_rows.get(database, {}).get(table) != expected
+        ]
+
+        verify_result = {
+            'checksum_ok': checksum_ok,
+            'tables': sum(len(tables) for tables in expected_rows.values()),
+            'mismatched_tables': mismatched,
+            'restore_errors': len(errors),
+            'unexpected_errors': unexpected[:20],
+            'restore_returncode': proc.returncode,
+            'restored_bytes': restored_bytes,
+            'restore_seconds': restore_seconds,
+            'throughput': restored_bytes / restore_seconds if restore_seconds > 0 else 0,
+        }
+        success = (checksum_ok is not False and not mismatched and restored_bytes > 0
+                   and proc.returncode == 0 and not unexpected)
+        logger.info(f"Verification of {artifact_path}: {'OK' if success else 'FAILED'} {verify_result}")
+        return success, verify_result
+
+    except Exception as e:
+        error_msg = f"Error during backup verification: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+    finally:
+        if started:
+            _run_as_postgres([str(PG_BIN_DIR / 'pg_ctl'), f'--pgdata={data_dir}', '-m', 'immediate', 'stop'])
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def unexpected_restore_errors(errors):
+    """
+    復元時のエラーのうち、ALLOWED_RESTORE_ERRORSに当てはまらないものを返す
+    """
+    return [line for line in errors if not any(pattern.search(line) for pattern in ALLOWED_RESTORE_ERRORS)]
+
+
+def _stream_artifact(artifact_path, fileobj, checksum):
+    """
+    バックアップファイルを読みながらチェックサムを計算し、展開したデータをfileobjへ書き込む
+    """
+    class _HashingReader:
+        def __init__(self, raw):
+            self.raw = raw
+
+        def read(self, size=-1):
+            data = self.raw.read(size)
+            checksum.update(data)
+            return data
+
+        def readable(self):
+            return True
+
+    written = 0
+    with open(artifact_path, 'rb') as raw:
+        hashing_raw = _HashingReader(raw)
+        if str(artifact_path).endswith('.zst'):
+            if zstandard is None:
+                raise ImportError("Verifying .zst backups requires the 'zstandard' package")
+            decompressed = zstandard.ZstdDecompressor().stream_reader(hashing_raw)
+        else:
+            decompressed = gzip.GzipFile(fileobj=hashing_raw, mode='rb')
+        with decompressed:
+            while True:
+                data = decompressed.read(RESTORE_CHUNK_SIZE)
+                if not data:
+                    break
+                fileobj.write(data)
+                written += len(data)
+        # gzipのトレーラーなど、展開で読み残した部分もチェックサムに含める
+        while hashing_raw.read(RESTORE_CHUNK_SIZE):
+            pass
+    return written
@@ -0,0 +1,216 @@
+import gzip
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # zstdはオプション（pip install zstandard）
+    zstandard = None
+
+# 並列gzipで1スレッドが一度に圧縮するブロックサイズ
+PGZIP_BLOCK_SIZE = 4 * 1024 * 1024  # 4MB
+
+# コーデックごとの設定
+#   extension: 出力ファイルの拡張子
+#   default_level: 圧縮レベルを指定しなかった場合の値
+CODECS = {
+    'gzip': {'extension': '.gz', 'default_level': 6},
+    'pgzip': {'extension': '.gz', 'default_level': 6},
+    'zstd': {'extension': '.zst', 'default_level': 3},
+}
+
+
+def codec_extension(codec):
+    """
+    コーデックに対応するファイル拡張子を返す
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec}. Must be one of: {', '.join(CODECS)}")
+    return CODECS[codec]['extension']
+
+
+def backup_extensions():
+    """
+    いずれかのコーデックで出力されうる拡張子の一覧を返す
+    """
+    return sorted({config['extension'] for config in CODECS.values()})
+
+
+def open_compressor(codec, fileobj, level=None, threads=None, filename=None):
+    """
+    指定されたコーデックで圧縮しながらfileobjへ書き込むファイルライクオブジェクトを返す
+    closeしてもfileobj自体は閉じない
+
+    Args:
+        codec (str): コーデック名 ('gzip', 'pgzip', 'zstd')
+        fileobj: 圧縮後のデータを書き込むバイナリファイル
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        threads (int): 圧縮スレッド数。Noneの場合はCPUコア数（gzipは常に1）
+        filename (str): gzipヘッダーに記録するファイル名
+
+    Returns:
+        書き込み可能なファイルライクオブジェクト
+    """
+    codec_extension(codec)
+    if level is None:
+        level = CODECS[codec]['default_level']
+    if not threads:
+        threads = os.cpu_count() or 1
+
+    if codec == 'gzip':
+        return gzip.GzipFile(filename=filename or '', mode='wb', fileobj=fileobj, compresslevel=level)
+    if codec == 'pgzip':
+        return ParallelGzipWriter(fileobj, level=level, threads=threads)
+    if zstandard is None:
+        raise ImportError("zstd codec requires the 'zstandard' package")
+    compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+    return compressor.stream_writer(fileobj, closefd=False)
+
+
+def pg_dump_compress_option(codec, level=None):
+    """
+    コーデック設定に対応するpg_dumpの--compressオプションを返す
+    pg_dumpはディレクトリ形式でテーブルごとに圧縮するため、pgzipはgzipとして扱う
+    """
+    codec_extension(codec)
+    if level is None:
+        level = CODECS[codec]['default_level']
+    method = 'zstd' if codec == 'zstd' else 'gzip'
+    return f'--compress={method}:{level}'
+
+
+class ParallelGzipWriter:
+    """
+    入力をブロックに分割して複数スレッドで圧縮する書き込みオブジェクト
+    各ブロックは独立したgzipメンバーとして出力されるため、結果は標準的な.gzとして読める
+    """
+
+    def __init__(self, fileobj, level=6, threads=None, block_size=PGZIP_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.block_size = block_size
+        self.executor = ThreadPoolExecutor(max_workers=threads or os.cpu_count() or 1,
+                                           thread_name_prefix='pgzip')
+        # 出力待ちのブロック数を制限してメモリ使用量を抑える
+        self.max_pending = (threads or os.cpu_count() or 1) * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block):
+        # zlibは圧縮中にGILを解放するためスレッドで並列に処理できる
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level, mtime=0))
+        while len(self.pending) >= self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.pending:
+                # 空入力でも有効なgzipファイルになるよう最低1メンバーは出力する
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _CountingSink:
+    """
+    書き込まれたバイト数だけを数えて捨てるファイルライクオブジェクト
+    """
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def read_sample(path, sample_bytes):
+    """
+    バックアップファイルから圧縮前のデータを先頭から指定サイズだけ読み込む
+    """
+    path = str(path)
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            return f.read(sample_bytes)
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading .zst samples requires the 'zstandard' package")
+        with open(path, 'rb') as raw, zstandard.ZstdDecompressor().stream_reader(raw) as f:
+            return f.read(sample_bytes)
+    with open(path, 'rb') as f:
+        return f.read(sample_bytes)
+
+
+def benchmark_codecs(sample, candidates, logger):
+    """
+    サンプルデータに対して各コーデックの圧縮速度と圧縮率を計測する
+
+    Args:
+        sample (bytes): 圧縮前のサンプルデータ
+        candidates (list): (codec, level, threads)のタプルのリスト
+        logger: ロガーインスタンス
+
+    Returns:
+        list: 計測結果の辞書のリスト
+            - codec, level, threads: 計測した設定
+            - mb_per_sec: 圧縮前データ基準の処理速度（MB/秒）
+            - ratio: 圧縮率（圧縮前サイズ / 圧縮後サイズ）
+            - error: 計測できなかった場合の理由
+    """
+    results = []
+    for codec, level, threads in candidates:
+        if level is None:
+            level = CODECS[codec]['default_level']
+        sink = _CountingSink()
+        try:
+            start_time = time.perf_counter()
+            with open_compressor(codec, sink, level=level, threads=threads) as writer:
+                # 実運用と同じく1MBずつ書き込む
+                for offset in range(0, len(sample), 1024 * 1024):
+                    writer.write(sample[offset:offset + 1024 * 1024])
+            elapsed = time.perf_counter() - start_time
+        except ImportError as e:
+            logger.warning(f"Skipping {codec}: {e}")
+            results.append({'codec': codec, 'level': level, 'threads': threads, 'error': str(e)})
+            continue
+
+        result = {
+            'codec': codec,
+            'level': level,
+            'threads': threads,
+            'mb_per_sec': round(len(sample) / (1024 * 1024) / elapsed, 2) if elapsed > 0 else 0,
+            'ratio': round(len(sample) / sink.bytes_written, 2) if sink.bytes_written else 0,
+        }
+        logger.info(f"Benchmark {codec} (level={level}, threads={threads}): "
+                    f"{result['mb_per_sec']} MB/s, ratio {result['ratio']}")
+        results.append(result)
+    return results
@@ -1,47 +1,199 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-def setup_logger(name=None, log_file='/scripts/python.log', level=logging.INFO):
+# ログファイルの既定のパス
+LOG_FILE = '/scripts/python.log'
+# JSON形式で出力する補足の項目（task_contextやextraで付ける）
+CONTEXT_FIELDS = ('task', 'run_id', 'duration')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 実行中のタスクの情報（スレッドごとに別の値を持つ）
+_CONTEXT = contextvars.ContextVar('log_context', default={})
+_LISTENER = None
+_QUEUE_HANDLER = None
+_LOGGERS = {}
+# setup_loggerで作るロガーのロギングレベル
+_LEVEL = logging.INFO
+_LOCK = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    1行に1つのJSONとして出力するフォーマッタ（機械的に集計するため）
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # キューを経由したレコードは、例外を整形済みの文字列として持っている
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ContextFilter(logging.Filter):
+    # キューに入れる前に、実行中のタスクの情報をレコードに付ける（出力は別スレッドで行うため）
+    def filter(self, record):
+        for key, value in _CONTEXT.get().items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, value)
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    # 標準のprepareは例外をmsgに連結してしまい、JSON形式でmessageとexceptionを分けられないため、
+    # 例外は整形した文字列をexc_textに残す（テキスト形式のFormatterはexc_textをそのまま末尾に付ける）
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging(log_file=LOG_FILE, level=logging.INFO, json_format=False):
+    """
+    ログの出力先を構築する。ロガーはキューに入れるだけで、ファイルとコンソールへの書き込みは別スレッドで行う
+    （バインドマウントしたログファイルへの書き込みが遅くてもタスクが止まらないようにする）
+    既に構築済みの場合は出力先を作り直す
+
+    Args:
+        log_file (str): ログファイルのパス
+        level (int): setup_loggerで作るロガーのロギングレベル
+            ライブラリのロガーは従来通りWARNING以上のみ出力する
+        json_format (bool): JSON Lines形式で出力するかどうか
+    """
+    with _LOCK:
+        _configure(log_file, level, json_format)
+
+
+def _configure(log_file, level, json_format):
+    global _LISTENER, _QUEUE_HANDLER, _LEVEL
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+
+    # ファイルハンドラー（ローテーション付き）
+    try:
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=5*1024*1024,  # 5MB
+            backupCount=3
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    except (PermissionError, IOError, OSError) as e:
+        print(f"警告: ログファイル '{log_file}' に書き込みができません: {e}", file=sys.stderr)
+
+    # コンソールハンドラー
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
+
+    root = logging.getLogger()
+    if _LISTENER is not None:
+        # 以前のキューに残っているログを書き出してから入れ替える
+        _LISTENER.stop()
+        root.removeHandler(_QUEUE_HANDLER)
+        for handler in _LISTENER.handlers:
+            handler.close()
+
+    log_queue = queue.Queue(-1)
+    _QUEUE_HANDLER = _QueueHandler(log_queue)
+    _QUEUE_HANDLER.addFilter(_ContextFilter())
+    root.addHandler(_QUEUE_HANDLER)
+    root.setLevel(logging.WARNING)
+    _LEVEL = level
+    for name, logger in _LOGGERS.items():
+        if name is not None:
+            logger.setLevel(level)
+    _LISTENER = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _LISTENER.start()
+
+
+def shutdown_logging():
+    """
+    キューに残っているログをすべて書き出して、書き込み用のスレッドを止める
+    """
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            for handler in _LISTENER.handlers:
+                handler.close()
+            logging.getLogger().removeHandler(_QUEUE_HANDLER)
+            _LISTENER = None
+
+
+atexit.register(shutdown_logging)
+
+
+@contextmanager
+def task_context(task, run_id=None):
+    """
+    この中で出力したログに、タスク名と実行ID（JSON形式のtask, run_id）を付ける
+
+    Args:
+        task (str): タスク名
+        run_id (str): 実行ID。Noneの場合は新しく作る
+
+    Yields:
+        str: 実行ID
+    """
+    run_id = run_id or uuid.uuid4().hex[:12]
+    token = _CONTEXT.set({**_CONTEXT.get(), 'task': task, 'run_id': run_id})
+    try:
+        yield run_id
+    finally:
+        _CONTEXT.reset(token)
+
+
+def setup_logger(name=None, log_file=LOG_FILE, level=None):
     """
     ロギング設定を行うヘルパー関数
-    
+    出力先は初回にconfigure_loggingで1つだけ構築し、ロガーは名前ごとに使い回す
+
     Args:
         name (str): ロガーの名前。Noneの場合はルートロガーを使用
-        log_file (str): ログファイルのパス
-        level (int): ロギングレベル
-    
+        log_file (str): ログファイルのパス（出力先がまだ構築されていない場合のみ使う）
+        level (int): ロギングレベル。Noneの場合はconfigure_loggingで指定したレベル
+
     Returns:
         Logger: 設定済みのロガーインスタンス
     """
-    # ディレクトリが存在しない場合は作成
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    
-    # 指定された名前でロガーを取得
-    logger = logging.getLogger(name)
-    
-    # ロガーのレベルが設定されていない場合のみ設定
-    if not logger.handlers:
-        logger.setLevel(level)
-        
-        # ファイルハンドラー（ローテーション付き）
-        try:
-            file_handler = RotatingFileHandler(
-                log_file, 
-                maxBytes=5*1024*1024,  # 5MB
-                backupCount=3
-            )
-            file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-            file_handler.setFormatter(file_format)
-            logger.addHandler(file_handler)
-        except (PermissionError, IOError, OSError) as e:
-            print(f"警告: ログファイル '{log_file}' に書き込みができません: {e}", file=sys.stderr)
-        
-        # コンソールハンドラー
-        console_handler = logging.StreamHandler()
-        console_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console_handler.setFormatter(console_format)
-        logger.addHandler(console_handler)
-    
+    logger = _LOGGERS.get(name)
+    if logger is not None and level is None:
+        return logger
+
+    with _LOCK:
+        if _LISTENER is None:
+            _configure(log_file, _LEVEL, False)
+        logger = logging.getLogger(name)
+        if name is not None:
+            logger.setLevel(level or _LEVEL)
+        _LOGGERS[name] = logger
     return logger
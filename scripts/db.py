@@ -0,0 +1,202 @@
+import threading
+import time
+from psycopg_pool import ConnectionPool
+from load_env import get_settings
+
+# 接続先ごとのコネクションプール（(host, port, user, dbname) をキーにする）
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+# クエリの実行後に呼び出す関数の一覧 (sql, elapsed, dbname, error) を受け取る
+_QUERY_HOOKS = []
+
+
+def _session_options():
+    """
+    接続ごとのセッション設定。.envのDB_STATEMENT_TIMEOUT_MS / DB_LOCK_TIMEOUT_MSで変更できる
+    """
+    settings = get_settings()
+    statement_timeout = settings.get('DB_STATEMENT_TIMEOUT_MS')
+    lock_timeout = settings.get('DB_LOCK_TIMEOUT_MS')
+    return f"-c statement_timeout={statement_timeout} -c lock_timeout={lock_timeout}"
+
+
+def get_pool(connection_info, dbname=None):
+    """
+    接続先のコネクションプールを返す（初回のみ作成し、以降は同じプールを共有する）
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        dbname (str): 接続するデータベース。Noneの場合はconnection_info['db']
+
+    Returns:
+        ConnectionPool: コネクションプール
+    """
+    dbname = dbname or connection_info['db']
+    key = (connection_info['host'], str(connection_info['port']), connection_info['user'], dbname)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                kwargs={
+                    'host': connection_info['host'],
+                    'port': connection_info['port'],
+                    'user': connection_info['user'],
+                    'password': connection_info['password'],
+                    'dbname': dbname,
+                    'application_name': 'mensis',
+                    'options': _session_options(),
+                    # DDL（CREATE INDEX CONCURRENTLYなど）をトランザクションの外で実行できるようにする
+                    'autocommit': True,
+                },
+                min_size=0,
+                max_size=get_settings().get('DB_POOL_SIZE'),
+                max_idle=300,
+                name=f"mensis-{dbname}",
+                open=True,
+            )
+            _POOLS[key] = pool
+        return pool
+
+
+def close_pools():
+    """
+    すべてのコネクションプールを閉じる
+    """
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
+
+
+def add_query_hook(hook):
+    """
+    クエリの実行後に呼び出す関数を登録する（計測やメトリクスの収集に使う）
+
+    Args:
+        hook (callable): (sql, elapsed, dbname, error) を受け取る関数
+            elapsedは秒、errorは失敗した場合の例外（成功した場合はNone）
+    """
+    _QUERY_HOOKS.append(hook)
+
+
+def _run_hooks(sql, elapsed, dbname, error):
+    for hook in _QUERY_HOOKS:
+        try:
+            hook(sql, elapsed, dbname, error)
+        except Exception:
+            # 計測の失敗で本来の処理を止めない
+            pass
+
+
+def _execute(connection_info, sql, params, timeout, dbname, fetch):
+    dbname = dbname or connection_info['db']
+    pool = get_pool(connection_info, dbname)
+    start_time = time.time()
+    error = None
+    try:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                if timeout is not None:
+                    # この文だけのタイムアウト（終わったら接続時の設定に戻す）
+                    cur.execute(f"SET statement_timeout = {int(timeout * 1000)}")
+                try:
+                    cur.execute(sql, params)
+                    if fetch:
+                        return cur.fetchall() if cur.description else []
+                    return cur.rowcount
+                finally:
+                    if timeout is not None and not conn.broken:
+                        cur.execute("RESET statement_timeout")
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _run_hooks(sql, time.time() - start_time, dbname, error)
+
+
+def query(connection_info, sql, params=None, timeout=None, dbname=None):
+    """
+    クエリを実行して結果の行を返す
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        sql (str): 実行するSQL
+        params (tuple|dict): SQLのパラメータ
+        timeout (float): この文だけのタイムアウト（秒）。Noneの場合はDB_STATEMENT_TIMEOUT_MS
+        dbname (str): 接続するデータベース。Noneの場合はconnection_info['db']
+
+    Returns:
+        list: 結果の行（タプル）のリスト
+    """
+    return _execute(connection_info, sql, params, timeout, dbname, fetch=True)
+
+
+def query_value(connection_info, sql, params=None, timeout=None, dbname=None):
+    """
+    結果の1行目の1列目の値を返す。結果がない場合はNone
+    """
+    rows = query(connection_info, sql, params, timeout, dbname)
+    return rows[0][0] if rows else None
+
+
+def execute(connection_info, sql, params=None, timeout=None, dbname=None):
+    """
+    結果を返さないSQL（DDLなど）を実行する
+
+    Returns:
+        int: 影響を受けた行数
+    """
+    return _execute(connection_info, sql, params, timeout, dbname, fetch=False)
+
+
+def execute_in_transaction(connection_info, statements, timeout=None, dbname=None):
+    """
+    複数のSQLを1つのトランザクションで実行する（インデックスの入れ替えなど、途中の状態を見せたくない場合に使う）
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        statements (list): 実行するSQLのリスト
+        timeout (float): トランザクション内の各文のタイムアウト（秒）。Noneの場合はDB_STATEMENT_TIMEOUT_MS
+        dbname (str): 接続するデータベース。Noneの場合はconnection_info['db']
+    """
+    dbname = dbname or connection_info['db']
+    pool = get_pool(connection_info, dbname)
+    sql = '; '.join(statements)
+    start_time = time.time()
+    error = None
+    try:
+        with pool.connection() as conn:
+            with conn.transaction():
+                with conn.cursor() as cur:
+                    if timeout is not None:
+                        # SET LOCALはトランザクションの終了時に元に戻る
+                        cur.execute(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+                    for statement in statements:
+                        cur.execute(statement)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _run_hooks(sql, time.time() - start_time, dbname, error)
+
+
+def log_slow_queries(logger, threshold=None):
+    """
+    一定時間以上かかったクエリと失敗したクエリをログに記録するフックを登録する
+    """
+    if threshold is None:
+        threshold = get_settings().get('DB_SLOW_QUERY_MS') / 1000
+
+    def _hook(sql, elapsed, dbname, error):
+        statement = ' '.join(sql.split())[:200]
+        if error is not None:
+            logger.error(f"Query failed on {dbname} after {elapsed:.3f}s: {statement} ({error})")
+        elif elapsed >= threshold:
+            logger.warning(f"Slow query on {dbname} ({elapsed:.3f}s): {statement}")
+        else:
+            logger.debug(f"Query on {dbname} ({elapsed:.3f}s): {statement}")
+
+    add_query_hook(_hook)
+    return _hook
+
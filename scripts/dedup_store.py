@@ -0,0 +1,401 @@
+import os
+import json
+import hashlib
+import sqlite3
+import subprocess
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from datetime import datetime
+
+# 重複排除リポジトリの既定の配置先
+DEFAULT_REPO_DIR = Path('/backup/postgres/repo')
+
+# チャンク分割の設定
+# SQLダンプは行指向のため、行の内容のハッシュでチャンク境界を決める（コンテンツ定義チャンク）
+# 下位CHUNK_CUT_BITSビットが全て0の行の後で切るため、平均で2^CHUNK_CUT_BITS行ごとに境界ができる
+CHUNK_CUT_BITS = 12
+CHUNK_MIN_SIZE = 256 * 1024        # 256KB
+CHUNK_MAX_SIZE = 8 * 1024 * 1024   # 8MB
+# 1行として読み込む最大サイズ（巨大な行でメモリを使い切らないため）
+LINE_READ_LIMIT = 1024 * 1024      # 1MB
+
+# チャンク保存時のzlib圧縮レベル
+CHUNK_COMPRESS_LEVEL = 6
+
+
+def iter_chunks(stream, cut_bits=CHUNK_CUT_BITS, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE):
+    """
+    ストリームを内容に応じた境界でチャンクに分割する
+    境界は行の内容だけで決まるため、途中に挿入や削除があっても前後のチャンクは同じになる
+
+    Args:
+        stream: バイナリの読み込みストリーム
+        cut_bits (int): 境界判定に使うハッシュのビット数
+        min_size (int): チャンクの最小サイズ
+        max_size (int): チャンクの最大サイズ
+
+    Yields:
+        bytes: チャンクのデータ
+    """
+    mask = (1 << cut_bits) - 1
+    lines = []
+    size = 0
+    for line in iter(lambda: stream.readline(LINE_READ_LIMIT), b''):
+        lines.append(line)
+        size += len(line)
+        if size >= max_size or (size >= min_size and (zlib.crc32(line) & mask) == 0):
+            yield b''.join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b''.join(lines)
+
+
+def _open_index(repo_dir):
+    """
+    チャンクインデックス（SQLite）を開き、必要であればテーブルを作成する
+    """
+    repo_dir = Path(repo_dir)
+    (repo_dir / 'chunks').mkdir(parents=True, exist_ok=True)
+    (repo_dir / 'manifests').mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(repo_dir / 'index.db')
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    return conn
+
+
+def _chunk_path(repo_dir, chunk_hash):
+    return Path(repo_dir) / 'chunks' / chunk_hash[:2] / chunk_hash
+
+
+def _manifest_path(repo_dir, backup_type, name):
+    return Path(repo_dir) / 'manifests' / backup_type / f"{name}.json"
+
+
+def store_stream(repo_dir, stream, backup_type, name, logger, inspector=None):
+    """
+    ストリームをチャンクに分割し、未保存のチャンクだけをリポジトリに書き込む
+    全チャンクの書き込み後にマニフェストを保存し、参照カウントを更新する
+
+    Args:
+        repo_dir (Path): リポジトリのディレクトリ
+        stream: バイナリの読み込みストリーム
+        backup_type (str): バックアップタイプ ('daily', 'weekly', 'monthly')
+        name (str): バックアップ名
+        logger: ロガーインスタンス
+        inspector: 元データを受け取るfeed(data)メソッドを持つオブジェクト（行数の集計などに使う）
+
+    Returns:
+        dict: 統計情報
+            - raw_bytes: 元データのサイズ
+            - size: 新たに書き込んだチャンクの合計サイズ（圧縮後）
+            - chunks: チャンク数
+            - new_chunks: 新たに書き込んだチャンク数
+            - manifest: マニフェストのパス
+    """
+    conn = _open_index(repo_dir)
+    try:
+        hashes = []
+        raw_bytes = 0
+        new_bytes = 0
+        new_chunks = 0
+        # 同じバックアップ内で同じチャンクが出てきた場合に再書き込みしないため
+        seen = set()
+
+        for chunk in iter_chunks(stream):
+            chunk_hash = hashlib.sha256(chunk).hexdigest()
+            hashes.append(chunk_hash)
+            raw_bytes += len(chunk)
+            if inspector is not None:
+                inspector.feed(chunk)
+            if chunk_hash in seen:
+                continue
+            seen.add(chunk_hash)
+
+            if conn.execute("SELECT 1 FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone():
+                continue
+
+            # 一時ファイルに書き込んでからリネームし、途中で止まっても壊れたチャンクを残さない
+            path = _chunk_path(repo_dir, chunk_hash)
+            path.parent.mkdir(exist_ok=True)
+            data = zlib.compress(chunk, CHUNK_COMPRESS_LEVEL)
+            tmp_path = path.with_name(path.name + '.part')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+            conn.execute(
+                "INSERT INTO chunks (hash, size, stored_size, refcount) VALUES (?, ?, ?, 0)",
+                (chunk_hash, len(chunk), len(data))
+            )
+            new_bytes += len(data)
+            new_chunks += 1
+
+        # マニフェストを書き込む
+        manifest_path = _manifest_path(repo_dir, backup_type, name)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        manifest = {
+            'name': name,
+            'backup_type': backup_type,
+            'created_at': datetime.now().isoformat(),
+            'raw_bytes': raw_bytes,
+            'row_counts': inspector.row_counts if inspector is not None else {},
+            'chunks': hashes
+        }
+        tmp_manifest = manifest_path.with_name(manifest_path.name + '.part')
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+
+        # マニフェストの確定と参照カウントの加算を1つのトランザクションで行う
+        with conn:
+            conn.executemany("UPDATE chunks SET refcount = refcount + 1 WHERE hash = ?",
+                             [(h,) for h in hashes])
+            os.replace(tmp_manifest, manifest_path)
+
+        logger.info(f"Stored {name}: {len(hashes)} chunks ({new_chunks} new), "
+                    f"{raw_bytes} bytes -> {new_bytes} new bytes")
+        return {
+            'raw_bytes': raw_bytes,
+            'size': new_bytes,
+            'chunks': len(hashes),
+            'new_chunks': new_chunks,
+            'row_counts': manifest['row_counts'],
+            'manifest': manifest_path
+        }
+    finally:
+        conn.close()
+
+
+def store_command_output(repo_dir, cmd, env, backup_type, name, logger, inspector=None):
+    """
+    コマンドの標準出力をそのままリポジトリへ書き込む
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+    """
+    with tempfile.TemporaryFile() as stderr_file:
+        start_time = time.time()
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            stats = store_stream(repo_dir, proc.stdout, backup_type, name, logger, inspector)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdout.close()
+
+        _, status, child_usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.time() - start_time
+
+        if proc.returncode != 0:
+            stderr_file.seek(0)
+            stderr_text = stderr_file.read().decode('utf-8', errors='replace')
+            # 不完全なダンプのマニフェストは残さない（チャンクは次回のGCで回収される）
+            delete_backup(repo_dir, backup_type, name, logger)
+            return False, f"Command exited with status {proc.returncode}: {stderr_text}"
+
+    stats.update({
+        'path': stats['manifest'],
+        'elapsed': elapsed,
+        'throughput': stats['raw_bytes'] / elapsed if elapsed > 0 else 0,
+        'child_peak_rss': child_usage.ru_maxrss * 1024,
+    })
+    return True, stats
+
+
+def promote_backup(repo_dir, source_type, source_name, target_type, target_name, logger):
+    """
+    既存のバックアップのマニフェストを別のタイプへ複製する
+    チャンクは共有されるため、参照カウントを加算するだけでデータの書き込みは発生しない
+    同じバックアップから昇格済みの場合は何もしない。別のマニフェストが同じ名前で残っている場合は置き換える
+
+    Returns:
+        dict: 統計情報（昇格済みだった場合はexistingがTrue）
+    """
+    with open(_manifest_path(repo_dir, source_type, source_name), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    promoted_from = f"{source_type}/{source_name}"
+    manifest_path = _manifest_path(repo_dir, target_type, target_name)
+    previous_chunks = []
+    if manifest_path.exists():
+        with open(manifest_path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('promoted_from') == promoted_from:
+            logger.info(f"{target_type}/{target_name} is already promoted from {promoted_from}")
+            return {
+                'raw_bytes': previous['raw_bytes'],
+                'size': 0,
+                'chunks': len(previous['chunks']),
+                'new_chunks': 0,
+                'manifest': manifest_path,
+                'path': manifest_path,
+                'existing': True
+            }
+        previous_chunks = previous['chunks']
+
+    manifest.update({
+        'name': target_name,
+        'backup_type': target_type,
+        'promoted_from': promoted_from,
+        'promoted_at': datetime.now().isoformat()
+    })
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_manifest = manifest_path.with_name(manifest_path.name + '.part')
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    conn = _open_index(repo_dir)
+    try:
+        with conn:
+            # 置き換える古いマニフェストの参照を外してから、新しいマニフェストの参照を加える
+            conn.executemany("UPDATE chunks SET refcount = refcount - 1 WHERE hash = ?",
+                             [(h,) for h in previous_chunks])
+            conn.executemany("UPDATE chunks SET refcount = refcount + 1 WHERE hash = ?",
+                             [(h,) for h in manifest['chunks']])
+            os.replace(tmp_manifest, manifest_path)
+    finally:
+        conn.close()
+
+    logger.info(f"Promoted {promoted_from} to {target_type}/{target_name}")
+    return {
+        'raw_bytes': manifest['raw_bytes'],
+        'size': 0,
+        'chunks': len(manifest['chunks']),
+        'new_chunks': 0,
+        'manifest': manifest_path,
+        'path': manifest_path,
+        'existing': False
+    }
+
+
+def list_backups(repo_dir, backup_type):
+    """
+    指定タイプのバックアップ名を古い順に返す
+    """
+    manifest_dir = Path(repo_dir) / 'manifests' / backup_type
+    if not manifest_dir.exists():
+        return []
+    manifests = sorted(manifest_dir.glob('*.json'), key=lambda p: p.stat().st_mtime)
+    return [p.stem for p in manifests]
+
+
+def delete_backup(repo_dir, backup_type, name, logger):
+    """
+    マニフェストを削除し、参照していたチャンクの参照カウントを減らす
+    """
+    manifest_path = _manifest_path(repo_dir, backup_type, name)
+    if not manifest_path.exists():
+        return
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    conn = _open_index(repo_dir)
+    try:
+        with conn:
+            conn.executemany("UPDATE chunks SET refcount = refcount - 1 WHERE hash = ?",
+                             [(h,) for h in manifest['chunks']])
+            manifest_path.unlink()
+    finally:
+        conn.close()
+    logger.info(f"Removed manifest {backup_type}/{name}")
+
+
+def reclaimable_bytes(repo_dir, backups):
+    """
+    指定したバックアップを削除した場合に、ガベージコレクションで解放される見込みのバイト数を返す
+    （他のマニフェストからも参照されているチャンクは解放されないため数えない）
+
+    Args:
+        repo_dir (Path): 重複排除リポジトリのディレクトリ
+        backups (list): 削除する (backup_type, name) のリスト
+
+    Returns:
+        int: 解放される見込みのバイト数
+    """
+    released = {}
+    for backup_type, name in backups:
+        manifest_path = _manifest_path(repo_dir, backup_type, name)
+        if not manifest_path.exists():
+            continue
+        with open(manifest_path, encoding='utf-8') as f:
+            for chunk_hash in json.load(f)['chunks']:
+                released[chunk_hash] = released.get(chunk_hash, 0) + 1
+    if not released:
+        return 0
+
+    conn = _open_index(repo_dir)
+    try:
+        total = 0
+        for chunk_hash, count in released.items():
+            row = conn.execute("SELECT stored_size, refcount FROM chunks WHERE hash = ?", (chunk_hash,)).fetchone()
+            if row and row[1] - count <= 0:
+                total += row[0]
+        return total
+    finally:
+        conn.close()
+
+
+def collect_garbage(repo_dir, logger):
+    """
+    どのマニフェストからも参照されていないチャンクを削除する
+
+    Returns:
+        tuple: (削除したチャンク数, 解放したバイト数)
+    """
+    conn = _open_index(repo_dir)
+    removed = 0
+    freed = 0
+    try:
+        rows = conn.execute("SELECT hash, stored_size FROM chunks WHERE refcount <= 0").fetchall()
+        for chunk_hash, stored_size in rows:
+            _chunk_path(repo_dir, chunk_hash).unlink(missing_ok=True)
+            removed += 1
+            freed += stored_size
+        with conn:
+            conn.executemany("DELETE FROM chunks WHERE hash = ? AND refcount <= 0",
+                             [(h,) for h, _ in rows])
+    finally:
+        conn.close()
+    logger.info(f"Garbage collection removed {removed} chunk(s), freed {freed} bytes")
+    return removed, freed
+
+
+def read_backup_manifest(repo_dir, backup_type, name):
+    """
+    バックアップのマニフェストを読み込む
+    """
+    with open(_manifest_path(repo_dir, backup_type, name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def restore_backup(repo_dir, backup_type, name, fileobj):
+    """
+    マニフェストの順にチャンクを展開してfileobjへ書き出す
+
+    Returns:
+        int: 書き出したバイト数
+    """
+    with open(_manifest_path(repo_dir, backup_type, name), encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    written = 0
+    for chunk_hash in manifest['chunks']:
+        with open(_chunk_path(repo_dir, chunk_hash), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise ValueError(f"Chunk {chunk_hash} is corrupted")
+        fileobj.write(data)
+        written += len(data)
+    return written
@@ -1,66 +1,359 @@
-from pathlib import Path  # このインポートが正しく機能しているか確認
-import dotenv
+from pathlib import Path
 import os
+import re
+import threading
+import dotenv
 
 from custom_logging import setup_logger
+import compression
 
+# .envを探すパス（先に見つかったものを使う）
+ENV_PATHS = [
+    Path('/scripts/.env'),              # Dockerコンテナのルート
+    Path('/home/web/mensis/.env'),      # プロジェクトのルート
+    Path(__file__).parent.parent / '.env'  # スクリプトからの相対パス
+]
 
-def load_env():
-    logger = setup_logger(name='load_env')
-    
-    # 複数の可能性のあるパスをチェック
-    possible_paths = [
-        Path('/scripts/.env'),              # Dockerコンテナのルート
-        Path('/home/web/mensis/.env'),      # プロジェクトのルート
-        Path(__file__).parent.parent / '.env'  # スクリプトからの相対パス
-    ]
-    
-    env_path = None
-    for path in possible_paths:
+# 必須の環境変数
+REQUIRED_VARS = ['POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB', 'POSTGRES_HOST', 'POSTGRES_PORT']
+
+
+def _bool(value):
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"expected True or False, got {value!r}")
+
+
+def _time(value):
+    # scheduleの.at()に渡す HH:MM 形式
+    if not re.fullmatch(r'([01]\d|2[0-3]):[0-5]\d', value.strip()):
+        raise ValueError(f"expected HH:MM, got {value!r}")
+    return value.strip()
+
+
+def _choice(*options):
+    def _parse(value):
+        if value not in options:
+            raise ValueError(f"expected one of {', '.join(options)}, got {value!r}")
+        return value
+    return _parse
+
+
+def _codec(value):
+    # 圧縮方式は夜間のバックアップの途中ではなく、読み込み時に確認する
+    _choice(*compression.CODECS)(value)
+    if value == 'zstd' and compression.zstandard is None:
+        raise ValueError("zstd requires the zstandard package (pip install zstandard)")
+    return value
+
+
+def _interval(*options):
+    # everydayは以前のexample.envに既定値として書かれていた表記のため、everyと同じ意味で受け付ける
+    parse = _choice('every', 'everyday', *options)
+
+    def _parse(value):
+        value = parse(value)
+        return 'every' if value == 'everyday' else value
+    return _parse
+
+
+# タスクごとに指定できる実行頻度
+_RUN_FREQUENCY = _choice('everyday', 'everyweek', 'everymonth')
+_WEEKLY_FREQUENCY = _choice('everyday', 'everyweek')
+_DAY_INTERVAL = _interval('every_second', 'every_third')
+_BACKUP_FREQUENCY = {
+    'DAILY': _DAY_INTERVAL,
+    'WEEKLY': _interval('every_second'),
+    'MONTHLY': _interval('every_second'),
+}
+
+
+# 設定の一覧（キー: (変換する関数, 既定値)）
+# 既定値がNoneのフラグは、未設定の場合にタスク側でエラーとして通知する
+SETTINGS_SCHEMA = {
+    # PostgreSQL
+    'POSTGRES_USER': (str, None),
+    'POSTGRES_PASSWORD': (str, None),
+    'POSTGRES_DB': (str, None),
+    'POSTGRES_HOST': (str, None),
+    'POSTGRES_PORT': (str, None),
+    'POSTGRES_REPLICA': (_bool, False),
+    'POSTGRES_REPLICA_USER': (str, None),
+    'POSTGRES_REPLICA_PASSWORD': (str, None),
+    'POSTGRES_REPLICA_DB': (str, None),
+    'POSTGRES_REPLICA_HOST': (str, None),
+    'POSTGRES_REPLICA_PORT': (str, None),
+    'POSTGRES_REPLICA_MAX_LAG_SECONDS': (int, 300),
+    'DB_POOL_SIZE': (int, 4),
+    'DB_STATEMENT_TIMEOUT_MS': (int, 300000),
+    'DB_LOCK_TIMEOUT_MS': (int, 30000),
+    'DB_SLOW_QUERY_MS': (float, 1000),
+
+    # スケジュールと通知
+    'MAINTENANCE_PIPELINE': (_bool, True),
+    'MAINTENANCE_START_TIME': (_time, '02:00'),
+    'MAINTENANCE_WINDOW_HOURS': (float, 6),
+    'MAINTENANCE_WORKERS': (int, 3),
+    'MAINTENANCE_REPORT': (_bool, None),
+    'MAINTENANCE_ANNOUNCEMENT': (_bool, None),
+    'TASK_REGRESSION_FACTOR': (float, 1.5),
+    'TASK_REGRESSION_MIN_SAMPLES': (int, 5),
+    'METRICS': (_bool, True),
+    'METRICS_PORT': (int, 5000),
+    'LOG_FORMAT': (_choice('text', 'json'), 'text'),
+    'LOG_LEVEL': (lambda value: _choice('DEBUG', 'INFO', 'WARNING', 'ERROR')(value.upper()), 'INFO'),
+
+    # pg_repack
+    'PG_REPACK': (_bool, None),
+    'PG_REPACK_FREQUENCY': (_RUN_FREQUENCY, None),
+    'PG_REPACK_MODE': (_choice('targeted', 'all'), 'targeted'),
+    'PG_REPACK_MIN_BLOAT_MB': (float, 100),
+    'PG_REPACK_MIN_BLOAT_PERCENT': (float, 20),
+    'PG_REPACK_TIME_BUDGET_MIN': (float, None),
+    'PG_REPACK_MAX_JOBS': (int, None),
+
+    # 負荷に応じたメンテナンスの抑制
+    'LOAD_GOVERNOR': (_bool, True),
+    'LOAD_GOVERNOR_INTERVAL': (float, 15),
+    'LOAD_THROTTLE_ACTIVE_SESSIONS': (int, 20),
+    'LOAD_THROTTLE_LOCK_WAITS': (int, 5),
+    'LOAD_THROTTLE_REPLICATION_LAG': (float, 60),
+    'LOAD_THROTTLE_CPU_PERCENT': (float, 85),
+    'LOAD_THROTTLE_IO_PRESSURE': (float, 30),
+    'LOAD_PAUSE_FACTOR': (float, 2),
+    'LOAD_MAX_PAUSE_SECONDS': (float, 600),
+    'LOAD_DEFER_WAIT_SECONDS': (float, 600),
+
+    # PGroonga
+    'PG_PGROONGA_REINDEX': (_bool, None),
+    'PG_PGROONGA_REINDEX_FREQUENCY': (_RUN_FREQUENCY, None),
+    'PG_PGROONGA_REINDEX_MODE': (_choice('swap', 'concurrently', 'recreate'), 'swap'),
+    'PG_PGROONGA_HEALTH_CHECK': (_bool, True),
+    'PG_PGROONGA_MAX_DEAD_PERCENT': (float, 20),
+    'PG_PGROONGA_MAX_GROWTH_PERCENT': (float, 30),
+    'PG_PGROONGA_MAX_AGE_DAYS': (int, 30),
+
+    # 論理バックアップ
+    'PG_BACKUP_ENGINE': (_choice('dumpall', 'directory', 'dedup'), 'dumpall'),
+    'PG_BACKUP_JOBS': (int, None),
+    'PG_BACKUP_PROMOTE': (_bool, True),
+    'PG_BACKUP_PREFLIGHT_MARGIN': (float, 1.2),
+    'PG_BACKUP_PREFLIGHT_RESERVE_PERCENT': (float, 5),
+    'PG_BACKUP_CODEC': (_codec, None),
+    'PG_BACKUP_COMPRESS_LEVEL': (int, None),
+    'PG_BACKUP_COMPRESS_THREADS': (int, None),
+    'PG_BACKUP_VERIFY': (_bool, None),
+    'PG_BACKUP_VERIFY_FREQUENCY': (_WEEKLY_FREQUENCY, None),
+    'PG_BACKUP_VERIFY_TYPE': (_choice('daily', 'weekly', 'monthly'), 'daily'),
+    'PG_BACKUP_VERIFY_TIME': (_time, '07:30'),
+    'COMPRESSION_BENCHMARK_SAMPLE': (str, None),
+    'COMPRESSION_BENCHMARK_SAMPLE_MB': (int, 64),
+
+    # 物理バックアップとWAL
+    'PG_BASEBACKUP': (_bool, None),
+    'PG_BASEBACKUP_FREQUENCY': (_WEEKLY_FREQUENCY, None),
+    'PG_BASEBACKUP_TIME': (_time, '06:30'),
+    'PG_BASEBACKUP_GENERATION': (int, 2),
+    'PG_WAL_ARCHIVE': (_bool, False),
+    'PG_WAL_SLOT': (str, 'mensis'),
+
+    # S3互換ストレージへのアップロード
+    'BACKUP_S3': (_bool, False),
+    'BACKUP_S3_ENDPOINT': (str, None),
+    'BACKUP_S3_ACCESS_KEY': (str, None),
+    'BACKUP_S3_SECRET_KEY': (str, None),
+    'BACKUP_S3_BUCKET': (str, None),
+    'BACKUP_S3_PREFIX': (str, 'mensis'),
+    'BACKUP_S3_PART_SIZE_MB': (int, 64),
+    'BACKUP_S3_CONCURRENCY': (int, None),
+    'BACKUP_S3_REGION': (str, None),
+
+    # Redis
+    'REDIS_HOST': (str, 'localhost'),
+    'REDIS_PORT': (str, '6379'),
+    'REDIS_PASSWORD': (str, None),
+    'REDIS_BACKUP': (_bool, None),
+    'REDIS_BACKUP_TIME': (_time, '03:30'),
+    'REDIS_BACKUP_BGSAVE': (_bool, True),
+    'REDIS_BGSAVE_TIMEOUT': (int, 600),
+    'REDIS_FORK_WARN_MS': (float, 500),
+    'REDIS_BACKUP_GENERATION': (int, 7),
+
+    # MinIO
+    'MINIO_HOST': (str, None),
+    'MINIO_PORT': (str, None),
+    'MINIO_ACCESS_KEY': (str, None),
+    'MINIO_SECRET_KEY': (str, None),
+    'MINIO_BUCKET': (str, None),
+    'MINIO_BACKUP': (_bool, None),
+    'MINIO_BACKUP_FREQUENCY': (_DAY_INTERVAL, 'every'),
+    'MINIO_BACKUP_TIME': (_time, '07:00'),
+    'MINIO_BACKUP_WORKERS': (int, 8),
+    'MINIO_BACKUP_GENERATION': (int, 12),
+
+    # Misskey
+    'MISSKEY_HOST': (str, None),
+    'MISSKEY_NOTICE_USER_ID': (str, None),
+    'MISSKEY_NOTICE_USER_TOKEN': (str, None),
+    'MISSKEY_TEARGET_USER_ID': (str, None),
+    'MISSKEY_NOTICE_COALESCE_SECONDS': (float, 5),
+}
+
+# バックアップ種別ごとの設定（PG_BACKUP_DAILY_CODEC など）
+for _type in ('DAILY', 'WEEKLY', 'MONTHLY'):
+    SETTINGS_SCHEMA.update({
+        f'PG_BACKUP_{_type}': (_bool, None),
+        f'PG_BACKUP_{_type}_FREQUENCY': (_BACKUP_FREQUENCY[_type], None),
+        f'PG_BACKUP_{_type}_GENERATION': (int, None),
+    })
+for _type in ('DAILY', 'WEEKLY', 'MONTHLY', 'BASEBACKUP', 'REDIS'):
+    SETTINGS_SCHEMA.update({
+        f'PG_BACKUP_{_type}_CODEC': (_codec, None),
+        f'PG_BACKUP_{_type}_COMPRESS_LEVEL': (int, None),
+        f'PG_BACKUP_{_type}_COMPRESS_THREADS': (int, None),
+    })
+
+
+class Settings:
+    """
+    .envから読み込んで型を変換した設定
+    値は読み込み時にまとめて検証するため、タスクの途中で変換に失敗することはない
+
+    Args:
+        path (Path): 読み込んだ.envのパス
+        mtime (float): 読み込んだ時点の.envの更新時刻
+        values (dict): キーごとの変換済みの値（未設定のキーは既定値）
+    """
+
+    def __init__(self, path, mtime, values):
+        self.path = path
+        self.mtime = mtime
+        self._values = values
+
+    def get(self, key, default=None):
+        """
+        設定値を返す。未設定で既定値もない場合はdefault
+        SETTINGS_SCHEMAにないキーはKeyError（綴りの間違いを見逃さないため）
+        """
+        value = self._values[key]
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def connection_info(self):
+        """
+        PostgreSQLの接続情報（従来のload_envの戻り値と同じ形式）
+        """
+        config = {var.lower().replace('postgres_', ''): self._values[var] for var in REQUIRED_VARS}
+        # レプリカ設定（オプション）
+        config.update({
+            'replica_enabled': self._values['POSTGRES_REPLICA'],
+            'replica_user': self._values['POSTGRES_REPLICA_USER'],
+            'replica_password': self._values['POSTGRES_REPLICA_PASSWORD'],
+            'replica_db': self._values['POSTGRES_REPLICA_DB'],
+            'replica_host': self._values['POSTGRES_REPLICA_HOST'],
+            'replica_port': self._values['POSTGRES_REPLICA_PORT']
+        })
+        return config
+
+
+# 起動時の環境変数（docker-composeなどで渡された値は.envより優先する）
+_BASE_ENVIRON = dict(os.environ)
+_SETTINGS = None
+_SETTINGS_LOCK = threading.Lock()
+
+
+def _find_env_path():
+    for path in ENV_PATHS:
         if path.exists():
-            env_path = path
-            logger.info(f"Found .env file at: {env_path}")
-            break
-    
-    if (env_path is None):
-        error_msg = (
-            "Could not find .env file. Searched in:\n" + 
-            "\n".join(f"- {p}" for p in possible_paths)
-        )
-        logger.error(error_msg)
-        raise FileNotFoundError(error_msg)
-    
-    # .envファイルをロード
-    dotenv.load_dotenv(env_path)
-    
-    # 必須の環境変数
-    required_vars = ['POSTGRES_USER', 'POSTGRES_PASSWORD', 'POSTGRES_DB', 
-                    'POSTGRES_HOST', 'POSTGRES_PORT']
-    
-    # 環境変数の値を取得し、未設定のものがないかチェック
-    config = {}
-    missing_vars = []
-    
-    for var in required_vars:
-        value = os.getenv(var)
-        if value is None:
-            missing_vars.append(var)
-        config[var.lower().replace('postgres_', '')] = value
-    
+            return path
+    return None
+
+
+def parse_settings(env_path, logger):
+    """
+    .envを読み込み、すべての設定を変換・検証する
+
+    Returns:
+        Settings: 読み込んだ設定
+
+    Raises:
+        ValueError: 必須の設定がない場合や、値が変換できない場合
+    """
+    mtime = env_path.stat().st_mtime
+    file_values = {k: v for k, v in dotenv.dotenv_values(env_path).items() if v is not None}
+    raw = {**file_values, **_BASE_ENVIRON}
+
+    values, errors = {}, []
+    for key, (parse, default) in SETTINGS_SCHEMA.items():
+        value = raw.get(key)
+        if value is None or value.strip() == '':
+            values[key] = default
+            continue
+        try:
+            values[key] = parse(value.strip())
+        except ValueError as e:
+            errors.append(f"{key}: {e}")
+
+    missing_vars = [var for var in REQUIRED_VARS if values[var] is None]
     if missing_vars:
-        error_msg = f"Missing required environment variables: {', '.join(missing_vars)}"
+        errors.append(f"Missing required environment variables: {', '.join(missing_vars)}")
+    if errors:
+        error_msg = f"Invalid settings in {env_path}:\n" + "\n".join(f"- {e}" for e in errors)
         logger.error(error_msg)
         raise ValueError(error_msg)
-    
-    # レプリカ設定（オプション）
-    config.update({
-        'replica_enabled': os.getenv('POSTGRES_REPLICA', 'false').lower() == 'true',
-        'replica_user': os.getenv('POSTGRES_REPLICA_USER'),
-        'replica_password': os.getenv('POSTGRES_REPLICA_PASSWORD'),
-        'replica_db': os.getenv('POSTGRES_REPLICA_DB'),
-        'replica_host': os.getenv('POSTGRES_REPLICA_HOST'),
-        'replica_port': os.getenv('POSTGRES_REPLICA_PORT')
-    })
-    
-    logger.info("Environment variables loaded successfully")
-    return config
\ No newline at end of file
+
+    # 子プロセス（pg_dumpなど）やライブラリからも同じ値が見えるようにする
+    os.environ.update({k: v for k, v in file_values.items() if k not in _BASE_ENVIRON})
+    logger.info(f"Loaded settings from {env_path}")
+    return Settings(env_path, mtime, values)
+
+
+def get_settings():
+    """
+    設定を返す。初回に.envを読み込み、以降は.envの更新時刻が変わった場合のみ読み直す
+    読み直した内容が不正な場合は、エラーを記録して前回の設定を使い続ける
+
+    Returns:
+        Settings: 現在の設定
+    """
+    global _SETTINGS
+    with _SETTINGS_LOCK:
+        env_path = _find_env_path() if _SETTINGS is None else _SETTINGS.path
+        if env_path is None:
+            error_msg = (
+                "Could not find .env file. Searched in:\n" +
+                "\n".join(f"- {p}" for p in ENV_PATHS)
+            )
+            setup_logger(name='load_env').error(error_msg)
+            raise FileNotFoundError(error_msg)
+
+        if _SETTINGS is None:
+            _SETTINGS = parse_settings(env_path, setup_logger(name='load_env'))
+            return _SETTINGS
+
+        try:
+            mtime = env_path.stat().st_mtime
+        except OSError:
+            # 編集中などで一時的に見えない場合は前回の設定を使う
+            return _SETTINGS
+        if mtime != _SETTINGS.mtime:
+            logger = setup_logger(name='load_env')
+            try:
+                _SETTINGS = parse_settings(env_path, logger)
+                logger.info(".env has changed. Settings were reloaded.")
+            except ValueError:
+                logger.error("Keeping the previous settings because the updated .env is invalid")
+                _SETTINGS.mtime = mtime
+        return _SETTINGS
+
+
+def load_env():
+    """
+    PostgreSQLの接続情報を返す（設定はget_settingsで一度だけ読み込む）
+    """
+    return get_settings().connection_info()
@@ -0,0 +1,308 @@
+import threading
+import time
+from pathlib import Path
+import psutil
+from db import query
+from load_env import get_settings
+
+# 負荷の段階
+NORMAL = 'normal'
+THROTTLE = 'throttle'
+PAUSE = 'pause'
+_LEVELS = [NORMAL, THROTTLE, PAUSE]
+
+# 指標ごとの抑制を始めるしきい値の既定値（一時停止はこの値のpause_factor倍）
+DEFAULT_THRESHOLDS = {
+    'active_sessions': 20,      # Misskeyからの実行中のクエリ数
+    'lock_waits': 5,            # ロック待ちのセッション数
+    'replication_lag': 60,      # レプリカの再生の遅れ（秒）
+    'cpu_percent': 85,          # ホストのCPU使用率（%）
+    'io_pressure': 30,          # I/O待ちで止まっていた時間の割合（%、PSIのsome avg10）
+}
+# 百分率の指標（一時停止のしきい値を100で頭打ちにする）
+_PERCENT_METRICS = ('cpu_percent', 'io_pressure')
+# 自分自身のセッションとして数えないapplication_name
+OWN_APPLICATIONS = ('mensis', 'pg_dump', 'pg_dumpall', 'pg_repack', 'pg_basebackup', 'pg_receivewal')
+# 負荷が下がってから段階を戻すまでに必要な連続したサンプル数（頻繁に切り替わらないようにする）
+CALM_SAMPLES = 2
+
+_ACTIVITY_SQL = """
+SELECT count(*) FILTER (WHERE state = 'active' AND backend_type = 'client backend'
+                          AND NOT (application_name = ANY(%s)) AND pid <> pg_backend_pid()),
+       count(*) FILTER (WHERE wait_event_type = 'Lock')
+FROM pg_stat_activity
+"""
+_REPLICATION_LAG_SQL = """
+SELECT COALESCE(max(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication
+"""
+
+
+def _io_pressure():
+    # PSIが使えない環境ではCPUのiowaitの割合で代用する
+    try:
+        line = Path('/proc/pressure/io').read_text().splitlines()[0]
+        return float(dict(field.split('=') for field in line.split()[1:])['avg10'])
+    except (OSError, ValueError, KeyError, IndexError):
+        return getattr(psutil.cpu_times_percent(interval=None), 'iowait', 0.0)
+
+
+def sample_load(connection_info):
+    """
+    Postgresとホストの負荷を1回計測する
+
+    Returns:
+        dict: active_sessions, lock_waits, replication_lag, cpu_percent, io_pressure
+            Postgresに問い合わせられなかった指標はNone
+    """
+    sample = {'cpu_percent': psutil.cpu_percent(interval=None), 'io_pressure': _io_pressure()}
+    try:
+        active, lock_waits = query(connection_info, _ACTIVITY_SQL, (list(OWN_APPLICATIONS),), timeout=10)[0]
+        lag = query(connection_info, _REPLICATION_LAG_SQL, timeout=10)[0][0]
+        sample.update({'active_sessions': active, 'lock_waits': lock_waits, 'replication_lag': float(lag)})
+    except Exception:
+        sample.update({'active_sessions': None, 'lock_waits': None, 'replication_lag': None})
+    return sample
+
+
+def _process_tree(pid):
+    try:
+        process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+class LoadGovernor:
+    """
+    重いメンテナンス処理の実行中に負荷を監視し、Misskey本体の応答を優先するように処理を抑える
+    - throttle: 処理中のコマンドの優先度を下げる（nice 19, ionice idle）
+    - pause: 一時停止できるコマンド（pg_dumpなど）を止め、負荷が下がったら再開する
+    - 次の対象を始める前に負荷が下がるのを待つ（wait_for_calm）
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+        thresholds (dict): 指標ごとの抑制を始めるしきい値。Noneの場合はDEFAULT_THRESHOLDS
+        pause_factor (float): 一時停止するしきい値の倍率
+        interval (float): 計測の間隔（秒）
+        max_pause (float): 1つのコマンドを一時停止してよい合計時間（秒）
+            pg_dumpを長く止めるとスナップショットが古いまま残り、テーブルの肥大化を招くため上限を設ける
+    """
+
+    def __init__(self, connection_info, logger, thresholds=None, pause_factor=2, interval=15, max_pause=600):
+        self.connection_info = connection_info
+        self.logger = logger
+        self.thresholds = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+        self.pause_factor = pause_factor
+        self.interval = interval
+        self.max_pause = max_pause
+        self.level = NORMAL
+        self.last_sample = None
+        self._calm_count = 0
+        self._lock = threading.Lock()
+        # 監視中のコマンド（pid: {'pausable', 'paused_at', 'paused_total', 'niced'}）
+        self._processes = {}
+        # 監視用のスレッドとその停止の合図（スレッドごとに作り直す）
+        self._monitor = None
+        self._stop = None
+
+    def _pause_threshold(self, metric):
+        threshold = self.thresholds[metric] * self.pause_factor
+        return min(threshold, 100) if metric in _PERCENT_METRICS else threshold
+
+    def assess(self, sample):
+        """
+        計測した値から負荷の段階を判断する
+
+        Returns:
+            tuple: (段階, しきい値を超えた指標の説明のリスト)
+        """
+        level, reasons = NORMAL, []
+        for metric, threshold in self.thresholds.items():
+            value = sample.get(metric)
+            if value is None or threshold is None:
+                continue
+            if value >= self._pause_threshold(metric):
+                level = PAUSE
+                reasons.append(f"{metric}={value:g}>={self._pause_threshold(metric):g}")
+            elif value >= threshold:
+                level = max(level, THROTTLE, key=_LEVELS.index)
+                reasons.append(f"{metric}={value:g}>={threshold:g}")
+        return level, reasons
+
+    def update(self):
+        """
+        負荷を計測して段階を更新し、監視中のコマンドに反映する
+
+        Returns:
+            str: 現在の段階
+        """
+        sample = sample_load(self.connection_info)
+        level, reasons = self.assess(sample)
+        with self._lock:
+            self.last_sample = sample
+            if _LEVELS.index(level) >= _LEVELS.index(self.level):
+                self._calm_count = 0
+                changed = level != self.level
+            else:
+                # 負荷が下がった場合は、続けて下がっているときだけ段階を戻す
+                self._calm_count += 1
+                changed = self._calm_count >= CALM_SAMPLES
+            if changed:
+                self.logger.info(f"Load level changed: {self.level} -> {level} "
+                                 f"({', '.join(reasons) or 'all metrics below thresholds'}; sample={sample})")
+                self.level = level
+                self._calm_count = 0
+            self._apply()
+        return self.level
+
+    def _apply(self):
+        now = time.time()
+        for pid, state in list(self._processes.items()):
+            tree = _process_tree(pid)
+            if not tree:
+                continue
+            if self.level != NORMAL and not state['niced']:
+                self._set_priority(tree, 19, psutil.IOPRIO_CLASS_IDLE)
+                state['niced'] = True
+                self.logger.info(f"Throttling pid {pid} ({len(tree)} process(es)): nice 19, ionice idle")
+            elif self.level == NORMAL and state['niced']:
+                self._set_priority(tree, 0, psutil.IOPRIO_CLASS_BE)
+                state['niced'] = False
+                self.logger.info(f"Restoring priority of pid {pid}")
+
+            if state['paused_at'] is not None:
+                paused_for = now - state['paused_at']
+                if self.level != PAUSE or state['paused_total'] + paused_for >= self.max_pause:
+                    self._resume(pid, tree, state, now)
+            elif self.level == PAUSE and state['pausable'] and state['paused_total'] < self.max_pause:
+                for process in tree:
+                    try:
+                        process.suspend()
+                    except psutil.Error:
+                        pass
+                state['paused_at'] = now
+                self.logger.warning(f"Pausing pid {pid} ({len(tree)} process(es)) until the load drops "
+                                    f"(paused {state['paused_total']:.0f}s of {self.max_pause:.0f}s so far)")
+
+    def _resume(self, pid, tree, state, now):
+        for process in tree:
+            try:
+                process.resume()
+            except psutil.Error:
+                pass
+        state['paused_total'] += now - state['paused_at']
+        state['paused_at'] = None
+        if state['paused_total'] >= self.max_pause:
+            self.logger.warning(f"Resuming pid {pid}: pause limit of {self.max_pause:.0f}s reached")
+        else:
+            self.logger.info(f"Resuming pid {pid} (paused {state['paused_total']:.0f}s in total)")
+
+    def _set_priority(self, tree, nice, ioclass):
+        for process in tree:
+            try:
+                process.nice(nice)
+                process.ionice(ioclass)
+            except psutil.Error as e:
+                # 優先度を上げ直すには権限が必要な場合がある
+                self.logger.debug(f"Could not change priority of pid {process.pid}: {e}")
+
+    def _run_monitor(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                self.update()
+            except Exception as e:
+                self.logger.error(f"Failed to sample load: {str(e)}")
+
+    def attach(self, pid, pausable=False):
+        """
+        コマンドを監視の対象にする。監視用のスレッドがなければ起動する
+
+        Args:
+            pid (int): コマンドのプロセスID（子プロセスもまとめて扱う）
+            pausable (bool): 一時停止してよいかどうか
+                ロックを持ったまま止まる可能性があるコマンド（pg_repackなど）はFalseにする
+        """
+        with self._lock:
+            self._processes[pid] = {'pausable': pausable, 'paused_at': None, 'paused_total': 0.0, 'niced': False}
+            if self._monitor is None:
+                # 停止を合図したスレッドは終了処理中の可能性があるため使い回さず、新しいスレッドを起動する
+                self._stop = threading.Event()
+                self._monitor = threading.Thread(target=self._run_monitor, args=(self._stop,),
+                                                 name='load-governor', daemon=True)
+                self._monitor.start()
+        # 開始時点の負荷をすぐに反映する
+        try:
+            self.update()
+        except Exception as e:
+            self.logger.error(f"Failed to sample load: {str(e)}")
+
+    def detach(self, pid):
+        """
+        コマンドを監視の対象から外す（一時停止していれば再開する）。対象がなくなれば監視を止める
+
+        Returns:
+            float: コマンドを一時停止していた合計時間（秒）
+        """
+        with self._lock:
+            state = self._processes.pop(pid, None)
+            if state is not None and state['paused_at'] is not None:
+                self._resume(pid, _process_tree(pid), state, time.time())
+            if not self._processes and self._monitor is not None:
+                self._stop.set()
+                self._monitor = None
+        return state['paused_total'] if state else 0.0
+
+    def wait_for_calm(self, max_wait, what='next step'):
+        """
+        負荷が通常の段階に戻るまで待つ（次のテーブルの再編成を始める前などに呼ぶ）
+
+        Args:
+            max_wait (float): 待つ最大時間（秒）
+            what (str): ログに残す待っている処理の説明
+
+        Returns:
+            bool: 負荷が通常の段階に戻ったかどうか（Falseの場合は時間切れ）
+        """
+        deadline = time.time() + max_wait
+        waited = False
+        while True:
+            try:
+                level = self.update()
+            except Exception as e:
+                # 計測できない場合は処理を止めない
+                self.logger.error(f"Failed to sample load: {str(e)}")
+                return True
+            if level == NORMAL:
+                if waited:
+                    self.logger.info(f"Load is back to normal. Starting {what}")
+                return True
+            if time.time() >= deadline:
+                self.logger.warning(f"Load stayed at {level} for {max_wait:.0f}s. Giving up waiting for {what}")
+                return False
+            if not waited:
+                self.logger.info(f"Load is {level}. Holding {what} for up to {max_wait:.0f}s")
+                waited = True
+            time.sleep(min(self.interval, max(0, deadline - time.time())))
+
+
+def governor_from_settings(connection_info, logger):
+    """
+    .envのLOAD_GOVERNOR_*から負荷の監視を作成する。LOAD_GOVERNORがFalseの場合はNone
+    """
+    settings = get_settings()
+    if not settings.get('LOAD_GOVERNOR'):
+        return None
+    return LoadGovernor(
+        connection_info, logger,
+        thresholds={
+            'active_sessions': settings.get('LOAD_THROTTLE_ACTIVE_SESSIONS'),
+            'lock_waits': settings.get('LOAD_THROTTLE_LOCK_WAITS'),
+            'replication_lag': settings.get('LOAD_THROTTLE_REPLICATION_LAG'),
+            'cpu_percent': settings.get('LOAD_THROTTLE_CPU_PERCENT'),
+            'io_pressure': settings.get('LOAD_THROTTLE_IO_PRESSURE'),
+        },
+        pause_factor=settings.get('LOAD_PAUSE_FACTOR'),
+        interval=settings.get('LOAD_GOVERNOR_INTERVAL'),
+        max_pause=settings.get('LOAD_MAX_PAUSE_SECONDS')
+    )
@@ -1,13 +1,28 @@
 import schedule
 import time
 import argparse
-import dotenv
 from datetime import datetime, timedelta
-from custom_logging import setup_logger
-from postgres import check_postgres_connection as check_pg_conn, manual_backup_postgres as manual_backup_pg, pgroonga_reindex as pgroonga_kensaku_reindex, auto_backup_postgres as auto_backup_pg, pg_repack_all_db as pg_repack_db
-from load_env import load_env
-from notice import sendDM_misskey_notification, post_misskey_notification
+from custom_logging import setup_logger, configure_logging, task_context
+from postgres import check_postgres_connection as check_pg_conn, manual_backup_postgres as manual_backup_pg, pgroonga_reindex as pgroonga_kensaku_reindex, auto_backup_postgres as auto_backup_pg, auto_backup_postgres_parallel as auto_backup_pg_parallel, auto_backup_postgres_dedup as auto_backup_pg_dedup, promote_daily_backup as promote_daily_pg, promotion_copy_size, get_database_size, get_retention_count, prune_before_backup as prune_before_pg_backup, pg_repack_all_db as pg_repack_db, pgroonga_index_health, decide_pgroonga_rebuild
+from load_env import load_env, get_settings
+from notice import sendDM_misskey_notification, post_misskey_notification, flush_notifications
 from system_check import get_disk_usage, format_bytes
+from compression import benchmark_codecs, read_sample, backup_extensions
+from backup_verify import verify_backup as verify_pg_backup
+from dedup_store import DEFAULT_REPO_DIR, list_backups as list_dedup_backups, read_backup_manifest, restore_backup as restore_dedup_backup
+from pg_physical import base_backup as pg_base_backup, prune_base_backups, start_wal_receiver, restore_to_timestamp
+from backup_catalog import list_backups as list_catalog_backups, record_prediction, slowest_repack_targets, record_pgroonga_health, last_pgroonga_rebuild, pgroonga_bytes_saved
+from backup_preflight import plan_backup, prediction_error, BACKUP_ROOT
+from object_storage import S3Target
+from minio import backup_minio_bucket, prune_minio_generations
+from redis_backup import backup_redis, load_redis_env, prune_redis_backups, read_redis_backup_metrics
+from db import log_slow_queries, close_pools
+from pipeline import MaintenancePipeline, PipelineTask, DB_IO
+from task_history import record_task_run, latest_task_runs, detect_regression
+from metrics import start_metrics_server
+from load_governor import governor_from_settings
+from pg_replica import read_connection_info, PRIMARY, REPLICA
+from pathlib import Path
 import os
 
 TASK_RESULTS = {
@@ -15,17 +30,105 @@ TASK_RESULTS = {
     'auto_backup_daily': {'last_run': None, 'success': None, 'details': None},
     'auto_backup_weekly': {'last_run': None, 'success': None, 'details': None},
     'auto_backup_monthly': {'last_run': None, 'success': None, 'details': None},
-    'pgroonga_reindex': {'last_run': None, 'success': None, 'details': None}
+    'pgroonga_reindex': {'last_run': None, 'success': None, 'details': None},
+    'physical_backup': {'last_run': None, 'success': None, 'details': None},
+    'verify_backup': {'last_run': None, 'success': None, 'details': None},
+    'minio_backup': {'last_run': None, 'success': None, 'details': None},
+    'redis_backup': {'last_run': None, 'success': None, 'details': None}
 }
 
 
+# 日単位の間隔の指定（PG_BACKUP_DAILY_FREQUENCY, MINIO_BACKUP_FREQUENCY）と間隔の日数
+DAY_INTERVALS = {'every': 1, 'every_second': 2, 'every_third': 3}
+
+
+def is_interval_day(frequency, today=None):
+    """
+    日単位の間隔の指定に対して、今日が実行する日かどうかを返す
+    月末をまたいでも間隔がずれないよう、月の日付ではなく通算の日数(toordinal)で判定する
+
+    Args:
+        frequency (str): 'every', 'every_second', 'every_third'。Noneの場合は毎日
+        today (date): 判定する日。Noneの場合は今日
+    """
+    today = today or datetime.now().date()
+    return today.toordinal() % DAY_INTERVALS.get(frequency, 1) == 0
+
+
 # タスク結果を記録する関数
-def record_task_result(task_name, success, details=None):
-    """タスクの実行結果を記録する"""
+def record_task_result(task_name, success, details=None, skipped=False, start_time=None, bytes_processed=None,
+                       method=None):
+    """
+    タスクの実行結果を記録する（skippedは不要と判断して処理を省いた場合）
+    実行履歴にも保存し、同じ方法（method）の直近の中央値より大きく遅くなった場合は通知する
+    """
     if task_name in TASK_RESULTS:
         TASK_RESULTS[task_name]['last_run'] = datetime.now()
         TASK_RESULTS[task_name]['success'] = success
         TASK_RESULTS[task_name]['details'] = details
+        TASK_RESULTS[task_name]['skipped'] = skipped
+
+    logger = setup_logger(name='task_history')
+    status = 'skipped' if skipped else 'success' if success else 'failed'
+    try:
+        run = record_task_run(task_name, status,
+                              started_at=datetime.fromtimestamp(start_time) if start_time else None,
+                              bytes_processed=bytes_processed, details=details, method=method)
+        settings = get_settings()
+        regression = detect_regression(
+            run,
+            factor=settings.get('TASK_REGRESSION_FACTOR'),
+            min_samples=settings.get('TASK_REGRESSION_MIN_SAMPLES')
+        )
+    except Exception as e:
+        # 履歴の保存に失敗してもタスクの結果は変えない
+        logger.error(f"Failed to record task history for {task_name}: {str(e)}")
+        return
+    logger.info(f"Task {task_name} finished: {status}", extra={'duration': run['duration']})
+    if regression:
+        logger.warning(f"{task_name} is slower than usual: {regression}")
+        sendDM_misskey_notification(f"⚠️ {task_name} がいつもより遅くなっています。\n\n{regression}\nストレージの劣化やテーブルの肥大化がないか確認してください。")
+
+
+def load_task_results():
+    """
+    実行履歴から各タスクの最新の結果を読み込む（再起動してもレポートに前回の結果を出せるようにする）
+    """
+    try:
+        runs = latest_task_runs()
+    except Exception as e:
+        setup_logger(name='task_history').error(f"Failed to load task history: {str(e)}")
+        return
+    for task_name, run in runs.items():
+        if task_name in TASK_RESULTS:
+            TASK_RESULTS[task_name].update({
+                'last_run': datetime.fromisoformat(run['finished_at']),
+                'success': run['status'] != 'failed',
+                'details': run['details'],
+                'skipped': run['status'] == 'skipped',
+            })
+
+def get_compression_settings(backup_type=None):
+    """
+    環境変数から圧縮コーデックの設定を取得する
+    PG_BACKUP_DAILY_CODEC のようなバックアップ種別ごとの設定を PG_BACKUP_CODEC より優先する
+    """
+    settings = get_settings()
+    prefixes = [f'PG_BACKUP_{backup_type.upper()}_'] if backup_type else []
+    prefixes.append('PG_BACKUP_')
+
+    def get_setting(key):
+        for prefix in prefixes:
+            value = settings.get(f'{prefix}{key}')
+            if value is not None:
+                return value
+        return None
+
+    return {
+        'codec': get_setting('CODEC') or 'gzip',
+        'level': get_setting('COMPRESS_LEVEL'),
+        'threads': get_setting('COMPRESS_THREADS')
+    }
 
 def system_check():
     logger = setup_logger(name='system_check')
@@ -41,13 +144,13 @@ def system_check():
         logger.info(f"ディスク使用率が80%未満です。")
 
 def pg_repack_all_db():
-    dotenv.load_dotenv()
+    settings = get_settings()
     logger = setup_logger(name='pg_repack_all_db')
     task_name = 'pg_repack_all_db'
 
-    PG_REPACK = os.environ.get('PG_REPACK')
+    PG_REPACK = settings.get('PG_REPACK')
     
-    PG_REPACK_FREQUENCY = os.environ.get('PG_REPACK_FREQUENCY')
+    PG_REPACK_FREQUENCY = settings.get('PG_REPACK_FREQUENCY')
 
     if PG_REPACK_FREQUENCY == "everyweek":
         # Only run on Sunday (weekday 6)
@@ -61,19 +164,33 @@ def pg_repack_all_db():
             logger.info("PG_REPACK_FREQUENCY is set to everymonth, but today is not the first day of the month. Skipping.")
             ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
             return False
-    if not PG_REPACK:
+    if PG_REPACK is None:
         logger.error("PG_REPACK environment variable is not set")
         sendDM_misskey_notification("環境変数PG_REPACKが設定されていません。")
         record_task_result(task_name, False, "環境変数PG_REPACKが設定されていません。")
         return False
-    elif PG_REPACK == "True":
+    elif PG_REPACK:
         system_check() # メンテナンス前にディスク使用量をログに残しておく
 
         connection_info = load_env()
         
         start_time = time.time()  # 開始時間を記録
         
-        response = pg_repack_db(connection_info, logger)
+        # 肥大化のしきい値と時間の上限
+        time_budget_min = settings.get('PG_REPACK_TIME_BUDGET_MIN')
+
+        response, report = pg_repack_db(
+            connection_info, logger,
+            min_bloat_bytes=int(settings.get('PG_REPACK_MIN_BLOAT_MB') * 1024 * 1024),
+            min_bloat_ratio=settings.get('PG_REPACK_MIN_BLOAT_PERCENT') / 100,
+            time_budget=time_budget_min * 60 if time_budget_min else None,
+            max_jobs=settings.get('PG_REPACK_MAX_JOBS'),
+            mode=settings.get('PG_REPACK_MODE'),
+            governor=governor_from_settings(connection_info, logger),
+            defer_wait=settings.get('LOAD_DEFER_WAIT_SECONDS'),
+            # 肥大化の見積もり（統計情報・pgstattuple）はレプリカでも同じ結果になるため、使える場合はレプリカで行う
+            stats_connection_info=read_connection_info(connection_info, logger, 'bloat estimation')[0]
+        )
         
         end_time = time.time()  # 終了時間を記録
         elapsed_time = end_time - start_time  # 経過時間を計算
@@ -84,13 +201,34 @@ def pg_repack_all_db():
         time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
         # 現在の時間を取得してフォーマット
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # 対象ごとに実際に回収できた量をまとめる
+        repack_msg = ""
+        if report['mode'] == 'targeted':
+            repack_msg = f"\n\n見積もり: {report['method']}\n対象: {report['candidates']}件"
+            for item in report['repacked']:
+                status = format_bytes(item['reclaimed']) if item['success'] else "失敗"
+                repack_msg += f"\n- {item['name']}: {status} (見積もり {format_bytes(item['estimated'])}, {item['elapsed']:.0f}秒)"
+            if report['deferred']:
+                repack_msg += f"\n次回に持ち越し: {', '.join(report['deferred'])}"
+            repack_msg += f"\n回収した容量: {format_bytes(report['reclaimed'])}"
+        # 直近30日で時間のかかっている対象
+        slowest = slowest_repack_targets(days=30, limit=3)
+        if slowest:
+            repack_msg += "\n\n時間のかかっている対象(30日):"
+            for item in slowest:
+                repack_msg += f"\n- {item['name']}: 最長 {item['max_duration']:.0f}秒 / 前回 {item['last_duration']:.0f}秒"
+        details = f"処理時間: {time_str}"
+        repacked_bytes = sum(item['before'] for item in report['repacked']) or None
+        if report['mode'] == 'targeted':
+            details += f", {len(report['repacked'])}件, 回収 {format_bytes(report['reclaimed'])}"
+
         if response:
-            sendDM_misskey_notification(f"PostgreSQLのテーブルの再構築が完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}")
-            record_task_result(task_name, True, f"処理時間: {time_str}")
+            sendDM_misskey_notification(f"PostgreSQLのテーブルの再構築が完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}{repack_msg}")
+            record_task_result(task_name, True, details, start_time=start_time, bytes_processed=repacked_bytes)
             logger.info(f"テーブルの再構築完了 - 処理時間: {time_str}")
         else:
-            sendDM_misskey_notification(f"PostgreSQLのテーブルの再構築に失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}")
-            record_task_result(task_name, False, f"処理時間: {time_str}")
+            sendDM_misskey_notification(f"PostgreSQLのテーブルの再構築に失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}{repack_msg}")
+            record_task_result(task_name, False, details, start_time=start_time, bytes_processed=repacked_bytes)
             logger.error(f"テーブルの再構築失敗 - 処理時間: {time_str}")
     else:
         logger.info("PG_REPACK is set to false. Skipping pg_repack_all_db")
@@ -99,13 +237,13 @@ def pg_repack_all_db():
 
 
 def pgroonga_reindex():
-    dotenv.load_dotenv()  # この行を追加
+    settings = get_settings()
 
     logger = setup_logger(name='pgroonga_reindex')
     task_name = 'pgroonga_reindex'
 
-    PG_PGROONGA_REINDEX = os.environ.get('PG_PGROONGA_REINDEX')
-    PG_PGROONGA_REINDEX_FREQUENCY = os.environ.get('PG_PGROONGA_REINDEX_FREQUENCY')
+    PG_PGROONGA_REINDEX = settings.get('PG_PGROONGA_REINDEX')
+    PG_PGROONGA_REINDEX_FREQUENCY = settings.get('PG_PGROONGA_REINDEX_FREQUENCY')
 
     # Check if repack should run based on frequency setting
     if PG_PGROONGA_REINDEX_FREQUENCY == "everyweek":
@@ -121,19 +259,51 @@ def pgroonga_reindex():
             ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
             return False
 
-    if not PG_PGROONGA_REINDEX:
+    if PG_PGROONGA_REINDEX is None:
         logger.error("PG_PGROONGA_REINDEX environment variable is not set")
         sendDM_misskey_notification("環境変数PG_PGROONGA_REINDEXが設定されていません。")
         record_task_result(task_name, False, f"環境変数PG_PGROONGA_REINDEXが設定されていません。")
 
         return False
 
-    elif PG_PGROONGA_REINDEX == "True":
+    elif PG_PGROONGA_REINDEX:
         connection_info = load_env()
         
         start_time = time.time()  # 開始時間を記録
+
+        # 再構築が必要かどうかをインデックスの状態から判断する
+        if settings.get('PG_PGROONGA_HEALTH_CHECK'):
+            health_ok, health = pgroonga_index_health(connection_info, logger)
+            if health_ok:
+                rebuild, reason = decide_pgroonga_rebuild(
+                    health, last_pgroonga_rebuild(),
+                    max_dead_ratio=settings.get('PG_PGROONGA_MAX_DEAD_PERCENT') / 100,
+                    max_growth=settings.get('PG_PGROONGA_MAX_GROWTH_PERCENT') / 100,
+                    max_age_days=settings.get('PG_PGROONGA_MAX_AGE_DAYS')
+                )
+                if not rebuild:
+                    # 再構築していればインデックス全体を書き直していた
+                    bytes_saved = health['index_bytes'] or 0
+                    record_pgroonga_health('skip', health, reason=reason, bytes_saved=bytes_saved)
+                    record_task_result(task_name, True, f"スキップ（正常）: {format_bytes(bytes_saved)}の再構築を省略",
+                                       skipped=True, start_time=start_time)
+                    logger.info(f"PGroongaインデックスは正常なため再構築をスキップします ({reason})")
+                    return True
+                record_pgroonga_health('rebuild', health, reason=reason)
+                logger.info(f"PGroongaインデックスを再構築します ({reason})")
+            else:
+                # 確認に失敗した場合は安全側に倒して再構築する
+                logger.warning("PGroongaインデックスの状態を確認できなかったため再構築します")
         
-        response = pgroonga_kensaku_reindex(connection_info, logger)
+        response = pgroonga_kensaku_reindex(connection_info, logger,
+                                            mode=settings.get('PG_PGROONGA_REINDEX_MODE'),
+                                            governor=governor_from_settings(connection_info, logger),
+                                            defer_wait=settings.get('LOAD_DEFER_WAIT_SECONDS'))
+        if response:
+            # 再構築直後の値を次回の判断の基準として記録する
+            health_ok, health = pgroonga_index_health(connection_info, logger)
+            if health_ok:
+                record_pgroonga_health('rebuilt', health)
         
         end_time = time.time()  # 終了時間を記録
         elapsed_time = end_time - start_time  # 経過時間を計算
@@ -146,11 +316,12 @@ def pgroonga_reindex():
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         if response:
             sendDM_misskey_notification(f"PGroongaのインデックス再構築が完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}")
-            record_task_result(task_name, True, f"処理時間: {time_str}")
+            record_task_result(task_name, True, f"処理時間: {time_str}", start_time=start_time,
+                               bytes_processed=health['index_bytes'] if health_ok else None)
             logger.info(f"PGroongaインデックスの再構築完了 - 処理時間: {time_str}")
         else:
             sendDM_misskey_notification(f"PostgreSQLのテーブルの再構築に失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}")
-            record_task_result(task_name, False, f"処理時間: {time_str}")
+            record_task_result(task_name, False, f"処理時間: {time_str}", start_time=start_time)
 
             logger.error(f"PGroongaインデックスの再構築に失敗 - 処理時間: {time_str}")
     
@@ -162,10 +333,12 @@ def pgroonga_reindex():
 def manual_backup_postgres():
     logger = setup_logger(name='manual_backup_postgres')
     connection_info = load_env()
+    # レプリカが使える場合はレプリカからダンプする
+    source_info, _ = read_connection_info(connection_info, logger, 'the manual backup')
     
     start_time = time.time()  # 開始時間を記録
     
-    response,backup_size = manual_backup_pg(connection_info, logger)
+    response, backup_stats = manual_backup_pg(source_info, logger, **get_compression_settings())
 
     end_time = time.time()  # 終了時間を記録
     elapsed_time = end_time - start_time  # 経過時間を計算
@@ -182,19 +355,22 @@ def manual_backup_postgres():
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     if response:
 
-        backup_size_formatted = format_bytes(backup_size) if backup_size else "不明"
+        backup_size_formatted = format_bytes(backup_stats['size']) if backup_stats else "不明"
+        throughput_formatted = f"{format_bytes(backup_stats['throughput'])}/s" if backup_stats else "不明"
+        peak_rss_formatted = format_bytes(backup_stats['child_peak_rss']) if backup_stats else "不明"
 
 
-        sendDM_misskey_notification(f"Postgresの手動バックアップが完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\n出力サイズ：{backup_size_formatted}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
+        sendDM_misskey_notification(f"Postgresの手動バックアップが完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\n出力サイズ：{backup_size_formatted}\nスループット：{throughput_formatted}\nピークメモリ(pg_dumpall)：{peak_rss_formatted}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
         logger.info(f"テーブルの再構築完了 - 処理時間: {time_str}")
     else:
         sendDM_misskey_notification(f"Postgresの手動バックアップに失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
         logger.error(f"テーブルの再構築失敗 - 処理時間: {time_str}")
 
 def auto_backup_postgres(backup_type="daily"):
-    dotenv.load_dotenv()  # この行を追加
+    settings = get_settings()
 
     logger = setup_logger(name='auto_backup_postgres')
+    task_name = f'auto_backup_{backup_type}'
 
     backup_type_upperd = backup_type.upper()
 
@@ -202,30 +378,28 @@ def auto_backup_postgres(backup_type="daily"):
 
     GET_ENV = f'PG_BACKUP_{backup_type_upperd}'
     GET_ENV_FREQUENCY = f'PG_BACKUP_{backup_type_upperd}_FREQUENCY'
-    PG_BACKUP_TYPE = os.environ.get(GET_ENV)
+    PG_BACKUP_TYPE = settings.get(GET_ENV)
 
 
-    if not PG_BACKUP_TYPE:
+    if PG_BACKUP_TYPE is None:
         logger.error(f"{GET_ENV} environment variable is not set")
         sendDM_misskey_notification(f"環境変数{GET_ENV}が設定されていません。")
         record_task_result(task_name, False, f"環境変数{GET_ENV}が設定されていません")
         return False
-    elif PG_BACKUP_TYPE == "True":
+    elif PG_BACKUP_TYPE:
 
-        if backup_type == "daily" and GET_ENV_FREQUENCY == "every_second":
-            # Only run on Sunday (weekday 6)
-            if datetime.now().day % 2 == 0:  # day % 2 == 0 is even days, so skip them
-                logger.info(f"{GET_ENV_FREQUENCY} is set to every_second, but today is not an odd day. Skipping.")
-                ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
-                return False
-        if backup_type == "weekly" and os.environ.get(GET_ENV_FREQUENCY) == "every_second":
+        if backup_type == "daily" and not is_interval_day(settings.get(GET_ENV_FREQUENCY)):
+            logger.info(f"{GET_ENV_FREQUENCY} is set to {settings.get(GET_ENV_FREQUENCY)}. Skipping today.")
+            ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
+            return False
+        if backup_type == "weekly" and settings.get(GET_ENV_FREQUENCY) == "every_second":
             # Get the week number in the year (1-53)
             current_week = datetime.now().isocalendar()[1]
             if current_week % 2 == 0:  # Even weeks
                 logger.info(f"{GET_ENV_FREQUENCY} is set to every_second, but this is an even week. Skipping.")
                 # Not a failure, just intentionally skipping
                 return False
-        if backup_type == "monthly" and os.environ.get(GET_ENV_FREQUENCY) == "every_second":
+        if backup_type == "monthly" and settings.get(GET_ENV_FREQUENCY) == "every_second":
             # Only run on the 1st day of the month
             current_month = datetime.now().month
             if current_month % 2 == 0:  # Even months (February, April, etc.)
@@ -234,17 +408,87 @@ def auto_backup_postgres(backup_type="daily"):
                 return False
 
         connection_info = load_env()
-        
-        disk = get_disk_usage()
-        if disk['percent'] > 90:
-            sendDM_misskey_notification(f"ディスク使用率が{disk['percent']}％です。\nバックアップは行われません。")
-            record_task_result(task_name, False, f"ディスク使用率が{disk['percent']}％のためバックアップ中止")
-            logger.warning(f"ディスク使用率が90％を超過しているため、バックアップは実行されなかった")
-            return
+        # ダンプとサイズの取得は、レプリカが有効で遅れが許容範囲内ならレプリカから行う
+        source_info, source = read_connection_info(connection_info, logger, f'the {backup_type} backup')
 
         start_time = time.time()  # 開始時間を記録
         
-        response, backup_size  = auto_backup_pg(connection_info, logger, backup_type)
+        # バックアップ方式の選択（dumpall: pg_dumpallの単一ストリーム, directory: DBごとの並列ディレクトリ形式,
+        # dedup: 重複排除リポジトリ）
+        PG_BACKUP_ENGINE = settings.get('PG_BACKUP_ENGINE')
+        compression = get_compression_settings(backup_type)
+
+        # S3互換ストレージへのアップロード先（BACKUP_S3=Trueの場合のみ）
+        try:
+            s3_target = S3Target.from_env(logger)
+        except Exception as e:
+            logger.error(f"Failed to set up S3 upload target: {e}")
+            sendDM_misskey_notification(f"バックアップのアップロード先の設定に失敗しました。ローカルにのみ保存します。\n{e}")
+            s3_target = None
+
+        # weekly/monthlyは当日のdailyバックアップがあれば再ダンプせずに昇格させる
+        promoted = False
+        if backup_type != 'daily' and settings.get('PG_BACKUP_PROMOTE'):
+            # ハードリンクとreflinkが使えない場合はdailyバックアップ全体をコピーするため、その分が収まるかを確認する
+            allow_copy = True
+            copy_size = promotion_copy_size(backup_type, PG_BACKUP_ENGINE)
+            if copy_size:
+                promotion_plan = plan_backup(
+                    backup_type, None, PG_BACKUP_ENGINE, None, get_retention_count(backup_type), logger,
+                    reserve_percent=settings.get('PG_BACKUP_PREFLIGHT_RESERVE_PERCENT'), known_size=copy_size
+                )
+                if promotion_plan['decision'] == 'prune':
+                    prune_before_pg_backup(backup_type, logger)
+                # コピーが収まらない見込みの場合は、容量を使わないハードリンクとreflinkだけを試す
+                allow_copy = promotion_plan['decision'] != 'skip'
+            promoted, backup_stats = promote_daily_pg(logger, backup_type, PG_BACKUP_ENGINE, s3_target=s3_target,
+                                                      allow_copy=allow_copy)
+            if promoted:
+                response = True
+            else:
+                logger.info(f"Daily backup could not be promoted to {backup_type}. Falling back to a full dump.")
+
+        # ダンプする前に出力サイズを予測し、保存先に収まるかを確認する
+        plan = None
+        if not promoted:
+            plan = plan_backup(
+                backup_type, get_database_size(source_info), PG_BACKUP_ENGINE,
+                None if PG_BACKUP_ENGINE == 'dedup' else compression['codec'],
+                get_retention_count(backup_type), logger,
+                margin=settings.get('PG_BACKUP_PREFLIGHT_MARGIN'),
+                reserve_percent=settings.get('PG_BACKUP_PREFLIGHT_RESERVE_PERCENT')
+            )
+            disk = plan['disk']
+            predicted_formatted = format_bytes(plan['predicted_size']) if plan['predicted_size'] is not None else "不明"
+            if plan['decision'] == 'skip':
+                sendDM_misskey_notification(f"バックアップの保存先の空き容量が不足する見込みです。\nバックアップは行われません。\n\nモード：{backup_type}\n予測サイズ：{predicted_formatted}\n空き容量: {format_bytes(disk['free'])}\n削除可能な古い世代：{format_bytes(plan['reclaimable'])}\nディスク使用率: {disk['percent']}%")
+                record_task_result(task_name, False, f"空き容量不足の見込みのためバックアップ中止（予測サイズ: {predicted_formatted}, 空き容量: {format_bytes(disk['free'])}）")
+                logger.warning(f"空き容量が不足する見込みのため、バックアップは実行されなかった")
+                return
+            if plan['decision'] == 'prune':
+                prune_before_pg_backup(backup_type, logger)
+
+        def run_backup(info):
+            # 負荷の監視はダンプを読み出すサーバー（レプリカまたはプライマリ）に対して行う
+            if PG_BACKUP_ENGINE == "dedup":
+                return auto_backup_pg_dedup(info, logger, backup_type)
+            if PG_BACKUP_ENGINE == "directory":
+                return auto_backup_pg_parallel(info, logger, backup_type,
+                                               settings.get('PG_BACKUP_JOBS'),
+                                               codec=compression['codec'], level=compression['level'],
+                                               s3_target=s3_target,
+                                               governor=governor_from_settings(info, logger))
+            return auto_backup_pg(info, logger, backup_type, **compression,
+                                  s3_target=s3_target,
+                                  governor=governor_from_settings(info, logger))
+
+        if not promoted:
+            response, backup_stats = run_backup(source_info)
+            if not response and source == REPLICA:
+                # WALの適用との競合でダンプが取り消された場合などは、プライマリで取り直す
+                logger.warning(f"{backup_type} backup from the replica failed. Retrying on the primary")
+                source_info, source = connection_info, PRIMARY
+                response, backup_stats = run_backup(source_info)
 
         end_time = time.time()  # 終了時間を記録
         elapsed_time = end_time - start_time  # 経過時間を計算
@@ -254,21 +498,49 @@ def auto_backup_postgres(backup_type="daily"):
         minutes, seconds = divmod(remainder, 60)
         time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
 
-        disk = get_disk_usage()
+        disk = get_disk_usage(str(BACKUP_ROOT))
         system_check_msg = f"ディスク使用状況:\n合計容量: {format_bytes(disk['total'])}\n使用済み: {format_bytes(disk['used'])}\n空き容量: {format_bytes(disk['free'])}\n使用率: {disk['percent']}%"
 
         # 現在の時間を取得してフォーマット
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         if response:
 
-            backup_size_formatted = format_bytes(backup_size) if backup_size else "不明"
+            backup_size_formatted = format_bytes(backup_stats['size']) if backup_stats else "不明"
+            throughput_formatted = f"{format_bytes(backup_stats['throughput'])}/s" if backup_stats else "不明"
+            peak_rss_formatted = format_bytes(backup_stats['child_peak_rss']) if backup_stats and 'child_peak_rss' in backup_stats else "不明"
+
+            mode_label = f"{backup_type}（dailyから昇格: {backup_stats['method']}）" if promoted else backup_type
+            source_label = "" if promoted else f"\n取得元：{'レプリカ' if source == REPLICA else 'プライマリ'}"
+
+            # 事前の予測と実際の出力サイズの誤差を記録する
+            prediction_msg = ""
+            error_percent = prediction_error(plan, backup_stats['size'] if backup_stats else None)
+            if error_percent is not None:
+                record_prediction(backup_stats['path'], plan['predicted_size'])
+                prediction_msg = f"\n予測サイズ：{format_bytes(plan['predicted_size'])}（誤差: {error_percent:+.1f}%）"
+                logger.info(f"Preflight prediction error: {error_percent:+.1f}% (predicted {plan['predicted_size']}, actual {backup_stats['size']})")
+
+            # S3互換ストレージへのアップロード結果
+            remote_msg = ""
+            if backup_stats and 'remote' in backup_stats:
+                remote_msg = f"\nアップロード先：{backup_stats['remote']}"
+            elif backup_stats and 'remote_error' in backup_stats:
+                remote_msg = f"\nアップロード：失敗（{backup_stats['remote_error']}）"
+            elif s3_target is not None and PG_BACKUP_ENGINE == 'dedup':
+                remote_msg = "\nアップロード：重複排除リポジトリは対象外"
 
-            sendDM_misskey_notification(f"Postgresの自動バックアップが完了しました。\n\nモード：{backup_type}\n現在時間：{current_time}\n処理時間: {time_str}\n出力サイズ：{backup_size_formatted}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
-            record_task_result(task_name, True, f"処理時間: {time_str}, サイズ: {backup_size_formatted}")
+            sendDM_misskey_notification(f"Postgresの自動バックアップが完了しました。\n\nモード：{mode_label}\n現在時間：{current_time}\n処理時間: {time_str}{source_label}\n出力サイズ：{backup_size_formatted}{prediction_msg}{remote_msg}\nスループット：{throughput_formatted}\nピークメモリ(pg_dumpall)：{peak_rss_formatted}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
+            if promoted:
+                # 昇格は数秒で終わるため、フルダンプの処理時間の基準に含めない
+                record_task_result(task_name, True, f"dailyから昇格({backup_stats['method']}), サイズ: {backup_size_formatted}",
+                                   start_time=start_time, method='promotion')
+            else:
+                record_task_result(task_name, True, f"処理時間: {time_str}, サイズ: {backup_size_formatted}, スループット: {throughput_formatted}",
+                                   start_time=start_time, bytes_processed=backup_stats.get('raw_bytes') or backup_stats.get('size'))
             logger.info(f"テーブルの再構築完了 - 処理時間: {time_str}")
         else:
             sendDM_misskey_notification(f"Postgresの自動バックアップに失敗しました。\n\nモード：{backup_type}\n現在時間：{current_time}\n処理時間: {time_str}\nディスク使用率: {disk['percent']}%\n空き容量: {format_bytes(disk['free'])}")
-            record_task_result(task_name, False, f"処理時間: {time_str}")
+            record_task_result(task_name, False, f"処理時間: {time_str}", start_time=start_time)
             logger.error(f"テーブルの再構築失敗 - 処理時間: {time_str}")
     else:
         logger.info(f"{GET_ENV} is set to false. Skipping auto_backup_postgres")
@@ -277,16 +549,14 @@ def auto_backup_postgres(backup_type="daily"):
 
 def daily_maintenance_report():
     """毎朝のメンテナンス結果レポートを生成して通知する"""
-    dotenv.load_dotenv()  # この行を追加
-
     logger = setup_logger(name='daily_maintenance_report')
 
-    MAINTENANCE_REPORT = os.environ.get('MAINTENANCE_REPORT')
-    if not MAINTENANCE_REPORT:
+    MAINTENANCE_REPORT = get_settings().get('MAINTENANCE_REPORT')
+    if MAINTENANCE_REPORT is None:
         logger.error("MAINTENANCE_REPORT environment variable is not set")
         sendDM_misskey_notification("環境変数MAINTENANCE_REPORTが設定されていません。")
         return False
-    elif MAINTENANCE_REPORT == "True":
+    elif MAINTENANCE_REPORT:
         # 現在の時間を取得してフォーマット
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
@@ -317,12 +587,46 @@ def daily_maintenance_report():
         else:
             task_status += f"- 日次バックアップ: ⚠️ 実行なし\n"
         
+        # 物理バックアップ
+        physical_status = TASK_RESULTS['physical_backup']
+        if physical_status['last_run'] and physical_status['last_run'].date() == (datetime.now() - timedelta(days=1)).date():
+            result = "✅ 成功" if physical_status['success'] else "❌ 失敗"
+            details = f" ({physical_status['details']})" if physical_status['details'] else ""
+            task_status += f"- 物理バックアップ: {result}{details}\n"
+
+        # バックアップ検証
+        verify_status = TASK_RESULTS['verify_backup']
+        if verify_status['last_run'] and verify_status['last_run'].date() == (datetime.now() - timedelta(days=1)).date():
+            result = "✅ 成功" if verify_status['success'] else "❌ 失敗"
+            details = f" ({verify_status['details']})" if verify_status['details'] else ""
+            task_status += f"- バックアップ検証: {result}{details}\n"
+
+        # MinIOのバックアップ
+        minio_status = TASK_RESULTS['minio_backup']
+        if minio_status['last_run'] and minio_status['last_run'].date() == (datetime.now() - timedelta(days=1)).date():
+            result = "✅ 成功" if minio_status['success'] else "❌ 失敗"
+            details = f" ({minio_status['details']})" if minio_status['details'] else ""
+            task_status += f"- MinIOバックアップ: {result}{details}\n"
+
+        # Redisのバックアップ
+        redis_status = TASK_RESULTS['redis_backup']
+        if redis_status['last_run'] and redis_status['last_run'].date() == (datetime.now() - timedelta(days=1)).date():
+            result = "✅ 成功" if redis_status['success'] else "❌ 失敗"
+            details = f" ({redis_status['details']})" if redis_status['details'] else ""
+            task_status += f"- Redisバックアップ: {result}{details}\n"
+
         # PGroongaインデックス再構築
         pgroonga_status = TASK_RESULTS['pgroonga_reindex']
         if pgroonga_status['last_run'] and pgroonga_status['last_run'].date() == (datetime.now() - timedelta(days=1)).date():
-            result = "✅ 成功" if pgroonga_status['success'] else "❌ 失敗"
+            if pgroonga_status.get('skipped'):
+                result = "⏭️ スキップ（正常）"
+            else:
+                result = "✅ 成功" if pgroonga_status['success'] else "❌ 失敗"
             details = f" ({pgroonga_status['details']})" if pgroonga_status['details'] else ""
             task_status += f"- PGroonga再構築: {result}{details}\n"
+            skipped_count, saved_bytes = pgroonga_bytes_saved(days=30)
+            if skipped_count:
+                task_status += f"  直近30日: {skipped_count}回スキップ, {format_bytes(saved_bytes)}の再構築を省略\n"
         else:
             task_status += f"- PGroonga再構築: ⚠️ 実行なし\n"
         
@@ -373,6 +677,349 @@ def check_postgres_connection():
     connection_info = load_env()
     check_pg_conn(connection_info, logger)
 
+def physical_backup():
+    """
+    pg_basebackupによる物理ベースバックアップを取得し、古いベースバックアップと不要なWALを削除する
+    """
+    settings = get_settings()
+
+    logger = setup_logger(name='physical_backup')
+    task_name = 'physical_backup'
+
+    PG_BASEBACKUP = settings.get('PG_BASEBACKUP')
+    PG_BASEBACKUP_FREQUENCY = settings.get('PG_BASEBACKUP_FREQUENCY')
+
+    if PG_BASEBACKUP_FREQUENCY == "everyweek":
+        # Only run on Sunday (weekday 6)
+        if datetime.now().weekday() != 6:
+            logger.info("PG_BASEBACKUP_FREQUENCY is set to everyweek, but today is not Sunday. Skipping.")
+            ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
+            return False
+
+    if not PG_BASEBACKUP:
+        logger.info("PG_BASEBACKUP is not set to True. Skipping physical_backup")
+        return False
+
+    connection_info = load_env()
+
+    start_time = time.time()  # 開始時間を記録
+
+    response, backup_stats = pg_base_backup(connection_info, logger, **{
+        k: v for k, v in get_compression_settings('basebackup').items() if k != 'threads'
+    })
+
+    end_time = time.time()  # 終了時間を記録
+    elapsed_time = end_time - start_time  # 経過時間を計算
+
+    # 時間を見やすいフォーマットに変換（時:分:秒）
+    hours, remainder = divmod(elapsed_time, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    # 現在の時間を取得してフォーマット
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if response:
+        prune_base_backups(settings.get('PG_BASEBACKUP_GENERATION'), logger)
+
+        backup_size_formatted = format_bytes(backup_stats['size'])
+        sendDM_misskey_notification(f"Postgresの物理バックアップが完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\n出力サイズ：{backup_size_formatted}\n開始WAL：{backup_stats['start_wal']}")
+        record_task_result(task_name, True, f"処理時間: {time_str}, サイズ: {backup_size_formatted}",
+                           start_time=start_time, bytes_processed=backup_stats['size'])
+        logger.info(f"物理バックアップ完了 - 処理時間: {time_str}")
+    else:
+        sendDM_misskey_notification(f"Postgresの物理バックアップに失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}")
+        record_task_result(task_name, False, f"処理時間: {time_str}", start_time=start_time)
+        logger.error(f"物理バックアップ失敗 - 処理時間: {time_str}")
+
+def minio_backup():
+    """
+    Misskeyのファイル保存先のMinIOバケットを差分バックアップし、古い世代を削除する
+    """
+    settings = get_settings()
+
+    logger = setup_logger(name='minio_backup')
+    task_name = 'minio_backup'
+
+    MINIO_BACKUP = settings.get('MINIO_BACKUP')
+    MINIO_BACKUP_FREQUENCY = settings.get('MINIO_BACKUP_FREQUENCY')
+
+    if not MINIO_BACKUP:
+        logger.info("MINIO_BACKUP is not set to True. Skipping minio_backup")
+        return False
+
+    if not is_interval_day(MINIO_BACKUP_FREQUENCY):
+        logger.info(f"MINIO_BACKUP_FREQUENCY is set to {MINIO_BACKUP_FREQUENCY}. Skipping today.")
+        ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
+        return False
+
+    # 接続先が設定されていない場合は、クライアントの作成で失敗する前に通知する
+    for env in ('MINIO_HOST', 'MINIO_ACCESS_KEY', 'MINIO_SECRET_KEY', 'MINIO_BUCKET'):
+        if settings.get(env) is None:
+            logger.error(f"{env} environment variable is not set")
+            sendDM_misskey_notification(f"環境変数{env}が設定されていません。")
+            record_task_result(task_name, False, f"環境変数{env}が設定されていません。")
+            return False
+
+    start_time = time.time()  # 開始時間を記録
+
+    response, backup_stats = backup_minio_bucket(logger, workers=settings.get('MINIO_BACKUP_WORKERS'))
+
+    end_time = time.time()  # 終了時間を記録
+    elapsed_time = end_time - start_time  # 経過時間を計算
+
+    # 時間を見やすいフォーマットに変換（時:分:秒）
+    hours, remainder = divmod(elapsed_time, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    # 現在の時間を取得してフォーマット
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(backup_stats, dict):
+        prune_minio_generations(settings.get('MINIO_BACKUP_GENERATION'), logger)
+        summary = (f"オブジェクト数：{backup_stats['objects']}（{format_bytes(backup_stats['total_bytes'])}）\n"
+                   f"新規・変更：{backup_stats['new_objects']}（{format_bytes(backup_stats['new_bytes'])}）\n"
+                   f"削除：{backup_stats['removed_objects']}\n"
+                   f"失敗：{backup_stats['failed_objects']}")
+        if response:
+            sendDM_misskey_notification(f"MinIOのバックアップが完了しました。\n\n世代：{backup_stats['generation']}\n現在時間：{current_time}\n処理時間: {time_str}\n{summary}")
+            record_task_result(task_name, True, f"処理時間: {time_str}, 新規: {backup_stats['new_objects']}件 ({format_bytes(backup_stats['new_bytes'])})",
+                               start_time=start_time, bytes_processed=backup_stats['new_bytes'])
+            logger.info(f"MinIOのバックアップ完了 - 処理時間: {time_str}")
+            return True
+        # 一部のオブジェクトの取得に失敗した場合も世代は記録されている（失敗分は次回再試行される）
+        sendDM_misskey_notification(f"MinIOのバックアップで一部のオブジェクトの取得に失敗しました。\n\n世代：{backup_stats['generation']}\n現在時間：{current_time}\n処理時間: {time_str}\n{summary}")
+        record_task_result(task_name, False, f"処理時間: {time_str}, 失敗: {backup_stats['failed_objects']}件",
+                           start_time=start_time, bytes_processed=backup_stats['new_bytes'])
+        logger.error(f"MinIOのバックアップで一部失敗 - 処理時間: {time_str}")
+        return False
+
+    sendDM_misskey_notification(f"MinIOのバックアップに失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\n{backup_stats}")
+    record_task_result(task_name, False, f"処理時間: {time_str}", start_time=start_time)
+    logger.error(f"MinIOのバックアップ失敗 - 処理時間: {time_str}")
+    return False
+
+def redis_backup():
+    """
+    RedisのRDBスナップショットを取得して圧縮して保存し、RDBサイズとfork時間を通知する
+    """
+    settings = get_settings()
+
+    logger = setup_logger(name='redis_backup')
+    task_name = 'redis_backup'
+
+    if not settings.get('REDIS_BACKUP'):
+        logger.info("REDIS_BACKUP is not set to True. Skipping redis_backup")
+        return False
+
+    start_time = time.time()  # 開始時間を記録
+
+    response, backup_stats = backup_redis(
+        load_redis_env(), logger, **get_compression_settings('redis'),
+        bgsave=settings.get('REDIS_BACKUP_BGSAVE'),
+        bgsave_timeout=settings.get('REDIS_BGSAVE_TIMEOUT')
+    )
+
+    end_time = time.time()  # 終了時間を記録
+    elapsed_time = end_time - start_time  # 経過時間を計算
+
+    # 時間を見やすいフォーマットに変換（時:分:秒）
+    hours, remainder = divmod(elapsed_time, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    # 現在の時間を取得してフォーマット
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if response:
+        # 前回のバックアップと比べて、RDBサイズとfork時間の増え方を確認する
+        previous = [b for b in list_catalog_backups('redis', limit=2) if b['path'] != str(backup_stats['path'])]
+        previous_metrics = read_redis_backup_metrics(previous[0]['path']) if previous else None
+        fork_ms = max(backup_stats.get('bgsave_fork_ms', 0), backup_stats['transfer_fork_ms'])
+        trend = ""
+        if previous_metrics:
+            previous_fork_ms = max(previous_metrics.get('bgsave_fork_ms', 0), previous_metrics.get('transfer_fork_ms', 0))
+            trend = f"\n前回：RDB {format_bytes(previous_metrics['rdb_bytes'])}, fork {previous_fork_ms:.1f}ms"
+
+        prune_redis_backups(settings.get('REDIS_BACKUP_GENERATION'), logger)
+
+        warning = ""
+        fork_warn_ms = settings.get('REDIS_FORK_WARN_MS')
+        if fork_ms > fork_warn_ms:
+            # forkの間はRedisがすべての処理を止めるため、Misskeyの応答が遅くなる
+            warning = f"\n\n⚠️ fork時間が{fork_warn_ms:.0f}msを超えています。スナップショットがMisskeyの応答速度に影響している可能性があります。"
+            logger.warning(f"Redis fork time {fork_ms:.1f}ms exceeds {fork_warn_ms:.0f}ms")
+
+        bgsave_line = f"BGSAVE：{backup_stats['bgsave_seconds']:.1f}秒 (fork {backup_stats['bgsave_fork_ms']:.1f}ms)\n" if 'bgsave_seconds' in backup_stats else ""
+        sendDM_misskey_notification(f"Redisのバックアップが完了しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\nRDBサイズ：{format_bytes(backup_stats['rdb_bytes'])}\n出力サイズ：{format_bytes(backup_stats['size'])}\nメモリ使用量：{format_bytes(backup_stats['used_memory'])}\n{bgsave_line}転送時のfork：{backup_stats['transfer_fork_ms']:.1f}ms{trend}{warning}")
+        record_task_result(task_name, True, f"処理時間: {time_str}, RDB: {format_bytes(backup_stats['rdb_bytes'])}, fork: {fork_ms:.1f}ms",
+                           start_time=start_time, bytes_processed=backup_stats['rdb_bytes'])
+        logger.info(f"Redisのバックアップ完了 - 処理時間: {time_str}")
+        return True
+
+    sendDM_misskey_notification(f"Redisのバックアップに失敗しました。\n\n現在時間：{current_time}\n処理時間: {time_str}\n{backup_stats}")
+    record_task_result(task_name, False, f"処理時間: {time_str}", start_time=start_time)
+    logger.error(f"Redisのバックアップ失敗 - 処理時間: {time_str}")
+    return False
+
+def verify_backup():
+    """
+    最新のバックアップを一時的なローカルPostgreSQLへ復元し、チェックサムと行数を検証する
+    """
+    settings = get_settings()
+
+    logger = setup_logger(name='verify_backup')
+    task_name = 'verify_backup'
+
+    PG_BACKUP_VERIFY = settings.get('PG_BACKUP_VERIFY')
+    PG_BACKUP_VERIFY_FREQUENCY = settings.get('PG_BACKUP_VERIFY_FREQUENCY')
+
+    if PG_BACKUP_VERIFY_FREQUENCY == "everyweek":
+        # Only run on Sunday (weekday 6)
+        if datetime.now().weekday() != 6:
+            logger.info("PG_BACKUP_VERIFY_FREQUENCY is set to everyweek, but today is not Sunday. Skipping.")
+            ## 意図した挙動である（失敗ではない）ため、record_task_resultは呼び出さない
+            return False
+
+    if not PG_BACKUP_VERIFY:
+        logger.info("PG_BACKUP_VERIFY is not set to True. Skipping verify_backup")
+        return False
+
+    backup_type = settings.get('PG_BACKUP_VERIFY_TYPE')
+    start_time = time.time()  # 開始時間を記録
+
+    # 検証対象の最新バックアップを選ぶ
+    if settings.get('PG_BACKUP_ENGINE') == "dedup":
+        backups = list_dedup_backups(DEFAULT_REPO_DIR, backup_type)
+        if not backups:
+            logger.error(f"No {backup_type} backup found in {DEFAULT_REPO_DIR}")
+            record_task_result(task_name, False, "検証対象のバックアップなし")
+            return False
+        backup_name = backups[-1]
+        target = DEFAULT_REPO_DIR / 'manifests' / backup_type / f"{backup_name}.json"
+        response, result = verify_pg_backup(
+            target, logger,
+            stream_writer=lambda f: restore_dedup_backup(DEFAULT_REPO_DIR, backup_type, backup_name, f),
+            manifest=read_backup_manifest(DEFAULT_REPO_DIR, backup_type, backup_name)
+        )
+    else:
+        backup_dir = Path(f'/backup/postgres/auto/{backup_type}/')
+        candidates = [p for ext in backup_extensions() for p in backup_dir.glob(f'pg_dump_*.sql{ext}')]
+        if not candidates:
+            logger.error(f"No {backup_type} backup found in {backup_dir}")
+            record_task_result(task_name, False, "検証対象のバックアップなし")
+            return False
+        target = max(candidates, key=lambda p: p.stat().st_mtime)
+        response, result = verify_pg_backup(target, logger)
+
+    # 現在の時間を取得してフォーマット
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if not isinstance(result, dict):
+        sendDM_misskey_notification(f"バックアップの検証に失敗しました。\n\n対象：{target.name}\n現在時間：{current_time}\nエラー：{result}")
+        record_task_result(task_name, False, f"対象: {target.name}, エラー: {result}", start_time=start_time)
+        logger.error(f"バックアップの検証失敗 - {result}")
+        return False
+
+    # 時間を見やすいフォーマットに変換（時:分:秒）
+    hours, remainder = divmod(result['restore_seconds'], 3600)
+    minutes, seconds = divmod(remainder, 60)
+    time_str = f"{int(hours):02}:{int(minutes):02}:{int(seconds):02}"
+    throughput_formatted = f"{format_bytes(result['throughput'])}/s"
+    checksum_label = {True: "一致", False: "不一致", None: "対象外"}[result['checksum_ok']]
+    mismatched = "\n".join(
+        f"- {m['table']}: 期待 {m['expected']} / 復元 {m['restored']}" for m in result['mismatched_tables'][:10]
+    )
+    restore_errors = "\n".join(f"- {line}" for line in result['unexpected_errors'][:5])
+    details = f"復元時間: {time_str}, 復元速度: {throughput_formatted}, テーブル数: {result['tables']}"
+
+    if response:
+        sendDM_misskey_notification(f"バックアップの検証が完了しました。\n\n対象：{target.name}\n現在時間：{current_time}\n復元時間: {time_str}\n復元速度：{throughput_formatted}\nチェックサム：{checksum_label}\nテーブル数：{result['tables']}（行数すべて一致）")
+        record_task_result(task_name, True, details, start_time=start_time)
+        logger.info(f"バックアップの検証完了 - {details}")
+    else:
+        sendDM_misskey_notification(f"バックアップの検証で問題が見つかりました。\n\n対象：{target.name}\n現在時間：{current_time}\n復元時間: {time_str}\n復元速度：{throughput_formatted}\nチェックサム：{checksum_label}\n行数の不一致：{len(result['mismatched_tables'])}件\n{mismatched}\npsqlの終了コード：{result['restore_returncode']}\n想定外の復元エラー：{len(result['unexpected_errors'])}件\n{restore_errors}")
+        record_task_result(task_name, False, f"{details}, 不一致: {len(result['mismatched_tables'])}件, 想定外の復元エラー: {len(result['unexpected_errors'])}件", start_time=start_time)
+        logger.error(f"バックアップの検証で問題を検出 - {details}")
+    return response
+
+def pitr_restore(target_time=None, data_dir=None):
+    """
+    ベースバックアップとWALアーカイブから指定時刻の状態のデータディレクトリを作成する
+    python main.py --run pitr_restore --target-time "2025-01-01 12:00:00" --data-dir /penetration/pgdata
+    """
+    logger = setup_logger(name='pitr_restore')
+    if not target_time or not data_dir:
+        logger.error("pitr_restore requires --target-time and --data-dir")
+        print("pitr_restore には --target-time と --data-dir の指定が必要です。")
+        return False
+
+    response, result = restore_to_timestamp(datetime.fromisoformat(target_time), Path(data_dir), logger)
+    if response:
+        print(f"{result} を {data_dir} に展開しました。このデータディレクトリでPostgreSQLを起動すると {target_time} までリカバリされます。")
+    else:
+        print(f"リストアに失敗しました: {result}")
+    return response
+
+def compression_benchmark():
+    """
+    実際のダンプのサンプルに対して各圧縮コーデックの速度と圧縮率を計測し、DMで通知する
+    サンプルはCOMPRESSION_BENCHMARK_SAMPLEで指定するか、最新のバックアップファイルを使う
+    """
+    logger = setup_logger(name='compression_benchmark')
+    settings = get_settings()
+
+    sample_path = settings.get('COMPRESSION_BENCHMARK_SAMPLE')
+    if not sample_path:
+        # 最新のpg_dumpallバックアップをサンプルとして使う
+        candidates = [
+            p for ext in backup_extensions()
+            for p in Path('/backup/postgres').rglob(f'pg_dump_*.sql{ext}')
+        ]
+        if not candidates:
+            logger.error("No backup file found for compression benchmark")
+            sendDM_misskey_notification("圧縮ベンチマーク用のバックアップファイルが見つかりません。")
+            return False
+        sample_path = max(candidates, key=lambda p: p.stat().st_mtime)
+
+    sample_mb = settings.get('COMPRESSION_BENCHMARK_SAMPLE_MB')
+    logger.info(f"Reading {sample_mb} MB sample from {sample_path}")
+    sample = read_sample(sample_path, sample_mb * 1024 * 1024)
+
+    cpu_count = os.cpu_count() or 1
+    results = benchmark_codecs(sample, [
+        ('gzip', 1, 1),
+        ('gzip', 6, 1),
+        ('gzip', 9, 1),
+        ('pgzip', 1, cpu_count),
+        ('pgzip', 6, cpu_count),
+        ('zstd', 3, cpu_count),
+        ('zstd', 10, cpu_count),
+    ], logger)
+
+    lines = []
+    for result in results:
+        if 'error' in result:
+            lines.append(f"- {result['codec']} (レベル{result['level']}): 計測不可 ({result['error']})")
+        else:
+            lines.append(f"- {result['codec']} (レベル{result['level']}, {result['threads']}スレッド): "
+                         f"{result['mb_per_sec']} MB/s, 圧縮率 {result['ratio']}")
+    result_text = "\n".join(lines)
+    sendDM_misskey_notification(f"圧縮コーデックのベンチマーク結果\n\nサンプル：{sample_path} ({format_bytes(len(sample))})\n{result_text}")
+    return True
+
+def list_backups():
+    """
+    カタログに登録されているバックアップを一覧表示する
+    ファイルシステムを走査しないため、バックアップ先が遅いストレージでもすぐに表示できる
+    """
+    backups = list_catalog_backups()
+    if not backups:
+        print("No backups recorded in the catalog.")
+        return True
+
+    print(f"{'created_at':<20} {'kind':<10} {'tier':<8} {'engine':<10} {'size':>10} {'duration':>9} {'codec':<6} path")
+    for backup in backups:
+        size = format_bytes(backup['size']) if backup['size'] is not None else '-'
+        duration = f"{backup['duration']:.1f}s" if backup['duration'] is not None else '-'
+        print(f"{backup['created_at'][:19]:<20} {backup['kind']:<10} {backup['tier']:<8} "
+              f"{backup['engine'] or '-':<10} {size:>10} {duration:>9} {backup['codec'] or '-':<6} {backup['path']}")
+    return True
+
 def morning_print():
     print(f"Morning print at {datetime.now()}")
 
@@ -380,20 +1027,86 @@ def test():
     print(f"test ok at {datetime.now()}")
     # バックアップ処理をここに実装
 
-def announcement_maintenance_start():
-    MAINTENANCE_ANNOUNCEMENT = os.environ.get('MAINTENANCE_ANNOUNCEMENT')
-    if not MAINTENANCE_ANNOUNCEMENT:
+def announcement_maintenance_start(start_time="02:00"):
+    """
+    メンテナンスの開始をアナウンスする
+
+    Args:
+        start_time (str): アナウンスする開始時刻 (HH:MM)
+    """
+    logger = setup_logger(name='announcement_maintenance_start')
+    MAINTENANCE_ANNOUNCEMENT = get_settings().get('MAINTENANCE_ANNOUNCEMENT')
+    if MAINTENANCE_ANNOUNCEMENT is None:
         logger.error("MAINTENANCE_ANNOUNCEMENT environment variable is not set")
         sendDM_misskey_notification("環境変数MAINTENANCE_ANNOUNCEMENTが設定されていません。")
         return False
-    elif MAINTENANCE_ANNOUNCEMENT == "True":
-        logger = setup_logger(name='announcement_maintenance_start')
-        post_misskey_notification(f"まもなく、本日2時よりメンテナンス作業を開始します。\n作業中もサーバはご利用頂けますが、応答速度の低下などが生じる可能性があります。\nご了承の程、よろしくお願いいたします。")
+    elif MAINTENANCE_ANNOUNCEMENT:
+        hour, minute = (int(part) for part in start_time.split(':'))
+        start_label = f"{hour}時" if minute == 0 else f"{hour}時{minute}分"
+        post_misskey_notification(f"まもなく、本日{start_label}よりメンテナンス作業を開始します。\n作業中もサーバはご利用頂けますが、応答速度の低下などが生じる可能性があります。\nご了承の程、よろしくお願いいたします。")
         logger.info("メンテナンス作業開始のアナウンスを実行")
     else:
         logger.info("MAINTENANCE_ANNOUNCEMENT is set to false. Skipping announcement")
         return False
 
+def build_maintenance_pipeline():
+    """
+    夜間メンテナンスのパイプラインを構築する
+    データベースに大きなI/Oをかけるタスクは依存関係の順に1つずつ連続して実行し、
+    RedisやMinIOのバックアップはそれと並行して実行する
+    アナウンスはパイプラインには含めず、開始時刻の前に別に投稿する（案内した時刻より前に負荷をかけないため）
+    """
+    logger = setup_logger(name='maintenance_pipeline')
+    tasks = [
+        PipelineTask('pg_repack_all_db', pg_repack_all_db, resource=DB_IO),
+        PipelineTask('auto_backup_daily', auto_backup_postgres, after=['pg_repack_all_db'], resource=DB_IO,
+                     kwargs={'backup_type': 'daily'}),
+        PipelineTask('pgroonga_reindex', pgroonga_reindex, after=['auto_backup_daily'], resource=DB_IO),
+        # 曜日・日付の条件は起動時ではなく実行の直前に評価する
+        PipelineTask('auto_backup_weekly', auto_backup_postgres, after=['pgroonga_reindex'], resource=DB_IO,
+                     when=lambda: datetime.now().weekday() == 6, kwargs={'backup_type': 'weekly'}),
+        PipelineTask('auto_backup_monthly', auto_backup_postgres, after=['auto_backup_weekly'], resource=DB_IO,
+                     when=lambda: datetime.now().day == 1, kwargs={'backup_type': 'monthly'}),
+        PipelineTask('physical_backup', physical_backup, after=['auto_backup_monthly'], resource=DB_IO),
+        PipelineTask('verify_backup', verify_backup, after=['physical_backup']),
+        PipelineTask('redis_backup', redis_backup),
+        PipelineTask('minio_backup', minio_backup),
+    ]
+    settings = get_settings()
+    return MaintenancePipeline(tasks, logger,
+                               max_workers=settings.get('MAINTENANCE_WORKERS'),
+                               window_length=timedelta(hours=settings.get('MAINTENANCE_WINDOW_HOURS')))
+
+
+def maintenance_pipeline():
+    build_maintenance_pipeline().run()
+
+
+# スケジュールから最後に開始したパイプライン
+_PIPELINE = None
+
+
+def start_maintenance_pipeline():
+    """
+    パイプラインを実行のたびに構築して別スレッドで開始する（MAINTENANCE_WORKERSなどの.envの変更を反映するため）
+    前回のパイプラインがまだ実行中の場合は開始しない
+    """
+    global _PIPELINE
+    if _PIPELINE is not None and _PIPELINE.running:
+        _PIPELINE.logger.warning("Maintenance pipeline is still running. Skipping this run.")
+        return None
+    _PIPELINE = build_maintenance_pipeline()
+    return _PIPELINE.start_background()
+
+
+def run_task(task_name, func, **kwargs):
+    """
+    タスク名と実行IDをログに付けてタスクを実行する（従来の時刻ごとの実行で使う）
+    """
+    with task_context(task_name):
+        return func(**kwargs)
+
+
 # 利用可能なタスクの辞書
 TASKS = {
     'morning_print': morning_print,
@@ -404,29 +1117,79 @@ TASKS = {
     'pg_repack_all_db': pg_repack_all_db,
     'system_check': system_check,
     'daily_maintenance_report': daily_maintenance_report,
-    'announcement_maintenance_start': announcement_maintenance_start
+    'announcement_maintenance_start': announcement_maintenance_start,
+    'compression_benchmark': compression_benchmark,
+    'physical_backup': physical_backup,
+    'verify_backup': verify_backup,
+    'pitr_restore': pitr_restore,
+    'list_backups': list_backups,
+    'minio_backup': minio_backup,
+    'redis_backup': redis_backup,
+    'maintenance_pipeline': maintenance_pipeline
 
 }
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--run', choices=TASKS.keys(), help='実行するタスクを指定')
+    parser.add_argument('--target-time', help='pitr_restoreで復元する時刻 (例: "2025-01-01 12:00:00")')
+    parser.add_argument('--data-dir', help='pitr_restoreの復元先データディレクトリ')
     args = parser.parse_args()
 
+    # 設定を読み込んで検証する（以降は.envが変更された場合のみ読み直す）
+    settings = get_settings()
+    # ログの出力先を構築する（書き込みは別スレッドで行う）
+    configure_logging(level=settings.get('LOG_LEVEL'), json_format=settings.get('LOG_FORMAT') == 'json')
+
+    # 遅いクエリと失敗したクエリをログに記録する
+    log_slow_queries(setup_logger(name='db'))
+    # 再起動前の実行結果を読み込む
+    load_task_results()
+
     if args.run:
-        # 指定されたタスクを即時実行
-        TASKS[args.run]()
+        # 指定されたタスクを即時実行（タスク固有の引数は指定された場合のみ渡す）
+        task_args = {k: v for k, v in (('target_time', args.target_time), ('data_dir', args.data_dir)) if v}
+        try:
+            with task_context(args.run):
+                TASKS[args.run](**task_args)
+        finally:
+            # 送信待ちの通知を送ってから終了する
+            flush_notifications()
+            close_pools()
         return
 
     # スケジュール設定
-    schedule.every().day.at("01:50").do(announcement_maintenance_start)
-    schedule.every().day.at("02:00").do(pg_repack_all_db)
-    schedule.every().day.at("03:00").do(auto_backup_postgres, backup_type="daily")
-    schedule.every().day.at("04:00").do(pgroonga_reindex)
-    schedule.every().day.at("05:00").do(auto_backup_postgres, backup_type="weekly") if datetime.now().weekday() == 6 else None
-    schedule.every().day.at("06:00").do(lambda: auto_backup_postgres(backup_type="monthly") if datetime.now().day == 1 else None)
+    if settings.get('MAINTENANCE_PIPELINE'):
+        # 依存関係に従って連続して実行する。別スレッドで動かすため、長引いても8時のレポートは遅れない
+        start_time = settings.get('MAINTENANCE_START_TIME')
+        announce_time = (datetime.strptime(start_time, '%H:%M') - timedelta(minutes=10)).strftime('%H:%M')
+        schedule.every().day.at(announce_time).do(run_task, 'announcement_maintenance_start',
+                                                  announcement_maintenance_start, start_time=start_time)
+        schedule.every().day.at(start_time).do(start_maintenance_pipeline)
+    else:
+        # 従来の時刻ごとの実行
+        schedule.every().day.at("01:50").do(run_task, 'announcement_maintenance_start', announcement_maintenance_start)
+        schedule.every().day.at("02:00").do(run_task, 'pg_repack_all_db', pg_repack_all_db)
+        schedule.every().day.at("03:00").do(run_task, 'auto_backup_daily', auto_backup_postgres, backup_type="daily")
+        schedule.every().day.at("04:00").do(run_task, 'pgroonga_reindex', pgroonga_reindex)
+        schedule.every().day.at("05:00").do(lambda: run_task('auto_backup_weekly', auto_backup_postgres, backup_type="weekly") if datetime.now().weekday() == 6 else None)
+        schedule.every().day.at("06:00").do(lambda: run_task('auto_backup_monthly', auto_backup_postgres, backup_type="monthly") if datetime.now().day == 1 else None)
+        schedule.every().day.at(settings.get('PG_BASEBACKUP_TIME')).do(run_task, 'physical_backup', physical_backup)
+        schedule.every().day.at(settings.get('PG_BACKUP_VERIFY_TIME')).do(run_task, 'verify_backup', verify_backup)
+        schedule.every().day.at(settings.get('MINIO_BACKUP_TIME')).do(run_task, 'minio_backup', minio_backup)
+        schedule.every().day.at(settings.get('REDIS_BACKUP_TIME')).do(run_task, 'redis_backup', redis_backup)
     # 毎朝8時にメンテナンスレポートを送信
-    schedule.every().day.at("08:00").do(daily_maintenance_report)
+    schedule.every().day.at("08:00").do(run_task, 'daily_maintenance_report', daily_maintenance_report)
+
+    # Prometheus形式のメトリクスを公開する（docker-compose.ymlで15000:5000に公開している）
+    if settings.get('METRICS'):
+        start_metrics_server(settings.connection_info(), setup_logger(name='metrics'),
+                             port=settings.get('METRICS_PORT'))
+
+    # WALの継続的なアーカイブ（ポイントインタイムリカバリ用）
+    if settings.get('PG_WAL_ARCHIVE'):
+        start_wal_receiver(settings.connection_info(), setup_logger(name='wal_receiver'),
+                           slot_name=settings.get('PG_WAL_SLOT'))
 
     # スケジューラー起動をログに記録
     # 現在の時間を取得してフォーマット
@@ -0,0 +1,259 @@
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backup_catalog import backup_summary
+from backup_preflight import BACKUP_ROOT
+from db import add_query_hook
+from pg_bloat import estimate_bloat
+from pg_replica import read_connection_info, REPLICA
+from postgres import get_database_size
+from system_check import get_disk_usage
+from task_history import latest_task_runs, last_successful_runs
+
+# メトリクスの名前の接頭辞
+PREFIX = 'mensis'
+# 肥大化のゲージを出すテーブルとインデックスの数（ラベルの種類が増えすぎないようにする）
+BLOAT_TOP_N = 10
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _timestamp(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+
+class _Metric:
+    """
+    Prometheusのテキスト形式で出力する1つのメトリクス
+    """
+
+    def __init__(self, name, help_text, metric_type='gauge'):
+        self.name = f"{PREFIX}_{name}"
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.samples = []
+
+    def add(self, value, **labels):
+        if value is not None:
+            self.samples.append((labels, value))
+        return self
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for labels, value in self.samples:
+            label_str = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            lines.append(f"{self.name}{{{label_str}}} {float(value)}" if label_str else f"{self.name} {float(value)}")
+        return '\n'.join(lines)
+
+
+class _QueryStats:
+    """
+    dbモジュールのクエリフックから、データベースごとのクエリ数・所要時間・失敗数を集計する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def hook(self, sql, elapsed, dbname, error):
+        with self._lock:
+            stats = self._stats.setdefault(dbname, {'count': 0, 'seconds': 0.0, 'errors': 0})
+            stats['count'] += 1
+            stats['seconds'] += elapsed
+            if error is not None:
+                stats['errors'] += 1
+
+    def collect(self):
+        with self._lock:
+            snapshot = {dbname: dict(stats) for dbname, stats in self._stats.items()}
+        count = _Metric('db_queries_total', 'Queries issued through the shared connection pool', 'counter')
+        seconds = _Metric('db_query_seconds_total', 'Total time spent in queries', 'counter')
+        errors = _Metric('db_query_errors_total', 'Queries that raised an error', 'counter')
+        for dbname, stats in snapshot.items():
+            count.add(stats['count'], database=dbname)
+            seconds.add(stats['seconds'], database=dbname)
+            errors.add(stats['errors'], database=dbname)
+        return [count, seconds, errors]
+
+
+class MetricsCollector:
+    """
+    スクレイプのたびにメトリクスを集める
+    Postgresへの問い合わせは重く、停止中は接続のタイムアウトまで待たされるため、
+    別スレッドで定期的に取り直した結果を返す
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報。Noneの場合はPostgresのメトリクスを出さない
+        logger: ロガーインスタンス
+        pg_interval (int): Postgresのサイズと肥大化を取り直す間隔（秒）
+        disk_paths (list): ディスク使用量を出すパス
+    """
+
+    def __init__(self, connection_info, logger, pg_interval=600, disk_paths=('/', str(BACKUP_ROOT))):
+        self.connection_info = connection_info
+        self.logger = logger
+        self.pg_interval = pg_interval
+        self.disk_paths = disk_paths
+        self.query_stats = _QueryStats()
+        # Postgresのメトリクスの前回の結果（成功したかどうか, メトリクスのリスト）
+        self._postgres = (None, [])
+
+    def _refresh_postgres(self):
+        while True:
+            try:
+                self._postgres = (True, self._collect_postgres())
+            except Exception as e:
+                self.logger.error(f"Failed to collect postgres metrics: {str(e)}")
+                self._postgres = (False, [])
+            time.sleep(self.pg_interval)
+
+    def start(self):
+        """
+        Postgresのメトリクスを定期的に取り直すスレッドを起動する
+        """
+        if self.connection_info is not None:
+            threading.Thread(target=self._refresh_postgres, name='metrics-postgres', daemon=True).start()
+
+    def _cached_postgres(self):
+        ok, metrics = self._postgres
+        if ok is False:
+            raise RuntimeError('last postgres collection failed')
+        return metrics
+
+    def _collect_tasks(self):
+        latest = latest_task_runs()
+        succeeded = last_successful_runs()
+        status = _Metric('task_last_status', 'Status of the last run (1=success, 0=failed, 2=skipped)')
+        finished = _Metric('task_last_run_timestamp_seconds', 'Unix time the last run finished')
+        duration = _Metric('task_last_duration_seconds', 'Duration of the last run')
+        processed = _Metric('task_last_bytes_processed', 'Bytes processed by the last run')
+        throughput = _Metric('task_last_throughput_bytes_per_second', 'Throughput of the last run')
+        last_success = _Metric('task_last_success_timestamp_seconds', 'Unix time of the last successful run')
+        for task, run in latest.items():
+            status.add({'success': 1, 'failed': 0, 'skipped': 2}[run['status']], task=task)
+            finished.add(_timestamp(run['finished_at']), task=task)
+            duration.add(run['duration'], task=task)
+            processed.add(run['bytes_processed'], task=task)
+            throughput.add(run['throughput'], task=task)
+        for task, run in succeeded.items():
+            last_success.add(_timestamp(run['finished_at']), task=task)
+        return [status, finished, duration, processed, throughput, last_success]
+
+    def _collect_backups(self):
+        count = _Metric('backup_count', 'Backups currently kept')
+        total = _Metric('backup_total_bytes', 'Total size of the backups currently kept')
+        size = _Metric('backup_last_size_bytes', 'Size of the latest backup')
+        raw = _Metric('backup_last_raw_bytes', 'Uncompressed size of the latest backup')
+        duration = _Metric('backup_last_duration_seconds', 'Duration of the latest backup')
+        created = _Metric('backup_last_timestamp_seconds', 'Unix time the latest backup was created')
+        for row in backup_summary():
+            labels = {'kind': row['kind'], 'tier': row['tier']}
+            count.add(row['count'], **labels)
+            total.add(row['total_size'], **labels)
+            size.add(row['size'], **labels)
+            raw.add(row['raw_bytes'], **labels)
+            duration.add(row['duration'], **labels)
+            created.add(_timestamp(row['created_at']), **labels)
+        return [count, total, size, raw, duration, created]
+
+    def _collect_disk(self):
+        total = _Metric('disk_total_bytes', 'Disk capacity')
+        used = _Metric('disk_used_bytes', 'Disk space used')
+        free = _Metric('disk_free_bytes', 'Disk space available')
+        percent = _Metric('disk_used_percent', 'Disk usage in percent')
+        for path in self.disk_paths:
+            disk = get_disk_usage(path)
+            if 'error' in disk:
+                continue
+            total.add(disk['total'], path=path)
+            used.add(disk['used'], path=path)
+            free.add(disk['free'], path=path)
+            percent.add(disk['percent'], path=path)
+        return [total, used, free, percent]
+
+    def _collect_postgres(self):
+        # サイズと肥大化の推定はレプリカでも同じ値になるため、使える場合はレプリカに問い合わせる
+        connection_info, source = read_connection_info(self.connection_info, self.logger, 'metrics')
+        from_replica = _Metric('postgres_stats_from_replica', 'Whether size and bloat were read from the replica')
+        from_replica.add(1 if source == REPLICA else 0)
+        size = _Metric('postgres_database_bytes', 'Total size of all databases')
+        size.add(get_database_size(connection_info))
+        # 統計情報からの推定はpgstattupleと違ってテーブルを読まないため、定期的に取っても負荷にならない
+        method, estimates = estimate_bloat(connection_info, self.logger, use_pgstattuple=False)
+        reclaimable_total = _Metric('postgres_bloat_reclaimable_bytes_total',
+                                    'Estimated reclaimable bytes across tables and btree indexes')
+        reclaimable_total.add(sum(e['reclaimable'] for e in estimates))
+        reclaimable = _Metric('postgres_bloat_reclaimable_bytes', 'Estimated reclaimable bytes of the most bloated objects')
+        ratio = _Metric('postgres_bloat_ratio', 'Estimated reclaimable fraction of the most bloated objects')
+        for estimate in estimates[:BLOAT_TOP_N]:
+            labels = {'kind': estimate['kind'], 'name': f"{estimate['schema']}.{estimate['name']}"}
+            reclaimable.add(estimate['reclaimable'], **labels)
+            ratio.add(estimate['ratio'], **labels)
+        return [from_replica, size, reclaimable_total, reclaimable, ratio]
+
+    def collect(self):
+        """
+        すべてのメトリクスをPrometheusのテキスト形式で返す
+        収集元の1つが失敗しても、他のメトリクスは出力する
+        """
+        sources = [
+            ('tasks', self._collect_tasks),
+            ('backups', self._collect_backups),
+            ('disk', self._collect_disk),
+            ('postgres', self._cached_postgres),
+            ('db', self.query_stats.collect),
+        ]
+        metrics = []
+        up = _Metric('collector_up', 'Whether the collector succeeded (1) or failed (0)')
+        for name, collect in sources:
+            try:
+                metrics.extend(collect())
+                up.add(1, collector=name)
+            except Exception as e:
+                self.logger.error(f"Failed to collect {name} metrics: {str(e)}")
+                up.add(0, collector=name)
+        metrics.append(up)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def start_metrics_server(connection_info, logger, port=5000, host='0.0.0.0'):
+    """
+    メトリクスを /metrics で返すHTTPサーバーを別スレッドで起動する
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+        port (int): 待ち受けるポート（docker-compose.ymlで15000に公開している）
+        host (str): 待ち受けるアドレス
+
+    Returns:
+        ThreadingHTTPServer: 起動したサーバー
+    """
+    collector = MetricsCollector(connection_info, logger)
+    add_query_hook(collector.query_stats.hook)
+    collector.start()
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            body = collector.collect().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # アクセスごとのログはpython.logに残さない
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Metrics server listening on {host}:{port}")
+    return server
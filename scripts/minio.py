@@ -0,0 +1,331 @@
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from backup_catalog import record_backup, list_backups, mark_deleted
+from load_env import get_settings
+from object_storage import create_s3_client, endpoint_url
+
+# MinIOのバックアップの保存先
+MINIO_BACKUP_DIR = Path('/backup/minio')
+# 一覧の取得結果を索引と比較する一時テーブルへ一度に書き込む件数
+LISTING_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    objects INTEGER,
+    total_bytes INTEGER,
+    new_objects INTEGER,
+    new_bytes INTEGER,
+    removed_objects INTEGER,
+    failed_objects INTEGER,
+    elapsed REAL
+);
+-- オブジェクトの各版が存在した世代の範囲を記録する（added_gen <= 世代 < removed_gen）
+-- 変更・削除されたオブジェクトの行だけを更新するため、世代ごとに全オブジェクトを複製しない
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT NOT NULL,
+    etag TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime TEXT,
+    blob TEXT NOT NULL,
+    added_gen INTEGER NOT NULL,
+    removed_gen INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_versions_live ON versions (key) WHERE removed_gen IS NULL;
+CREATE INDEX IF NOT EXISTS idx_versions_removed ON versions (removed_gen) WHERE removed_gen IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_versions_blob ON versions (blob);
+"""
+
+
+def _open_index(backup_dir):
+    conn = sqlite3.connect(Path(backup_dir) / 'index.db', timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def _blob_name(etag, size):
+    # ETagとサイズが同じオブジェクトは同じ内容として1つの実体を共有する
+    etag = etag.strip('"').replace('/', '_')
+    return f"{etag[:2]}/{etag}-{size}"
+
+
+def create_minio_client(max_connections=10):
+    """
+    .envのMINIO_*からMinIOのクライアントを作成する
+    """
+    settings = get_settings()
+    return create_s3_client(
+        endpoint_url(settings.get('MINIO_HOST'), settings.get('MINIO_PORT')),
+        settings.get('MINIO_ACCESS_KEY'),
+        settings.get('MINIO_SECRET_KEY'),
+        max_connections=max_connections
+    )
+
+
+def _download(client, bucket, key, size, blob_path):
+    """
+    オブジェクトを一時ファイルへダウンロードし、サイズを確認してから確定させる
+    """
+    part_path = blob_path.with_name(blob_path.name + '.part')
+    part_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        client.download_file(bucket, key, str(part_path))
+        downloaded = part_path.stat().st_size
+        if downloaded != size:
+            raise IOError(f"Size mismatch for {key}: expected {size}, got {downloaded}")
+        os.replace(part_path, blob_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+
+
+def backup_minio_bucket(logger, bucket=None, backup_dir=MINIO_BACKUP_DIR, workers=8, client=None):
+    """
+    MinIOのバケットを差分バックアップし、新しい世代として記録する
+    バケットの一覧をローカルの索引（キー、ETag、サイズ、更新日時）と比較し、
+    新規・変更されたオブジェクトだけを並列にダウンロードする
+
+    Args:
+        logger: ロガーインスタンス
+        bucket (str): バックアップするバケット。Noneの場合はMINIO_BUCKET
+        backup_dir (Path): バックアップの保存先
+        workers (int): 並列ダウンロード数
+        client: S3クライアント。Noneの場合は.envの設定から作成する
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+            統計情報の辞書には以下が含まれる:
+            - generation: 作成した世代の番号
+            - objects: バケット内のオブジェクト数
+            - total_bytes: バケット内のオブジェクトの合計サイズ
+            - new_objects / new_bytes: 今回ダウンロードしたオブジェクト数とサイズ
+            - removed_objects: 前回から削除されたオブジェクト数
+            - failed_objects: ダウンロードに失敗したオブジェクト数（次回再試行される）
+            - elapsed: 処理時間（秒）
+    """
+    bucket = bucket or get_settings().get('MINIO_BUCKET')
+    backup_dir = Path(backup_dir)
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    blob_dir = backup_dir / 'blobs'
+    start_time = time.time()
+
+    try:
+        if client is None:
+            client = create_minio_client(max_connections=workers * 2)
+        conn = _open_index(backup_dir)
+    except Exception as e:
+        error_msg = f"Error setting up MinIO backup: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+    generation = None
+    try:
+        with conn:
+            generation = conn.execute(
+                "INSERT INTO generations (created_at, bucket) VALUES (?, ?)",
+                (datetime.now().isoformat(), bucket)
+            ).lastrowid
+
+        # 1. バケットの一覧を一時テーブルに書き込む（数百万件でもメモリに載せない）
+        logger.info(f"Listing objects in bucket {bucket}")
+        conn.execute("CREATE TEMP TABLE listing (key TEXT PRIMARY KEY, etag TEXT, size INTEGER, mtime TEXT)")
+        paginator = client.get_paginator('list_objects_v2')
+        batch = []
+        for page in paginator.paginate(Bucket=bucket):
+            for obj in page.get('Contents', []):
+                batch.append((obj['Key'], obj['ETag'].strip('"'), obj['Size'], obj['LastModified'].isoformat()))
+            if len(batch) >= LISTING_BATCH:
+                conn.executemany("INSERT INTO listing VALUES (?, ?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT INTO listing VALUES (?, ?, ?, ?)", batch)
+
+        objects, total_bytes = conn.execute("SELECT count(*), coalesce(sum(size), 0) FROM listing").fetchone()
+
+        # 2. 索引と比較して新規・変更されたオブジェクトを求める
+        changed = conn.execute(
+            """
+            SELECT l.key, l.etag, l.size, l.mtime FROM listing l
+            LEFT JOIN versions v ON v.key = l.key AND v.removed_gen IS NULL
+            WHERE v.key IS NULL OR v.etag != l.etag OR v.size != l.size
+            """
+        ).fetchall()
+        logger.info(f"{len(changed)} of {objects} object(s) are new or changed")
+
+        # 3. 実体がまだないものだけを並列にダウンロードする
+        pending = {}
+        for key, etag, size, mtime in changed:
+            blob = _blob_name(etag, size)
+            if not (blob_dir / blob).exists():
+                pending.setdefault(blob, (key, size))
+
+        new_bytes = 0
+        failed = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='minio-backup') as executor:
+            futures = {
+                executor.submit(_download, client, bucket, key, size, blob_dir / blob): (blob, key, size)
+                for blob, (key, size) in pending.items()
+            }
+            for future in as_completed(futures):
+                blob, key, size = futures[future]
+                try:
+                    future.result()
+                    new_bytes += size
+                except Exception as e:
+                    failed.add(blob)
+                    logger.error(f"Failed to download {key}: {e}")
+
+        # 4. 索引を更新する（失敗したものは旧版を残し、次回に再試行する）
+        succeeded = [(key, etag, size, mtime, _blob_name(etag, size)) for key, etag, size, mtime in changed
+                     if _blob_name(etag, size) not in failed]
+        with conn:
+            conn.executemany(
+                "UPDATE versions SET removed_gen = ? WHERE key = ? AND removed_gen IS NULL",
+                [(generation, key) for key, *_ in succeeded]
+            )
+            conn.executemany(
+                "INSERT INTO versions (key, etag, size, mtime, blob, added_gen) VALUES (?, ?, ?, ?, ?, ?)",
+                [(key, etag, size, mtime, blob, generation) for key, etag, size, mtime, blob in succeeded]
+            )
+            # バケットから削除されたオブジェクトは、この世代から存在しないものとして記録する
+            removed = conn.execute(
+                """
+                UPDATE versions SET removed_gen = ?
+                WHERE removed_gen IS NULL AND key NOT IN (SELECT key FROM listing)
+                """,
+                (generation,)
+            ).rowcount
+
+            elapsed = time.time() - start_time
+            conn.execute(
+                """
+                UPDATE generations SET objects = ?, total_bytes = ?, new_objects = ?, new_bytes = ?,
+                                       removed_objects = ?, failed_objects = ?, elapsed = ?
+                WHERE id = ?
+                """,
+                (objects, total_bytes, len(pending) - len(failed), new_bytes, removed, len(failed), elapsed,
+                 generation)
+            )
+        conn.execute("DROP TABLE listing")
+
+        stats = {
+            'path': backup_dir / f'generation-{generation}',
+            'generation': generation,
+            'objects': objects,
+            'total_bytes': total_bytes,
+            'new_objects': len(pending) - len(failed),
+            'new_bytes': new_bytes,
+            'removed_objects': removed,
+            'failed_objects': len(failed),
+            'elapsed': elapsed,
+            'throughput': new_bytes / elapsed if elapsed > 0 else 0,
+        }
+        record_backup('minio', 'daily', stats['path'], engine='incremental', size=new_bytes,
+                      raw_bytes=total_bytes, duration=elapsed)
+        logger.info(
+            f"MinIO backup generation {generation}: {stats['new_objects']} new object(s) "
+            f"({new_bytes} bytes), {removed} removed, {len(failed)} failed in {elapsed:.1f}s"
+        )
+        return not failed, stats
+
+    except Exception as e:
+        error_msg = f"Error during MinIO backup: {str(e)}"
+        logger.error(error_msg)
+        # 索引は最後にまとめて更新するため、途中で失敗した世代は記録ごと取り消す
+        if generation is not None:
+            with conn:
+                conn.execute("DELETE FROM generations WHERE id = ?", (generation,))
+        return False, error_msg
+
+    finally:
+        conn.close()
+
+
+def prune_minio_generations(retention_count, logger, backup_dir=MINIO_BACKUP_DIR):
+    """
+    保持数を超える古い世代を削除する
+    残す世代のいずれにも含まれない版を索引から削除し、どの版からも参照されなくなった実体を削除する
+
+    Returns:
+        tuple: (削除した世代数, 削除した実体の数, 解放したバイト数)
+    """
+    backup_dir = Path(backup_dir)
+    conn = _open_index(backup_dir)
+    try:
+        generations = [row[0] for row in conn.execute("SELECT id FROM generations ORDER BY id DESC")]
+        if len(generations) <= retention_count:
+            return 0, 0, 0
+        expired = generations[retention_count:]
+        oldest_kept = generations[retention_count - 1] if retention_count > 0 else generations[0] + 1
+
+        with conn:
+            # 残す一番古い世代より前に削除された版は、どの世代の復元にも使われない
+            orphaned = conn.execute(
+                """
+                SELECT DISTINCT blob FROM versions WHERE removed_gen <= ?
+                """,
+                (oldest_kept,)
+            ).fetchall()
+            conn.execute("DELETE FROM versions WHERE removed_gen <= ?", (oldest_kept,))
+            conn.executemany("DELETE FROM generations WHERE id = ?", [(g,) for g in expired])
+
+        removed_blobs = 0
+        freed = 0
+        for (blob,) in orphaned:
+            if conn.execute("SELECT 1 FROM versions WHERE blob = ? LIMIT 1", (blob,)).fetchone():
+                continue
+            blob_path = backup_dir / 'blobs' / blob
+            if blob_path.exists():
+                freed += blob_path.stat().st_size
+                blob_path.unlink()
+                removed_blobs += 1
+    finally:
+        conn.close()
+
+    # カタログ上の世代も削除済みにする
+    expired_paths = {str(backup_dir / f'generation-{g}') for g in expired}
+    for backup in list_backups('minio', 'daily'):
+        if backup['path'] in expired_paths:
+            mark_deleted(backup['id'])
+
+    logger.info(f"Removed {len(expired)} old MinIO generation(s), {removed_blobs} object(s), freed {freed} bytes")
+    return len(expired), removed_blobs, freed
+
+
+def restore_minio_generation(generation, dest_dir, logger, backup_dir=MINIO_BACKUP_DIR):
+    """
+    指定した世代のバケットの内容を、キーをパスとしてdest_dirへ書き出す（可能な場合はハードリンク）
+
+    Returns:
+        int: 書き出したオブジェクト数
+    """
+    backup_dir = Path(backup_dir)
+    dest_dir = Path(dest_dir)
+    conn = _open_index(backup_dir)
+    try:
+        rows = conn.execute(
+            """
+            SELECT key, blob FROM versions
+            WHERE added_gen <= ? AND (removed_gen IS NULL OR removed_gen > ?)
+            """,
+            (generation, generation)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    for key, blob in rows:
+        target = dest_dir / key
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(backup_dir / 'blobs' / blob, target)
+        except OSError:
+            shutil.copy2(backup_dir / 'blobs' / blob, target)
+    logger.info(f"Restored {len(rows)} object(s) from MinIO generation {generation} to {dest_dir}")
+    return len(rows)
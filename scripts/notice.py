@@ -1,58 +1,61 @@
-import os
-import sys
+import queue
+import threading
+import time
 import requests
-import json
-from pathlib import Path
-import dotenv
-from load_env import load_env
+from load_env import get_settings
 from custom_logging import setup_logger
 
+# 接続とレスポンスのタイムアウト（秒）
+REQUEST_TIMEOUT = (5, 30)
+# 送信の最大試行回数
+MAX_ATTEMPTS = 5
+# 再試行の待ち時間の初期値と上限（秒）
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+# ノートの最大文字数（Misskeyの既定値）
+MAX_NOTE_LENGTH = 3000
+# まとめた通知の区切り
+COALESCE_SEPARATOR = "\n\n―――――\n\n"
 
-# 以下、残りのコードは変更なし
 
-
-def sendDM_misskey_notification(text, visibility="specified", visible_user_ids=None, cw=None, local_only=False):
+class MisskeyNotifier:
     """
-    Misskeyに投稿を送信する関数
-    
+    Misskeyへの通知を送るクライアント
+    HTTPセッションを使い回し、通知はキューに入れて別スレッドで送るため、呼び出し側は送信を待たない
+    短い間隔で続いた同じ宛先への通知は1つのノートにまとめる
+
     Args:
-        text (str): 投稿するテキスト内容
-        visibility (str): 投稿の公開範囲 ("public", "home", "followers", "specified")
-        visible_user_ids (list): visibilityが"specified"の場合、表示を許可するユーザーIDのリスト
-        cw (str): コンテンツ警告（任意）
-        local_only (bool): ローカルのみに投稿するかどうか
-        
-    Returns:
-        dict: API応答のJSON、または失敗時にはNone
+        host (str): Misskeyのホスト名
+        token (str): 通知を送るユーザーのAPIトークン
+        target_user_id (str): DMの送信先のユーザーID
+        logger: ロガーインスタンス
+        coalesce_seconds (float): 通知をまとめるために次の通知を待つ時間（秒）。0の場合はまとめない
     """
-    logger = setup_logger(name='sendDM_misskey_notification')
-    try:
-        # 環境変数の読み込み
-        env_config = load_env()
-        
-        # Misskey関連の設定を取得
-        misskey_host = os.getenv('MISSKEY_HOST')
-        token = os.getenv('MISSKEY_NOTICE_USER_TOKEN')
-        
-        if not misskey_host or not token:
-            logger.error("MISSKEY_HOST or MISSKEY_NOTICE_USER_TOKEN not found in environment variables")
-            return None
-        
-        # APIエンドポイントの構築
-        url = f"https://{misskey_host}/api/notes/create"
-        
-        # ヘッダーの設定
-        headers = {
+
+    def __init__(self, host, token, target_user_id, logger, coalesce_seconds=5):
+        self.logger = logger
+        self.session = requests.Session()
+        self.configure(host, token, target_user_id, coalesce_seconds)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='misskey-notifier', daemon=True)
+        self._worker.start()
+
+    def configure(self, host, token, target_user_id, coalesce_seconds=5):
+        """
+        送信先と認証情報を設定する（.envが変更された場合も、キューとセッションはそのまま使う）
+        """
+        self.url = f"https://{host}/api/notes/create"
+        self.target_user_id = target_user_id
+        self.coalesce_seconds = coalesce_seconds
+        self.session.headers.update({
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
-        }
-        
+        })
+
+    def _payload(self, text, visibility, visible_user_ids, cw, local_only):
         # 可視性設定
         if visible_user_ids is None and visibility == "specified":
-            target_user_id = os.getenv('MISSKEY_TEARGET_USER_ID')
-            visible_user_ids = [target_user_id] if target_user_id else []
-        
-        # ペイロードの構築
+            visible_user_ids = [self.target_user_id] if self.target_user_id else []
         payload = {
             "visibility": visibility,
             "visibleUserIds": visible_user_ids or [],
@@ -65,92 +68,178 @@ def sendDM_misskey_notification(text, visibility="specified", visible_user_ids=N
             "channelId": None,
             "text": text
         }
-        
         # 不要なNoneの値を削除
-        payload = {k: v for k, v in payload.items() if v is not None}
-        
-        # リクエスト送信
-        logger.info(f"Sending notification to Misskey: {url}")
-        print(f"Sending notification to Misskey: {url}")
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # レスポンスの確認
-        response.raise_for_status()
-        logger.info(f"Notification sent successfully: {response.status_code}")
-        print(f"Notification sent successfully: {response.status_code}")
-        return response.json()
-        
-    except Exception as e:
-        logger.error(f"Failed to send notification to Misskey: {e}")
-        return
+        return {k: v for k, v in payload.items() if v is not None}
 
+    def post(self, payload):
+        """
+        ノートを作成する。429（レート制限）と5xx、通信エラーの場合は待ってから再試行する
 
+        Returns:
+            dict: API応答のJSON、または失敗時にはNone
+        """
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            wait = min(BACKOFF_BASE ** attempt, BACKOFF_MAX)
+            try:
+                response = self.session.post(self.url, json=payload, timeout=REQUEST_TIMEOUT)
+                if response.status_code == 429:
+                    # Retry-Afterがあればそれに従う
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after and retry_after.isdigit():
+                        wait = min(int(retry_after), BACKOFF_MAX)
+                    self.logger.warning(f"Misskey rate limit reached. Retrying in {wait}s ({attempt}/{MAX_ATTEMPTS})")
+                elif response.status_code >= 500:
+                    self.logger.warning(f"Misskey returned {response.status_code}. Retrying in {wait}s ({attempt}/{MAX_ATTEMPTS})")
+                else:
+                    # 4xxは再試行しても結果が変わらない
+                    response.raise_for_status()
+                    self.logger.info(f"Notification sent successfully: {response.status_code}")
+                    return response.json()
+            except requests.HTTPError as e:
+                self.logger.error(f"Failed to send notification to Misskey: {e}")
+                return None
+            except requests.RequestException as e:
+                self.logger.warning(f"Failed to reach Misskey: {e}. Retrying in {wait}s ({attempt}/{MAX_ATTEMPTS})")
+            if attempt < MAX_ATTEMPTS:
+                time.sleep(wait)
+        self.logger.error(f"Failed to send notification to Misskey after {MAX_ATTEMPTS} attempts")
+        return None
 
-def post_misskey_notification(text, visibility="public", visible_user_ids=None, cw=None, local_only=False):
+    def send(self, text, visibility="specified", visible_user_ids=None, cw=None, local_only=False):
+        """
+        通知をキューに入れる（送信は別スレッドで行う）
+        """
+        self._queue.put((text, (visibility, tuple(visible_user_ids or ()), cw, local_only)))
+
+    def _coalesce(self, first):
+        # 同じ宛先の通知が続く間はまとめ、宛先が違う通知や文字数の上限を超える通知は次に回す
+        texts, key = [first[0]], first[1]
+        length = len(first[0])
+        deadline = time.time() + self.coalesce_seconds
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return texts, key, None
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return texts, key, None
+            if item is None:
+                # flushによる待ち時間の打ち切り
+                self._queue.task_done()
+                return texts, key, None
+            if item[1] != key or \
+                    length + len(COALESCE_SEPARATOR) + len(item[0]) > MAX_NOTE_LENGTH:
+                return texts, key, item
+            texts.append(item[0])
+            length += len(COALESCE_SEPARATOR) + len(item[0])
+            self._queue.task_done()
+
+    def _run(self):
+        pending = None
+        while True:
+            item = pending if pending is not None else self._queue.get()
+            pending = None
+            if item is None:
+                self._queue.task_done()
+                continue
+            try:
+                texts, key, pending = self._coalesce(item)
+                visibility, visible_user_ids, cw, local_only = key
+                if len(texts) > 1:
+                    self.logger.info(f"Coalesced {len(texts)} notifications into one note")
+                self.post(self._payload(COALESCE_SEPARATOR.join(texts), visibility, list(visible_user_ids) or None,
+                                        cw, local_only))
+            except Exception as e:
+                self.logger.error(f"Failed to send notification to Misskey: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """
+        キューに入っている通知がすべて送られるまで待つ（プロセスの終了前に呼ぶ）
+
+        Returns:
+            bool: 時間内にすべて送れたかどうか
+        """
+        # まとめるための待ち時間を打ち切る
+        self._queue.put(None)
+        deadline = None if timeout is None else time.time() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+_NOTIFIER = None
+# 通知クライアントの作成に使った設定
+_NOTIFIER_SETTINGS = None
+_NOTIFIER_LOCK = threading.Lock()
+
+
+def get_notifier():
     """
-    Misskeyに投稿を送信する関数
-    
+    共有の通知クライアントを返す（初回に作成し、.envの変更後は設定を入れ替える）。設定がない場合はNone
+    """
+    global _NOTIFIER, _NOTIFIER_SETTINGS
+    settings = get_settings()
+    config = (settings.get('MISSKEY_HOST'), settings.get('MISSKEY_NOTICE_USER_TOKEN'),
+              settings.get('MISSKEY_TEARGET_USER_ID'), settings.get('MISSKEY_NOTICE_COALESCE_SECONDS'))
+    with _NOTIFIER_LOCK:
+        if config == _NOTIFIER_SETTINGS:
+            return _NOTIFIER
+        misskey_host, token = config[0], config[1]
+        if not misskey_host or not token:
+            setup_logger(name='misskey_notifier').error(
+                "MISSKEY_HOST or MISSKEY_NOTICE_USER_TOKEN not found in environment variables")
+            return _NOTIFIER
+        if _NOTIFIER is None:
+            _NOTIFIER = MisskeyNotifier(*config[:3], setup_logger(name='misskey_notifier'), coalesce_seconds=config[3])
+        else:
+            _NOTIFIER.configure(*config)
+        _NOTIFIER_SETTINGS = config
+        return _NOTIFIER
+
+
+def sendDM_misskey_notification(text, visibility="specified", visible_user_ids=None, cw=None, local_only=False):
+    """
+    Misskeyに投稿を送信する関数（送信先のユーザーへのDM）
+    送信は別スレッドで行い、続けて送られた通知は1つのノートにまとめる
+
     Args:
         text (str): 投稿するテキスト内容
         visibility (str): 投稿の公開範囲 ("public", "home", "followers", "specified")
         visible_user_ids (list): visibilityが"specified"の場合、表示を許可するユーザーIDのリスト
         cw (str): コンテンツ警告（任意）
         local_only (bool): ローカルのみに投稿するかどうか
-        
-    Returns:
-        dict: API応答のJSON、または失敗時にはNone
     """
-    logger = setup_logger(name='post_misskey_notification')
     try:
-        # 環境変数の読み込み
-        env_config = load_env()
-        
-        # Misskey関連の設定を取得
-        misskey_host = os.getenv('MISSKEY_HOST')
-        token = os.getenv('MISSKEY_NOTICE_USER_TOKEN')
-        
-        if not misskey_host or not token:
-            logger.error("MISSKEY_HOST or MISSKEY_NOTICE_USER_TOKEN not found in environment variables")
-            return None
-        
-        # APIエンドポイントの構築
-        url = f"https://{misskey_host}/api/notes/create"
-        
-        # ヘッダーの設定
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
-        
-       
-        # ペイロードの構築
-        payload = {
-            "visibility": visibility,
-            "visibleUserIds": visible_user_ids or [],
-            "cw": cw,
-            "localOnly": local_only,
-            "reactionAcceptance": None,
-            "noExtractMentions": False,
-            "noExtractHashtags": False,
-            "noExtractEmojis": False,
-            "channelId": None,
-            "text": text
-        }
-        
-        # 不要なNoneの値を削除
-        payload = {k: v for k, v in payload.items() if v is not None}
-        
-        # リクエスト送信
-        logger.info(f"Sending notification to Misskey: {url}")
-        print(f"Sending notification to Misskey: {url}")
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # レスポンスの確認
-        response.raise_for_status()
-        logger.info(f"Notification sent successfully: {response.status_code}")
-        print(f"Notification sent successfully: {response.status_code}")
-        return response.json()
-        
+        notifier = get_notifier()
+        if notifier is not None:
+            notifier.send(text, visibility, visible_user_ids, cw, local_only)
     except Exception as e:
-        logger.error(f"Failed to send notification to Misskey: {e}")
-        return
\ No newline at end of file
+        setup_logger(name='sendDM_misskey_notification').error(f"Failed to queue notification to Misskey: {e}")
+
+
+def post_misskey_notification(text, visibility="public", visible_user_ids=None, cw=None, local_only=False):
+    """
+    Misskeyに投稿を送信する関数（公開のノート）
+
+    Args:
+        text (str): 投稿するテキスト内容
+        visibility (str): 投稿の公開範囲 ("public", "home", "followers", "specified")
+        visible_user_ids (list): visibilityが"specified"の場合、表示を許可するユーザーIDのリスト
+        cw (str): コンテンツ警告（任意）
+        local_only (bool): ローカルのみに投稿するかどうか
+    """
+    sendDM_misskey_notification(text, visibility, visible_user_ids, cw, local_only)
+
+
+def flush_notifications(timeout=60):
+    """
+    送信待ちの通知をすべて送る（--runで1つのタスクを実行して終了する場合など）
+    """
+    if _NOTIFIER is not None:
+        return _NOTIFIER.flush(timeout)
+    return True
@@ -0,0 +1,383 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from backup_catalog import record_backup, expired_backups, mark_deleted
+from load_env import get_settings
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+except ImportError:  # S3/MinIOへのアップロードはオプション（pip install boto3）
+    boto3 = None
+
+# マルチパートアップロードの既定のパートサイズと並列数
+DEFAULT_PART_SIZE = 64 * 1024 * 1024  # 64MB
+DEFAULT_CONCURRENCY = 4
+# S3のパートサイズの下限（最後のパートを除く）とパート数の上限
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+# これより古い未完了のマルチパートアップロードは破棄する
+STALE_UPLOAD_AGE = timedelta(days=1)
+
+
+def endpoint_url(host, port=None):
+    """
+    ホスト名（とポート）からエンドポイントのURLを作成する。スキームがない場合はhttp://とみなす
+    """
+    endpoint = host if host.startswith(('http://', 'https://')) else f"http://{host}"
+    if port:
+        endpoint = f"{endpoint}:{port}"
+    return endpoint
+
+
+def create_s3_client(endpoint, access_key, secret_key, region=None, max_connections=10):
+    """
+    S3互換ストレージ（MinIOなど）のクライアントを作成する。endpointがNoneの場合はAWSのS3を使う
+    """
+    if boto3 is None:
+        raise ImportError("Accessing S3-compatible storage requires the 'boto3' package")
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint_url(endpoint) if endpoint else None,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name=region or 'us-east-1',
+        config=BotoConfig(retries={'max_attempts': 5, 'mode': 'standard'},
+                          max_pool_connections=max_connections)
+    )
+
+
+class MultipartUploadWriter:
+    """
+    書き込まれたデータをパートサイズごとに区切り、マルチパートアップロードとして並列に送信する
+    送信中のパートはconcurrency個までに制限するため、メモリ使用量は最大で(concurrency + 1) * part_sizeになる
+    送信に失敗した場合はそれ以降の書き込みを無視し、complete()で失敗を返す
+    （アップロードは中断せずに残すため、upload_fileで同じアップロードを再開できる）
+    """
+
+    def __init__(self, client, bucket, key, part_size, concurrency, logger):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.logger = logger
+        self.upload_id = None
+        self.buffer = bytearray()
+        self.parts = {}
+        self.futures = []
+        self.error = None
+        self.size = 0
+        self.slots = threading.Semaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='s3-upload')
+
+    def write(self, data):
+        if self.error is not None:
+            return len(data)
+        self.buffer += data
+        self.size += len(data)
+        try:
+            while len(self.buffer) >= self.part_size:
+                self._submit(bytes(self.buffer[:self.part_size]))
+                del self.buffer[:self.part_size]
+        except Exception as e:
+            # アップロードの失敗でローカルのバックアップまで止めないように、エラーを記録して以降は無視する
+            self.error = e
+            self.logger.error(f"Failed to start upload of s3://{self.bucket}/{self.key}: {e}")
+        return len(data)
+
+    def _submit(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self.futures) + 1
+        # 送信中のパート数が上限に達している場合は、空きが出るまで書き込み側を待たせる
+        self.slots.acquire()
+        self.futures.append(self.executor.submit(self._upload_part, part_number, body))
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                               PartNumber=part_number, Body=body)
+            self.parts[part_number] = response['ETag']
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+                self.logger.error(f"Failed to upload part {part_number} of s3://{self.bucket}/{self.key}: {e}")
+        finally:
+            self.slots.release()
+
+    def complete(self):
+        """
+        残りのデータを送信してアップロードを完了する
+
+        Returns:
+            tuple: (成功したかどうかのブール値, 送信したバイト数またはエラーメッセージ)
+        """
+        try:
+            if self.error is None and (self.buffer or not self.futures):
+                if not self.futures:
+                    # 1パートに満たない小さなファイルは通常のPUTで送る
+                    self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+                    return True, self.size
+                self._submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            for future in self.futures:
+                future.result()
+            if self.error is not None:
+                return False, str(self.error)
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': self.parts[n]} for n in sorted(self.parts)]}
+            )
+            return True, self.size
+        except Exception as e:
+            return False, str(e)
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def abort(self):
+        """
+        アップロードを中止し、送信済みのパートを破棄する
+        """
+        self.error = self.error or RuntimeError('aborted')
+        self.executor.shutdown(wait=True)
+        if self.upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                self.logger.warning(f"Failed to abort upload of s3://{self.bucket}/{self.key}: {e}")
+
+
+class S3Target:
+    """
+    S3互換ストレージ（MinIOなど）へのバックアップのアップロード先
+    """
+
+    def __init__(self, endpoint, access_key, secret_key, bucket, logger, prefix='mensis',
+                 part_size=DEFAULT_PART_SIZE, concurrency=DEFAULT_CONCURRENCY, region=None):
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.concurrency = concurrency
+        self.logger = logger
+        self.client = create_s3_client(endpoint, access_key, secret_key, region=region,
+                                       max_connections=concurrency * 2)
+
+    @classmethod
+    def from_env(cls, logger):
+        """
+        .envのBACKUP_S3_*からアップロード先を作成する。BACKUP_S3がTrueでない場合はNone
+        """
+        settings = get_settings()
+        if not settings.get('BACKUP_S3'):
+            return None
+        return cls(
+            endpoint=settings.get('BACKUP_S3_ENDPOINT'),
+            access_key=settings.get('BACKUP_S3_ACCESS_KEY'),
+            secret_key=settings.get('BACKUP_S3_SECRET_KEY'),
+            bucket=settings.get('BACKUP_S3_BUCKET'),
+            logger=logger,
+            prefix=settings.get('BACKUP_S3_PREFIX'),
+            part_size=settings.get('BACKUP_S3_PART_SIZE_MB') * 1024 * 1024,
+            concurrency=settings.get('BACKUP_S3_CONCURRENCY', DEFAULT_CONCURRENCY),
+            region=settings.get('BACKUP_S3_REGION')
+        )
+
+    def key_for(self, kind, tier, name):
+        return f"{self.prefix}/{kind}/{tier}/{name}"
+
+    def uri(self, key):
+        return f"s3://{self.bucket}/{key}"
+
+    def _key_from_uri(self, uri):
+        return uri[len(f"s3://{self.bucket}/"):]
+
+    def open_writer(self, key):
+        """
+        ストリームをそのままアップロードするための書き込み先を返す
+        """
+        return MultipartUploadWriter(self.client, self.bucket, key, self.part_size, self.concurrency, self.logger)
+
+    def _part_size_for(self, size):
+        # パート数の上限を超えないようにパートサイズを大きくする
+        return max(self.part_size, -(-size // MAX_PARTS))
+
+    def _find_upload(self, key):
+        """
+        同じキーに対する未完了のマルチパートアップロードを探す（最新のもの）
+        """
+        response = self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=key)
+        uploads = [u for u in response.get('Uploads', []) if u['Key'] == key]
+        if not uploads:
+            return None
+        return max(uploads, key=lambda u: u['Initiated'])['UploadId']
+
+    def _list_parts(self, key, upload_id):
+        parts = {}
+        paginator = self.client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket, Key=key, UploadId=upload_id):
+            for part in page.get('Parts', []):
+                parts[part['PartNumber']] = part
+        return parts
+
+    def upload_file(self, path, key):
+        """
+        ファイルをマルチパートで並列にアップロードする
+        同じキーの未完了のアップロードがあれば、内容が一致する送信済みのパートを再利用して再開する
+
+        Returns:
+            tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+        """
+        path = Path(path)
+        size = path.stat().st_size
+        start_time = time.time()
+        try:
+            if size < MIN_PART_SIZE:
+                with open(path, 'rb') as f:
+                    self.client.put_object(Bucket=self.bucket, Key=key, Body=f)
+                return True, {'key': key, 'size': size, 'elapsed': time.time() - start_time, 'resumed_parts': 0}
+
+            upload_id = self._find_upload(key)
+            existing = {}
+            part_size = self._part_size_for(size)
+            if upload_id is not None:
+                existing = self._list_parts(key, upload_id)
+                if 1 in existing:
+                    # 再開時は送信済みのパートと同じ区切りを使う
+                    part_size = existing[1]['Size']
+            else:
+                upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+            part_count = -(-size // part_size)
+            etags = {}
+            resumed = 0
+            slots = threading.Semaphore(self.concurrency)
+
+            def _upload(part_number):
+                try:
+                    offset = (part_number - 1) * part_size
+                    with open(path, 'rb') as f:
+                        f.seek(offset)
+                        body = f.read(part_size)
+                    part = existing.get(part_number)
+                    # 送信済みのパートはMD5（ETag）が一致する場合のみ再利用する
+                    if part and part['Size'] == len(body) and part['ETag'].strip('"') == hashlib.md5(body).hexdigest():
+                        return part_number, part['ETag'], True
+                    response = self.client.upload_part(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                       PartNumber=part_number, Body=body)
+                    return part_number, response['ETag'], False
+                finally:
+                    slots.release()
+
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='s3-upload') as executor:
+                futures = []
+                for part_number in range(1, part_count + 1):
+                    slots.acquire()
+                    futures.append(executor.submit(_upload, part_number))
+                for future in futures:
+                    part_number, etag, reused = future.result()
+                    etags[part_number] = etag
+                    resumed += reused
+
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': n, 'ETag': etags[n]} for n in sorted(etags)]}
+            )
+            elapsed = time.time() - start_time
+            if resumed:
+                self.logger.info(f"Resumed upload of {key}: reused {resumed}/{part_count} part(s)")
+            return True, {'key': key, 'size': size, 'elapsed': elapsed, 'resumed_parts': resumed}
+
+        except Exception as e:
+            error_msg = f"Failed to upload {path} to {self.uri(key)}: {e}"
+            self.logger.error(error_msg)
+            return False, error_msg
+
+    def upload_path(self, path, key):
+        """
+        ファイルまたはディレクトリ（並列ダンプ）をアップロードする。ディレクトリの場合はkeyを接頭辞として使う
+        """
+        path = Path(path)
+        if not path.is_dir():
+            return self.upload_file(path, key)
+        start_time = time.time()
+        total = 0
+        for file in sorted(p for p in path.rglob('*') if p.is_file()):
+            success, result = self.upload_file(file, f"{key}/{file.relative_to(path).as_posix()}")
+            if not success:
+                return False, result
+            total += result['size']
+        return True, {'key': key, 'size': total, 'elapsed': time.time() - start_time, 'resumed_parts': 0}
+
+    def copy(self, source_key, key):
+        """
+        サーバー側でオブジェクト（と付随するオブジェクト）をコピーする
+
+        Returns:
+            int: コピーしたオブジェクトの数（コピー元がない場合は0）
+        """
+        sources = self._list_keys(source_key)
+        for source in sources:
+            target = key + source[len(source_key):]
+            self.client.copy({'Bucket': self.bucket, 'Key': source}, self.bucket, target)
+        return len(sources)
+
+    def _list_keys(self, key):
+        # keyで始まるオブジェクト（ディレクトリの中身やマニフェストなどの付随ファイルを含む）を返す
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key):
+            keys += [obj['Key'] for obj in page.get('Contents', [])]
+        return keys
+
+    def delete(self, key):
+        """
+        オブジェクト（と付随するオブジェクト）を削除する
+        """
+        keys = self._list_keys(key)
+        for i in range(0, len(keys), 1000):
+            self.client.delete_objects(Bucket=self.bucket, Delete={
+                'Objects': [{'Key': k} for k in keys[i:i + 1000]], 'Quiet': True
+            })
+        return len(keys)
+
+    def abort_stale_uploads(self, kind):
+        """
+        中断されたまま放置されている古いマルチパートアップロードを破棄する
+        """
+        threshold = datetime.now(timezone.utc) - STALE_UPLOAD_AGE
+        response = self.client.list_multipart_uploads(Bucket=self.bucket, Prefix=f"{self.prefix}/{kind}/")
+        for upload in response.get('Uploads', []):
+            if upload['Initiated'] < threshold:
+                self.logger.info(f"Aborting stale upload of {upload['Key']}")
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+
+    def apply_retention(self, kind, tier, retention_count):
+        """
+        ローカルと同じ世代数を超える古いバックアップをストレージから削除する
+        アップロードしたバックアップはカタログに種類's3:<kind>'として記録している
+        """
+        expired = expired_backups(f's3:{kind}', tier, retention_count)
+        for backup in expired:
+            self.logger.info(f"Removing old remote backup: {backup['path']}")
+            self.delete(self._key_from_uri(backup['path']))
+            mark_deleted(backup['id'])
+        self.abort_stale_uploads(kind)
+        return len(expired)
+
+    def record(self, kind, tier, key, stats, engine=None, promoted_from=None):
+        """
+        アップロードしたバックアップをカタログに登録する
+        """
+        return record_backup(
+            f's3:{kind}', tier, self.uri(key),
+            engine=engine,
+            size=stats.get('size'),
+            raw_bytes=stats.get('raw_bytes'),
+            duration=stats.get('elapsed'),
+            codec=stats.get('codec'),
+            sha256=stats.get('sha256'),
+            promoted_from=promoted_from
+        )
@@ -0,0 +1,166 @@
+import math
+from db import query, query_value
+
+# ページ内のヘッダーと、行・インデックスタプルごとの固定サイズ（バイト）
+PAGE_HEADER = 24
+HEAP_TUPLE_HEADER = 24
+INDEX_TUPLE_HEADER = 8
+ITEM_POINTER = 4
+# B-treeインデックスの既定のfillfactor
+BTREE_FILLFACTOR = 90
+
+_TABLES_SQL = """
+SELECT c.oid, n.nspname, c.relname, pg_relation_size(c.oid), c.reltuples,
+       coalesce((SELECT substring(opt FROM 'fillfactor=(\\d+)')::int
+                 FROM unnest(c.reloptions) AS opt WHERE opt LIKE 'fillfactor=%%'), 100),
+       coalesce((SELECT sum((1 - s.null_frac) * s.avg_width) FROM pg_stats s
+                 WHERE s.schemaname = n.nspname AND s.tablename = c.relname), 0),
+       (SELECT count(*) FROM pg_index i WHERE i.indrelid = c.oid),
+       EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = c.oid AND (i.indisprimary OR i.indisunique))
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'repack')
+  AND n.nspname NOT LIKE 'pg_toast%%' AND pg_relation_size(c.oid) >= %s
+"""
+
+_INDEXES_SQL = """
+SELECT ic.oid, n.nspname, ic.relname, tc.relname, pg_relation_size(ic.oid), ic.reltuples, am.amname,
+       coalesce((SELECT sum(s.avg_width) FROM pg_attribute a
+                 JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = tc.relname AND s.attname = a.attname
+                 WHERE a.attrelid = tc.oid AND a.attnum = ANY (i.indkey)), 0)
+FROM pg_index i
+JOIN pg_class ic ON ic.oid = i.indexrelid
+JOIN pg_class tc ON tc.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = ic.relnamespace
+JOIN pg_am am ON am.oid = ic.relam
+WHERE n.nspname NOT IN ('pg_catalog', 'information_schema', 'repack')
+  AND n.nspname NOT LIKE 'pg_toast%%' AND i.indisvalid AND pg_relation_size(ic.oid) >= %s
+"""
+
+
+def has_pgstattuple(connection_info):
+    """
+    pgstattuple拡張が使えるかどうかを返す
+    """
+    return bool(query_value(connection_info, "SELECT 1 FROM pg_extension WHERE extname = 'pgstattuple'"))
+
+
+def _estimate_table_from_stats(size, reltuples, fillfactor, data_width, block_size):
+    # pg_statsの平均列幅から、詰め直した場合のページ数を見積もる
+    if reltuples <= 0:
+        return 0
+    tuple_size = HEAP_TUPLE_HEADER + data_width + ITEM_POINTER
+    tuples_per_page = max(1, math.floor((block_size - PAGE_HEADER) * fillfactor / 100 / tuple_size))
+    expected = math.ceil(reltuples / tuples_per_page) * block_size
+    return max(0, size - expected)
+
+
+def _estimate_index_from_stats(size, reltuples, data_width, block_size):
+    if reltuples <= 0:
+        return 0
+    tuple_size = INDEX_TUPLE_HEADER + data_width + ITEM_POINTER
+    tuples_per_page = max(1, math.floor((block_size - PAGE_HEADER) * BTREE_FILLFACTOR / 100 / tuple_size))
+    # メタページの分を加える
+    expected = (math.ceil(reltuples / tuples_per_page) + 1) * block_size
+    return max(0, size - expected)
+
+
+def estimate_bloat(connection_info, logger, min_bytes=0, use_pgstattuple=None):
+    """
+    テーブルとB-treeインデックスの肥大化を見積もり、回収できるバイト数の大きい順に返す
+    pgstattuple拡張があればpgstattuple_approx/pgstatindexで実測し、なければpg_statsの統計情報から推定する
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+        min_bytes (int): これより小さいオブジェクトは調べない（回収できる量がこれを超えることはないため）
+        use_pgstattuple (bool): pgstattupleを使うかどうか。Noneの場合は拡張の有無で決める
+
+    Returns:
+        tuple: (見積もりの方法 'pgstattuple' または 'statistics', 見積もりの辞書のリスト)
+            各辞書には以下が含まれる:
+            - kind: 'table' または 'index'
+            - schema / name / table: スキーマ名、オブジェクト名、（インデックスの場合は）テーブル名
+            - bytes: 現在のサイズ
+            - reclaimable: 回収できると見積もったバイト数
+            - ratio: サイズに対する回収できる割合
+            - index_count: テーブルのインデックス数（テーブルの場合のみ）
+            - has_unique: 主キーまたは一意制約があるかどうか（pg_repackの対象にできる条件）
+    """
+    if use_pgstattuple is None:
+        use_pgstattuple = has_pgstattuple(connection_info)
+    method = 'pgstattuple' if use_pgstattuple else 'statistics'
+    block_size = int(query_value(connection_info, "SELECT current_setting('block_size')"))
+
+    estimates = []
+    for oid, schema, name, size, reltuples, fillfactor, data_width, index_count, has_unique in \
+            query(connection_info, _TABLES_SQL, (min_bytes,)):
+        if use_pgstattuple:
+            # 可視性マップを使う近似版のため、テーブル全体を読み込まない
+            free, dead = query(connection_info,
+                               "SELECT approx_free_space, dead_tuple_len FROM pgstattuple_approx(%s)",
+                               (oid,), timeout=600)[0]
+            # fillfactorで意図的に空けている領域は回収の対象にしない
+            reclaimable = max(0, int(free + dead - size * (100 - fillfactor) / 100))
+        else:
+            reclaimable = _estimate_table_from_stats(size, reltuples, fillfactor, float(data_width), block_size)
+        estimates.append({
+            'kind': 'table', 'schema': schema, 'name': name, 'table': name, 'bytes': size,
+            'reclaimable': reclaimable, 'ratio': reclaimable / size if size else 0,
+            'index_count': index_count, 'has_unique': has_unique,
+        })
+
+    for oid, schema, name, table, size, reltuples, amname, data_width in \
+            query(connection_info, _INDEXES_SQL, (min_bytes,)):
+        # GINやPGroongaなどB-tree以外のインデックスは見積もれないため対象外
+        if amname != 'btree':
+            continue
+        if use_pgstattuple:
+            density = query_value(connection_info, "SELECT avg_leaf_density FROM pgstatindex(%s)",
+                                  (oid,), timeout=600)
+            # 空のインデックスではavg_leaf_densityがNaNになる
+            if density is None or math.isnan(density):
+                reclaimable = 0
+            else:
+                reclaimable = max(0, int(size * (1 - float(density) / BTREE_FILLFACTOR)))
+        else:
+            reclaimable = _estimate_index_from_stats(size, reltuples, float(data_width), block_size)
+        estimates.append({
+            'kind': 'index', 'schema': schema, 'name': name, 'table': table, 'bytes': size,
+            'reclaimable': reclaimable, 'ratio': reclaimable / size if size else 0,
+        })
+
+    estimates.sort(key=lambda e: e['reclaimable'], reverse=True)
+    logger.info(f"Estimated bloat of {len(estimates)} object(s) using {method}")
+    return method, estimates
+
+
+def select_repack_targets(estimates, min_bytes, min_ratio):
+    """
+    回収できる量としきい値から、pg_repackの対象を選ぶ
+    テーブルを再編成するとインデックスも作り直されるため、対象のテーブルのインデックスは別に数えない
+
+    Returns:
+        list: 対象の見積もりの辞書のリスト（回収できる量の大きい順）
+    """
+    targets = []
+    tables = set()
+    for estimate in estimates:
+        if estimate['reclaimable'] < min_bytes or estimate['ratio'] < min_ratio:
+            continue
+        if estimate['kind'] == 'table':
+            # pg_repackは主キーまたは一意制約のないテーブルを再編成できない
+            if not estimate['has_unique']:
+                continue
+            tables.add((estimate['schema'], estimate['name']))
+        targets.append(estimate)
+    return [t for t in targets if t['kind'] == 'table' or (t['schema'], t['table']) not in tables]
+
+
+def relation_size(connection_info, schema, name, kind):
+    """
+    オブジェクトの現在のサイズを返す（テーブルの場合はインデックスとTOASTを含む）
+    """
+    function = 'pg_total_relation_size' if kind == 'table' else 'pg_relation_size'
+    return int(query_value(connection_info, f"SELECT {function}(format('%%I.%%I', %s::text, %s::text)::regclass)",
+                           (schema, name)))
@@ -0,0 +1,323 @@
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+from datetime import datetime
+
+# 物理バックアップとWALアーカイブの配置先
+BASEBACKUP_DIR = Path('/backup/postgres/base')
+WAL_ARCHIVE_DIR = Path('/backup/postgres/wal')
+
+# WALセグメントのサイズ（PostgreSQLの既定値）
+WAL_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# WAL受信プロセスが異常終了した場合の再起動待ち時間（秒）
+WAL_RECEIVER_RESTART_MIN = 5
+WAL_RECEIVER_RESTART_MAX = 300
+
+# 実行中のWAL受信スレッド
+_wal_receiver_thread = None
+_wal_receiver_stop = threading.Event()
+
+
+def _connection_args(connection_info):
+    return [
+        f'--host={connection_info["host"]}',
+        f'--port={connection_info["port"]}',
+        f'--username={connection_info["user"]}',
+        '--no-password',
+    ]
+
+
+def _connection_env(connection_info):
+    env = os.environ.copy()
+    env['PGPASSWORD'] = connection_info['password']
+    return env
+
+
+def wal_file_name(timeline, lsn, segment_size=WAL_SEGMENT_SIZE):
+    """
+    タイムラインとLSN（'0/2000028'形式）からWALセグメントのファイル名を求める
+    """
+    high, low = (int(part, 16) for part in lsn.split('/'))
+    segments_per_id = 0x100000000 // segment_size
+    segment_no = ((high << 32) | low) // segment_size
+    return f"{timeline:08X}{segment_no // segments_per_id:08X}{segment_no % segments_per_id:08X}"
+
+
+def base_backup(connection_info, logger, codec='gzip', level=None, backup_root=BASEBACKUP_DIR):
+    """
+    pg_basebackupで物理ベースバックアップを取得する
+    tar形式で圧縮して保存し、PostgreSQLが生成するbackup_manifest（SHA256チェックサム付き）を残す
+    WALは--wal-method=streamで同時に取得するため、このバックアップ単体でも整合性のある状態に戻せる
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報（REPLICATION権限が必要）
+        logger: ロガーインスタンス
+        codec (str): 圧縮方式 ('gzip', 'zstd')
+        level (int): 圧縮レベル。Noneの場合はgzipは6、zstdは3
+        backup_root (Path): ベースバックアップの保存先
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+    """
+    try:
+        backup_root = Path(backup_root)
+        backup_root.mkdir(parents=True, exist_ok=True)
+
+        if codec not in ('gzip', 'zstd'):
+            codec = 'gzip'
+        if level is None:
+            level = 3 if codec == 'zstd' else 6
+
+        target_dir = backup_root / f"base_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        part_dir = target_dir.with_name(target_dir.name + '.part')
+
+        cmd = [
+            'pg_basebackup',
+            *_connection_args(connection_info),
+            f'--pgdata={part_dir}',
+            '--format=tar',
+            '--wal-method=stream',
+            f'--compress=client-{codec}:{level}',
+            '--manifest-checksums=SHA256',
+            '--checkpoint=spread',  # チェックポイントを分散させてプライマリへの負荷を抑える
+            '--label=mensis',
+        ]
+
+        logger.info(f"Running: {' '.join(cmd)}")
+        start_time = time.time()
+        result = subprocess.run(cmd, env=_connection_env(connection_info), capture_output=True, text=True)
+        elapsed = time.time() - start_time
+
+        if result.returncode != 0:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            error_msg = f"pg_basebackup failed: {result.stderr}"
+            logger.error(error_msg)
+            return False, error_msg
+
+        # backup_manifestからWALの範囲を取り出して記録する
+        with open(part_dir / 'backup_manifest', encoding='utf-8') as f:
+            manifest = json.load(f)
+        wal_range = manifest['WAL-Ranges'][0]
+        size = sum(p.stat().st_size for p in part_dir.iterdir() if p.is_file())
+        metadata = {
+            'label': target_dir.name,
+            'started_at': datetime.fromtimestamp(start_time).isoformat(),
+            'finished_at': datetime.now().isoformat(),
+            'timeline': wal_range['Timeline'],
+            'start_lsn': wal_range['Start-LSN'],
+            'end_lsn': wal_range['End-LSN'],
+            'start_wal': wal_file_name(wal_range['Timeline'], wal_range['Start-LSN']),
+            'codec': codec,
+            'size': size,
+        }
+        with open(part_dir / 'mensis.json', 'w', encoding='utf-8') as f:
+            json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+        os.replace(part_dir, target_dir)
+        logger.info(f"Base backup saved to {target_dir} ({size} bytes, {elapsed:.1f}s)")
+
+        return True, {
+            'path': target_dir,
+            'size': size,
+            'elapsed': elapsed,
+            'throughput': size / elapsed if elapsed > 0 else 0,
+            'start_wal': metadata['start_wal'],
+        }
+
+    except Exception as e:
+        error_msg = f"Error during base backup: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+
+def list_base_backups(backup_root=BASEBACKUP_DIR):
+    """
+    完了しているベースバックアップのメタデータを古い順に返す
+    """
+    backups = []
+    for meta_path in Path(backup_root).glob('base_*/mensis.json'):
+        with open(meta_path, encoding='utf-8') as f:
+            metadata = json.load(f)
+        metadata['path'] = meta_path.parent
+        backups.append(metadata)
+    backups.sort(key=lambda b: b['finished_at'])
+    return backups
+
+
+def prune_base_backups(retention_count, logger, backup_root=BASEBACKUP_DIR, wal_dir=WAL_ARCHIVE_DIR):
+    """
+    保持数を超える古いベースバックアップを削除し、
+    残っている最も古いベースバックアップより前のWALをpg_archivecleanupで削除する
+    """
+    backups = list_base_backups(backup_root)
+    if len(backups) > retention_count:
+        for backup in backups[:-retention_count]:
+            logger.info(f"Removing old base backup: {backup['path']}")
+            shutil.rmtree(backup['path'])
+        backups = backups[-retention_count:]
+        logger.info(f"Removed old base backup(s). Keeping {retention_count} most recent backups.")
+
+    if backups and Path(wal_dir).exists():
+        oldest_wal = backups[0]['start_wal']
+        removed = 0
+        # pg_archivecleanupと同様にタイムライン部分を除いたセグメント番号で比較する
+        # （.historyファイルはタイムラインの切り替えに必要なため残す）
+        for wal_path in Path(wal_dir).iterdir():
+            segment = wal_path.name[:24]
+            if len(segment) != 24 or not all(c in '0123456789ABCDEF' for c in segment):
+                continue
+            if wal_path.name.endswith('.history'):
+                continue
+            if segment[8:] < oldest_wal[8:]:
+                wal_path.unlink()
+                removed += 1
+        logger.info(f"Removed {removed} archived WAL file(s) older than {oldest_wal}")
+
+
+def _wal_receiver_loop(connection_info, logger, wal_dir, slot_name, codec):
+    """
+    pg_receivewalを起動し、終了した場合は待ち時間を伸ばしながら再起動し続ける
+    """
+    env = _connection_env(connection_info)
+    delay = WAL_RECEIVER_RESTART_MIN
+
+    # レプリケーションスロットを用意し、受信が止まっている間もWALがプライマリに残るようにする
+    create_cmd = ['pg_receivewal', *_connection_args(connection_info),
+                  f'--slot={slot_name}', '--create-slot', '--if-not-exists']
+    result = subprocess.run(create_cmd, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        logger.error(f"Failed to create replication slot {slot_name}: {result.stderr}")
+
+    cmd = [
+        'pg_receivewal',
+        *_connection_args(connection_info),
+        f'--directory={wal_dir}',
+        f'--slot={slot_name}',
+        f'--compress={codec}',
+        '--synchronous',
+    ]
+    while not _wal_receiver_stop.is_set():
+        logger.info(f"Running: {' '.join(cmd)}")
+        started = time.time()
+        with tempfile.TemporaryFile() as stderr_file:
+            proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=stderr_file)
+            while proc.poll() is None:
+                if _wal_receiver_stop.wait(1):
+                    proc.terminate()
+                    proc.wait()
+                    return
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+
+        # 長く動いていた場合は一時的な切断とみなして待ち時間を戻す
+        if time.time() - started > WAL_RECEIVER_RESTART_MAX:
+            delay = WAL_RECEIVER_RESTART_MIN
+        logger.error(f"pg_receivewal exited with status {proc.returncode}, restarting in {delay}s: {stderr}")
+        _wal_receiver_stop.wait(delay)
+        delay = min(delay * 2, WAL_RECEIVER_RESTART_MAX)
+
+
+def start_wal_receiver(connection_info, logger, wal_dir=WAL_ARCHIVE_DIR, slot_name='mensis', codec='gzip'):
+    """
+    WALを継続的にアーカイブするpg_receivewalをバックグラウンドスレッドで起動する
+    既に起動している場合は何もしない
+
+    Returns:
+        bool: 新たに起動したかどうか
+    """
+    global _wal_receiver_thread
+    if _wal_receiver_thread and _wal_receiver_thread.is_alive():
+        return False
+
+    Path(wal_dir).mkdir(parents=True, exist_ok=True)
+    _wal_receiver_stop.clear()
+    _wal_receiver_thread = threading.Thread(
+        target=_wal_receiver_loop,
+        args=(connection_info, logger, wal_dir, slot_name, codec),
+        name='wal-receiver',
+        daemon=True
+    )
+    _wal_receiver_thread.start()
+    logger.info(f"WAL receiver started (slot={slot_name}, directory={wal_dir})")
+    return True
+
+
+def stop_wal_receiver():
+    """
+    WAL受信スレッドを停止する
+    """
+    _wal_receiver_stop.set()
+    if _wal_receiver_thread:
+        _wal_receiver_thread.join()
+
+
+def restore_to_timestamp(target_time, data_dir, logger, backup_root=BASEBACKUP_DIR, wal_dir=WAL_ARCHIVE_DIR):
+    """
+    指定時刻の状態に戻すためのデータディレクトリを作成する（ポイントインタイムリカバリ）
+    指定時刻より前に完了した最新のベースバックアップを展開し、
+    アーカイブ済みWALを使って指定時刻まで進めるrecovery設定を書き込む
+    PostgreSQLをこのデータディレクトリで起動するとリカバリが行われる
+
+    Args:
+        target_time (datetime): 復元したい時刻
+        data_dir (Path): 復元先のデータディレクトリ（空である必要がある）
+        logger: ロガーインスタンス
+        backup_root (Path): ベースバックアップの保存先
+        wal_dir (Path): WALアーカイブの保存先
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 使用したベースバックアップのパスまたはエラーメッセージ)
+    """
+    try:
+        data_dir = Path(data_dir)
+        if data_dir.exists() and any(data_dir.iterdir()):
+            error_msg = f"Data directory {data_dir} is not empty"
+            logger.error(error_msg)
+            return False, error_msg
+
+        candidates = [b for b in list_base_backups(backup_root)
+                      if datetime.fromisoformat(b['finished_at']) <= target_time]
+        if not candidates:
+            error_msg = f"No base backup finished before {target_time.isoformat()}"
+            logger.error(error_msg)
+            return False, error_msg
+        backup = candidates[-1]
+        logger.info(f"Restoring base backup {backup['path']} into {data_dir}")
+
+        # tarの展開（圧縮形式はtarが自動判別する）
+        data_dir.mkdir(parents=True, exist_ok=True)
+        os.chmod(data_dir, 0o700)
+        for archive in sorted(Path(backup['path']).glob('*.tar*')):
+            destination = data_dir / 'pg_wal' if archive.name.startswith('pg_wal.') else data_dir
+            destination.mkdir(exist_ok=True)
+            result = subprocess.run(['tar', '-xf', str(archive), '-C', str(destination)],
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Failed to extract {archive}: {result.stderr}")
+
+        # アーカイブ済みWALを読み込むrecovery設定
+        restore_command = (
+            f"if [ -f {wal_dir}/%f.gz ]; then gunzip -c {wal_dir}/%f.gz > %p; "
+            f"elif [ -f {wal_dir}/%f.zst ]; then zstd -dc {wal_dir}/%f.zst > %p; "
+            f"else cp {wal_dir}/%f %p; fi"
+        )
+        with open(data_dir / 'postgresql.auto.conf', 'a', encoding='utf-8') as f:
+            f.write("\n# Mensis point-in-time recovery\n")
+            f.write(f"restore_command = '{restore_command}'\n")
+            f.write(f"recovery_target_time = '{target_time.isoformat()}'\n")
+            f.write("recovery_target_action = 'promote'\n")
+        (data_dir / 'recovery.signal').touch()
+
+        logger.info(f"Data directory prepared for recovery to {target_time.isoformat()}")
+        return True, backup['path']
+
+    except Exception as e:
+        error_msg = f"Error during point-in-time restore: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
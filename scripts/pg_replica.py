@@ -0,0 +1,87 @@
+from db import query
+from load_env import get_settings
+
+# レプリカの接続情報の項目（replica_*が未設定の項目はプライマリの値を使う）
+_REPLICA_FIELDS = ('user', 'password', 'db', 'host', 'port')
+
+# スタンバイかどうかと再生の遅れ（秒）
+# 受信したWALをすべて再生済みで受信も続いている場合は、更新がないだけなので遅れは0とみなす
+# （pg_stat_wal_receiverのstatusはpg_read_all_stats権限がないとNULLになり、その場合は最後に再生した時刻から計算する）
+_STATUS_SQL = """
+SELECT pg_is_in_recovery(),
+       CASE WHEN NOT pg_is_in_recovery() THEN NULL
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+       END
+"""
+
+PRIMARY = 'primary'
+REPLICA = 'replica'
+
+
+def replica_connection_info(connection_info):
+    """
+    connection_infoのreplica_*からレプリカの接続情報を作る
+
+    Returns:
+        dict: レプリカの接続情報（connection_infoと同じ形式）。POSTGRES_REPLICAがFalseかホストが未設定の場合はNone
+    """
+    if not connection_info.get('replica_enabled') or not connection_info.get('replica_host'):
+        return None
+    return {field: connection_info.get(f'replica_{field}') or connection_info[field] for field in _REPLICA_FIELDS}
+
+
+def replica_status(replica_info):
+    """
+    レプリカがスタンバイとして動いているかと、再生の遅れを調べる
+
+    Returns:
+        dict: in_recovery (bool), lag (float: 秒。まだ何も再生していない場合はNone)
+    """
+    in_recovery, lag = query(replica_info, _STATUS_SQL, timeout=10)[0]
+    return {'in_recovery': bool(in_recovery), 'lag': float(lag) if lag is not None else None}
+
+
+def read_connection_info(connection_info, logger, purpose='read-only queries', max_lag=None):
+    """
+    読み取りだけの処理（バックアップ、サイズや肥大化の統計）の接続先を選ぶ
+    レプリカが有効で、スタンバイとして動いていて遅れがmax_lag以内ならレプリカ、そうでなければプライマリを返す
+    実行のたびに呼び、その時点の状態で判断する
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報（load_envの戻り値）
+        logger: ロガーインスタンス
+        purpose (str): ログに残す用途の説明
+        max_lag (float): 許容する再生の遅れ（秒）。Noneの場合はPOSTGRES_REPLICA_MAX_LAG_SECONDS
+
+    Returns:
+        tuple: (接続情報, 'replica' または 'primary')
+    """
+    replica_info = replica_connection_info(connection_info)
+    if replica_info is None:
+        return connection_info, PRIMARY
+
+    if max_lag is None:
+        max_lag = get_settings().get('POSTGRES_REPLICA_MAX_LAG_SECONDS')
+    address = f"{replica_info['host']}:{replica_info['port']}"
+    try:
+        status = replica_status(replica_info)
+    except Exception as e:
+        logger.warning(f"Replica {address} is unavailable ({str(e).strip()}). Using the primary for {purpose}")
+        return connection_info, PRIMARY
+
+    if not status['in_recovery']:
+        # 昇格済みか設定の誤りで、プライマリと同じデータである保証がない
+        logger.warning(f"Replica {address} is not in recovery. Using the primary for {purpose}")
+        return connection_info, PRIMARY
+    if status['lag'] is None:
+        logger.warning(f"Replica {address} has not replayed any transaction yet. Using the primary for {purpose}")
+        return connection_info, PRIMARY
+    if status['lag'] > max_lag:
+        logger.warning(f"Replica {address} is {status['lag']:.0f}s behind (limit {max_lag}s). "
+                       f"Using the primary for {purpose}")
+        return connection_info, PRIMARY
+
+    logger.info(f"Using replica {address} for {purpose} (replay lag {status['lag']:.0f}s)")
+    return replica_info, REPLICA
@@ -0,0 +1,179 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from custom_logging import task_context
+
+# データベースに大きなI/Oをかけるタスク（再編成、ダンプ、インデックス作成など）の資源クラス
+DB_IO = 'db_io'
+# 資源クラスごとの同時実行数の上限（記載のない資源クラスは上限なし）
+DEFAULT_RESOURCE_LIMITS = {DB_IO: 1}
+
+
+class PipelineTask:
+    """
+    メンテナンスパイプラインのタスク
+
+    Args:
+        name (str): タスク名
+        func (callable): 実行する関数
+        after (list): このタスクより先に終わっている必要があるタスク名のリスト
+            先行タスクが失敗しても後続は実行する（再編成が失敗してもバックアップは取る）
+        resource (str): 資源クラス。同じ資源クラスのタスクは上限の数までしか同時に実行しない
+        when (callable): 実行する直前に評価する条件。Falseを返した場合はスキップする
+        window (bool): メンテナンスウィンドウの終了後は開始しないかどうか
+        kwargs (dict): 関数に渡す引数
+    """
+
+    def __init__(self, name, func, after=(), resource=None, when=None, window=True, kwargs=None):
+        self.name = name
+        self.func = func
+        self.after = list(after)
+        self.resource = resource
+        self.when = when
+        self.window = window
+        self.kwargs = kwargs or {}
+
+
+class MaintenancePipeline:
+    """
+    依存関係と資源クラスに従ってタスクを順に、または並行して実行する
+    時刻ごとの枠ではなく、先行タスクが終わり次第すぐに次のタスクを開始する
+    """
+
+    def __init__(self, tasks, logger, max_workers=3, resource_limits=None, window_length=None):
+        self.tasks = {task.name: task for task in tasks}
+        self.logger = logger
+        self.max_workers = max_workers
+        self.resource_limits = DEFAULT_RESOURCE_LIMITS if resource_limits is None else resource_limits
+        # メンテナンスウィンドウの長さ（timedelta）。実行の開始時刻から数える
+        self.window_length = window_length
+        self.window_end = None
+        self._lock = threading.Lock()
+        self._running = False
+
+        for task in tasks:
+            for dependency in task.after:
+                if dependency not in self.tasks:
+                    raise ValueError(f"Task {task.name} depends on unknown task {dependency}")
+        self._check_cycles()
+
+    def _check_cycles(self):
+        # 依存関係に循環があると永久に開始できないタスクが残るため、構築時に検出する
+        visiting, visited = set(), set()
+
+        def _visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError(f"Dependency cycle detected at task {name}")
+            visiting.add(name)
+            for dependency in self.tasks[name].after:
+                _visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.tasks:
+            _visit(name)
+
+    @property
+    def running(self):
+        return self._running
+
+    def _run_task(self, task):
+        start_time = time.time()
+        with task_context(task.name):
+            self.logger.info(f"Pipeline task started: {task.name}")
+            try:
+                task.func(**task.kwargs)
+                status = 'done'
+            except Exception as e:
+                # タスク内で処理されなかった例外もパイプライン全体は止めない
+                self.logger.error(f"Pipeline task {task.name} raised an exception: {str(e)}")
+                status = 'failed'
+            elapsed = time.time() - start_time
+            self.logger.info(f"Pipeline task finished: {task.name} ({status}, {elapsed:.1f}s)",
+                             extra={'duration': round(elapsed, 3)})
+        return {'status': status, 'started': datetime.fromtimestamp(start_time), 'elapsed': elapsed}
+
+    def _resource_available(self, task, in_use):
+        if task.resource is None or task.resource not in self.resource_limits:
+            return True
+        return in_use.get(task.resource, 0) < self.resource_limits[task.resource]
+
+    def run(self):
+        """
+        すべてのタスクを実行する。既に実行中の場合は何もしない
+
+        Returns:
+            dict: タスク名ごとの結果（status: 'done', 'failed', 'skipped' と started, elapsed, reason）
+                実行中だった場合はNone
+        """
+        with self._lock:
+            if self._running:
+                self.logger.warning("Maintenance pipeline is still running. Skipping this run.")
+                return None
+            self._running = True
+
+        try:
+            return self._run()
+        finally:
+            self._running = False
+
+    def _run(self):
+        results = {}
+        pending = dict(self.tasks)
+        in_use = {}
+        futures = {}
+        start_time = time.time()
+        self.window_end = datetime.now() + self.window_length if self.window_length is not None else None
+        self.logger.info(f"Maintenance pipeline started ({len(pending)} tasks)")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline') as executor:
+            while pending or futures:
+                # 先行タスクがすべて終わっていて、資源に空きがあるタスクを開始する
+                for name, task in list(pending.items()):
+                    if any(dependency not in results for dependency in task.after):
+                        continue
+                    if task.window and self.window_end is not None and datetime.now() >= self.window_end:
+                        self.logger.warning(f"Skipping {name}: maintenance window ended at {self.window_end:%H:%M}")
+                        results[name] = {'status': 'skipped', 'reason': 'window'}
+                        del pending[name]
+                        continue
+                    if task.when is not None and not task.when():
+                        self.logger.info(f"Skipping {name}: condition not met")
+                        results[name] = {'status': 'skipped', 'reason': 'condition'}
+                        del pending[name]
+                        continue
+                    if not self._resource_available(task, in_use):
+                        continue
+                    if task.resource is not None:
+                        in_use[task.resource] = in_use.get(task.resource, 0) + 1
+                    futures[executor.submit(self._run_task, task)] = task
+                    del pending[name]
+
+                if not futures:
+                    # スキップによって新たに開始できるタスクが増えた場合はもう一度確認する
+                    if pending and all(any(d not in results for d in t.after) for t in pending.values()):
+                        raise RuntimeError("Maintenance pipeline has tasks that can never start")
+                    continue
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = futures.pop(future)
+                    if task.resource is not None:
+                        in_use[task.resource] -= 1
+                    results[task.name] = future.result()
+
+        elapsed = time.time() - start_time
+        summary = ', '.join(f"{name}={result['status']}" for name, result in results.items())
+        self.logger.info(f"Maintenance pipeline finished in {elapsed:.1f}s: {summary}")
+        return results
+
+    def start_background(self):
+        """
+        パイプラインを別スレッドで実行する（スケジューラーのループを止めないため）
+        """
+        thread = threading.Thread(target=self.run, name='maintenance-pipeline', daemon=True)
+        thread.start()
+        return thread
@@ -1,144 +1,238 @@
 import os
-import subprocess
-import dotenv
-import gzip
+import errno
+import fcntl
+import json
+import re
 import shutil
+import time
 from pathlib import Path
 from datetime import datetime
 from custom_logging import setup_logger  # logging.py から custom_logging.py に変更
-from load_env import load_env
+from load_env import get_settings
+from backup_stream import stream_command_to_file, run_command_streaming
+from backup_verify import DumpInspector, write_manifest, MANIFEST_SUFFIX
+from compression import codec_extension, backup_extensions, pg_dump_compress_option
+from dedup_store import DEFAULT_REPO_DIR, store_command_output, collect_garbage, delete_backup as delete_dedup_backup, list_backups as list_dedup_backups, promote_backup as promote_dedup_backup
+from backup_catalog import record_backup, is_cataloged, has_backups, expired_backups, mark_deleted, record_repack_timing
+from db import query, query_value, execute, execute_in_transaction
+from pg_bloat import estimate_bloat, select_repack_targets, relation_size
+from psycopg.errors import QueryCanceled
 
 def check_postgres_connection(connection_info, logger):
     """
     PostgreSQLへの接続をチェックする
     """
     try:
-        # psqlコマンドの構築
-        cmd = [
-            'psql',
-            f'--host={connection_info["host"]}',
-            f'--port={connection_info["port"]}',
-            f'--username={connection_info["user"]}',
-            f'--dbname={connection_info["db"]}',
-            '--no-password',  # パスワードはPGPASSWORD環境変数で渡す
-            '-c', 'SELECT 1'  # 簡単な接続テストクエリ
-        ]
+        # 簡単な接続テストクエリ（プールの接続を使う）
+        query_value(connection_info, 'SELECT 1', timeout=10)
+        logger.info(f"Successfully connected to PostgreSQL at {connection_info['host']}:{connection_info['port']}")
+        return True
 
-        # 環境変数にパスワードを設定
-        env = os.environ.copy()
-        env['PGPASSWORD'] = connection_info['password']
+    except Exception as e:
+        logger.error(f"Failed to connect to PostgreSQL: {str(e)}")
+        return False
 
-        # psqlコマンドを実行
-        result = subprocess.run(
-            cmd,
-            env=env,
-            capture_output=True,
-            text=True
-        )
-
-        if result.returncode == 0:
-            logger.info(f"Successfully connected to PostgreSQL at {connection_info['host']}:{connection_info['port']}")
-            return True
-        else:
-            logger.error(f"Failed to connect to PostgreSQL: {result.stderr}")
-            return False
+
+# ファイルのreflink（copy-on-writeクローン）を作成するioctl番号 (Linux)
+FICLONE = 0x40049409
+
+# 各タイプごとの保持世代数（PG_BACKUP_<TYPE>_GENERATIONが設定されていない場合の既定値）
+RETENTION_CONFIG = {
+    'daily': 7,
+    'weekly': 5,
+    'monthly': 12
+}
+
+
+def get_retention_count(backup_type):
+    """
+    .envのPG_BACKUP_<TYPE>_GENERATIONから保持世代数を取得する
+    """
+    return get_settings().get(f'PG_BACKUP_{backup_type.upper()}_GENERATION', RETENTION_CONFIG[backup_type])
+
+
+def get_database_size(connection_info):
+    """
+    全データベースの合計サイズ（バイト）を取得する。取得できない場合はNone
+    """
+    try:
+        size = query_value(connection_info,
+                           "SELECT sum(pg_database_size(datname)) FROM pg_database WHERE datallowconn")
+        return int(size) if size is not None else None
+    except Exception:
+        return None
+
+
+def prune_before_backup(backup_type, logger, repo_dir=DEFAULT_REPO_DIR):
+    """
+    空き容量が足りない場合に、次のバックアップが成功すれば削除される古い世代をバックアップ前に削除する
+    """
+    return _prune_old_backups(backup_type, logger, repo_dir,
+                              retention_count=max(get_retention_count(backup_type) - 1, 0))
+
+
+def _catalog_backup(backup_type, engine, stats, source_db_size=None, promoted_from=None):
+    """
+    作成したバックアップをカタログに登録する
+    """
+    return record_backup(
+        'postgres', backup_type, stats['path'],
+        engine=engine,
+        size=stats.get('size'),
+        raw_bytes=stats.get('raw_bytes'),
+        duration=stats.get('elapsed'),
+        codec=stats.get('codec'),
+        sha256=stats.get('sha256'),
+        source_db_size=source_db_size,
+        promoted_from=promoted_from
+    )
+
+
+def _upload_backup(s3_target, backup_type, engine, stats, logger, writer=None, promoted_from=None):
+    """
+    バックアップをS3互換ストレージへアップロードし、カタログへの登録とリモートの世代管理を行う
+    ストリームと同時に送信していた場合はそれを完了させ、失敗した場合はローカルのファイルから再開する
+    昇格の場合は、アップロード済みのdailyバックアップをサーバー側でコピーする
+
+    Returns:
+        tuple: (成功したかどうかのブール値, アップロード先のURIまたはエラーメッセージ)
+    """
+    try:
+        path = Path(stats['path'])
+        key = s3_target.key_for('postgres', backup_type, path.name)
+        upload_stats = None
+
+        if promoted_from is not None:
+            source_key = s3_target.key_for('postgres', 'daily', promoted_from)
+            if s3_target.copy(source_key, key):
+                upload_stats = {'elapsed': 0}
+        elif writer is not None:
+            success, result = writer.complete()
+            if success:
+                upload_stats = {'elapsed': stats.get('elapsed')}
+            else:
+                logger.warning(f"Streaming upload failed ({result}). Resuming from {path}")
+
+        if upload_stats is None:
+            success, upload_stats = s3_target.upload_path(path, key)
+            if not success:
+                return False, upload_stats
+
+        # 検証用マニフェストや昇格時のメタデータなどの付随ファイルも送る
+        for suffix in (MANIFEST_SUFFIX, '.meta.json'):
+            sidecar = path.with_name(path.name + suffix)
+            if sidecar.exists():
+                s3_target.upload_file(sidecar, key + suffix)
+
+        s3_target.record('postgres', backup_type, key, {**stats, 'elapsed': upload_stats['elapsed']},
+                         engine=engine, promoted_from=promoted_from)
+        logger.info(f"Uploaded {path.name} to {s3_target.uri(key)}")
+        if backup_type in RETENTION_CONFIG:
+            s3_target.apply_retention('postgres', backup_type, get_retention_count(backup_type))
+        return True, s3_target.uri(key)
 
     except Exception as e:
-        logger.error(f"Error checking PostgreSQL connection: {str(e)}")
-        return False
+        error_msg = f"Error during backup upload: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+
+def _build_pg_dumpall_cmd(connection_info):
+    """
+    標準出力へダンプを書き出すpg_dumpallコマンドを構築する
+    """
+    return [
+        'pg_dumpall',
+        f'--host={connection_info["host"]}',
+        f'--port={connection_info["port"]}',
+        f'--username={connection_info["user"]}',
+        '--clean',  # データベース再作成用のDROPコマンドを含める
+        '--if-exists',  # DROP時にIF EXISTSを使用
+    ]
 
 
-def manual_backup_postgres(connection_info, logger):
+def manual_backup_postgres(connection_info, logger, codec='gzip', level=None, threads=None, governor=None):
     """
     PostgreSQLデータベースのバックアップを作成する
-    pg_dumpallを使用して全データベースをバックアップし、gzipで圧縮する
+    pg_dumpallの出力を中間ファイルを介さずに圧縮してバックアップする
     
     Args:
         connection_info (dict): PostgreSQL接続情報
         logger: ロガーインスタンス
+        codec (str): 圧縮コーデック ('gzip', 'pgzip', 'zstd')
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        threads (int): 圧縮スレッド数。Noneの場合はCPUコア数
+        governor (LoadGovernor): 指定した場合は負荷に応じてpg_dumpallの優先度を下げ、一時停止する
         
     Returns:
-        tuple: (成功したかどうかのブール値, 出力ファイルパスまたはエラーメッセージ)
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
     """
     try:
         # バックアップディレクトリの設定
         backup_dir = Path('/backup/postgres/manual/')
         backup_dir.mkdir(parents=True, exist_ok=True)
         
-        # バックアップファイル名の生成 (YYYYMMDD形式)
-        current_date = datetime.now().strftime('%Y%m%d')
+        # バックアップファイル名の生成 (YYYYMMDD_HHMMSS形式。同じ日に複数回取得しても上書きしない)
+        current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = f"pg_dump_{current_date}"
-        sql_file = backup_dir / f"{backup_filename}.sql"
-        gz_file = backup_dir / f"{backup_filename}.sql.gz"
+        gz_file = backup_dir / f"{backup_filename}.sql{codec_extension(codec)}"
         
-        logger.info(f"Starting PostgreSQL backup to {sql_file}")
+        logger.info(f"Starting PostgreSQL backup to {gz_file}")
         
-        # pg_dumpallコマンドの構築
-        cmd = [
-            'pg_dumpall',
-            f'--host={connection_info["host"]}',
-            f'--port={connection_info["port"]}',
-            f'--username={connection_info["user"]}',
-            '--clean',  # データベース再作成用のDROPコマンドを含める
-            '--if-exists',  # DROP時にIF EXISTSを使用
-            f'--file={sql_file}'
-        ]
+        # pg_dumpallコマンドの構築（出力は標準出力へ流す）
+        cmd = _build_pg_dumpall_cmd(connection_info)
         
         # 環境変数にパスワードを設定
         env = os.environ.copy()
         env['PGPASSWORD'] = connection_info['password']
+        source_db_size = get_database_size(connection_info)
         
-        # pg_dumpallを実行
-        logger.info(f"Running: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            env=env,
-            capture_output=True,
-            text=True
-        )
+        # pg_dumpallの出力を直接圧縮処理へ流し込む
+        logger.info(f"Running: {' '.join(cmd)} (codec={codec})")
+        success, result = stream_command_to_file(cmd, env, gz_file, logger,
+                                                 codec=codec, level=level, threads=threads,
+                                                 inspector=DumpInspector(), governor=governor)
         
-        if result.returncode != 0:
-            error_msg = f"Database backup failed: {result.stderr}"
+        if not success:
+            error_msg = f"Database backup failed: {result}"
             logger.error(error_msg)
             return False, error_msg
-        
-        logger.info(f"Database dump completed successfully. Compressing the file...")
-        
-        # gzipで圧縮
-        with open(sql_file, 'rb') as f_in:
-            with gzip.open(gz_file, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        
-        # 圧縮後、元のSQLファイルを削除
-        os.remove(sql_file)
-        logger.info(f"Compression complete. Backup saved to: {gz_file}")
+
+        # チェックサムとテーブルの行数を検証用マニフェストとして保存
+        write_manifest(gz_file, result)
+        _catalog_backup('manual', 'dumpall', result, source_db_size=source_db_size)
 
         # 圧縮ファイルのサイズを取得
-        file_size = gz_file.stat().st_size
-        file_size_mb = round(file_size / (1024 * 1024), 2)
+        file_size_mb = round(result['size'] / (1024 * 1024), 2)
         logger.info(f"Compression complete. Backup saved to: {gz_file} (サイズ: {file_size_mb} MB)")
         
         
-        return True, file_size
+        return True, result
         
     except Exception as e:
         error_msg = f"Error during database backup: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
-def auto_backup_postgres(connection_info, logger, backup_type):
+def auto_backup_postgres(connection_info, logger, backup_type, codec='gzip', level=None, threads=None, s3_target=None,
+                         governor=None):
     """
     PostgreSQLデータベースの自動バックアップを作成する
-    pg_dumpallを使用して全データベースをバックアップし、gzipで圧縮する
+    pg_dumpallの出力を中間ファイルを介さずに圧縮してバックアップする
     古いバックアップは設定に応じて自動的に削除される
     
     Args:
         connection_info (dict): PostgreSQL接続情報
         logger: ロガーインスタンス
         backup_type (str): バックアップタイプ ('daily', 'weekly', 'monthly')
+        codec (str): 圧縮コーデック ('gzip', 'pgzip', 'zstd')
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        threads (int): 圧縮スレッド数。Noneの場合はCPUコア数
+        s3_target (S3Target): 指定した場合は圧縮したストリームを同時にS3互換ストレージへアップロードする
+        governor (LoadGovernor): 指定した場合は負荷に応じてpg_dumpallの優先度を下げ、一時停止する
         
     Returns:
-        bool: バックアップが成功したかどうか
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはNone)
     """
     try:
         # バックアップタイプの検証
@@ -146,13 +240,6 @@ def auto_backup_postgres(connection_info, logger, backup_type):
             logger.error(f"Invalid backup type: {backup_type}. Must be one of: daily, weekly, monthly")
             return False , None
             
-        # 各タイプごとの保持世代数を設定
-        retention_config = {
-            'daily': 7,
-            'weekly': 5,
-            'monthly': 12
-        }
-        
         # バックアップディレクトリの設定
         backup_dir = Path(f'/backup/postgres/auto/{backup_type}/')
         backup_dir.mkdir(parents=True, exist_ok=True)
@@ -160,75 +247,51 @@ def auto_backup_postgres(connection_info, logger, backup_type):
         # バックアップファイル名の生成
         current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
         backup_filename = f"pg_dump_{backup_type}_{current_date}"
-        sql_file = backup_dir / f"{backup_filename}.sql"
-        gz_file = backup_dir / f"{backup_filename}.sql.gz"
+        gz_file = backup_dir / f"{backup_filename}.sql{codec_extension(codec)}"
         
-        logger.info(f"Starting PostgreSQL {backup_type} backup to {sql_file}")
+        logger.info(f"Starting PostgreSQL {backup_type} backup to {gz_file}")
         
-        # pg_dumpallコマンドの構築
-        cmd = [
-            'pg_dumpall',
-            f'--host={connection_info["host"]}',
-            f'--port={connection_info["port"]}',
-            f'--username={connection_info["user"]}',
-            '--clean',  # データベース再作成用のDROPコマンドを含める
-            '--if-exists',  # DROP時にIF EXISTSを使用
-            f'--file={sql_file}'
-        ]
+        # pg_dumpallコマンドの構築（出力は標準出力へ流す）
+        cmd = _build_pg_dumpall_cmd(connection_info)
         
         # 環境変数にパスワードを設定
         env = os.environ.copy()
         env['PGPASSWORD'] = connection_info['password']
+        source_db_size = get_database_size(connection_info)
         
-        # pg_dumpallを実行
-        logger.info(f"Running: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            env=env,
-            capture_output=True,
-            text=True
-        )
+        # リモートへのアップロード先（ローカルに書き出すのと同時に送信する）
+        writer = None
+        if s3_target is not None:
+            writer = s3_target.open_writer(s3_target.key_for('postgres', backup_type, gz_file.name))
+
+        # pg_dumpallの出力を直接圧縮処理へ流し込む
+        logger.info(f"Running: {' '.join(cmd)} (codec={codec})")
+        success, result = stream_command_to_file(cmd, env, gz_file, logger,
+                                                 codec=codec, level=level, threads=threads,
+                                                 inspector=DumpInspector(), mirror=writer, governor=governor)
         
-        if result.returncode != 0:
-            error_msg = f"Database backup failed: {result.stderr}"
+        if not success:
+            error_msg = f"Database backup failed: {result}"
             logger.error(error_msg)
             return False, None
         
-        logger.info(f"Database dump completed successfully. Compressing the file...")
-        
-        # gzipで圧縮
-        with open(sql_file, 'rb') as f_in:
-            with gzip.open(gz_file, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-        
-        # 圧縮後、元のSQLファイルを削除
-        os.remove(sql_file)
-        logger.info(f"Compression complete. Backup saved to: {gz_file}")
-        
+        # チェックサムとテーブルの行数を検証用マニフェストとして保存
+        write_manifest(gz_file, result)
+        _catalog_backup(backup_type, 'dumpall', result, source_db_size=source_db_size)
+
         # 圧縮ファイルのサイズを取得
-        file_size = gz_file.stat().st_size
-        file_size_mb = round(file_size / (1024 * 1024), 2)
+        file_size_mb = round(result['size'] / (1024 * 1024), 2)
         logger.info(f"Compression complete. Backup saved to: {gz_file} (サイズ: {file_size_mb} MB)")
         
 
+        if s3_target is not None:
+            uploaded, remote = _upload_backup(s3_target, backup_type, 'dumpall', result, logger, writer=writer)
+            result['remote' if uploaded else 'remote_error'] = remote
+
         # 古いバックアップを削除して世代管理を行う
-        # 保持する世代数
-        retention_count = retention_config[backup_type]
-        
-        # 対象ディレクトリのバックアップファイル一覧を取得し、古い順にソート
-        backup_files = list(backup_dir.glob("*.sql.gz"))
-        backup_files.sort(key=lambda x: x.stat().st_mtime)
+        _prune_old_backups(backup_type, logger)
         
-        # 保持数を超える古いバックアップを削除
-        if len(backup_files) > retention_count:
-            files_to_delete = backup_files[:-retention_count]
-            for file in files_to_delete:
-                logger.info(f"Removing old backup: {file}")
-                file.unlink()
-                
-            logger.info(f"Removed {len(files_to_delete)} old backup(s). Keeping {retention_count} most recent backups.")
-        
-        return True, file_size
+        return True, result
         
     except Exception as e:
         error_msg = f"Error during {backup_type} database backup: {str(e)}"
@@ -236,165 +299,953 @@ def auto_backup_postgres(connection_info, logger, backup_type):
 
         return False, None
 
-def pg_repack_all_db(connection_info, logger):
+def auto_backup_postgres_parallel(connection_info, logger, backup_type, jobs=None, codec='gzip', level=None,
+                                  s3_target=None, governor=None):
     """
-    PostgreSQLデータベース内の全テーブルに対してpg_repackを実行し、物理的な再編成を行う
-    
+    PostgreSQLデータベースの自動バックアップをデータベースごとの並列ダンプで作成する
+    グローバルオブジェクト（ロール・テーブルスペース）をpg_dumpall --globals-onlyで一度だけ取得し、
+    各データベースはpg_dump -Fd --jobs=Nのディレクトリ形式で取得する
+    結果は1つのディレクトリにまとめ、manifest.jsonを持つ1つのバックアップとして扱う
+    ディレクトリ形式のためpg_restore -tによる単一テーブルのリストアが可能
+
     Args:
         connection_info (dict): PostgreSQL接続情報
         logger: ロガーインスタンス
-        
+        backup_type (str): バックアップタイプ ('daily', 'weekly', 'monthly')
+        jobs (int): pg_dumpの並列数。Noneの場合はCPUコア数
+        codec (str): 圧縮コーデック。pg_dumpの--compressに変換される
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        governor (LoadGovernor): 指定した場合は負荷に応じてpg_dumpの優先度を下げ、一時停止する
+
     Returns:
-        bool: pg_repackが成功したかどうか
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはNone)
     """
     try:
-        logger.info(f"Starting pg_repack for all tables in database: {connection_info['db']}")
-        
-        # pg_repackコマンドの構築
-        cmd = [
-            'pg_repack',
-            f"--host={connection_info['host']}",
-            f"--port={connection_info['port']}",
-            f"--username={connection_info['user']}",
-            f"--dbname={connection_info['db']}",
-            '--jobs=2',           # 並列処理数
-            '--wait-timeout=30000', # タイムアウト（秒）
-            '-a'                  # 全テーブルを対象にする
-        ]
-        
+        # バックアップタイプの検証
+        if backup_type not in ['daily', 'weekly', 'monthly']:
+            logger.error(f"Invalid backup type: {backup_type}. Must be one of: daily, weekly, monthly")
+            return False, None
+
+        if not jobs:
+            jobs = os.cpu_count() or 1
+
+        # バックアップディレクトリの設定
+        backup_dir = Path(f'/backup/postgres/auto/{backup_type}/')
+        backup_dir.mkdir(parents=True, exist_ok=True)
+
+        # 作業中は.partディレクトリに書き込み、完了後にリネームする
+        current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
+        target_dir = backup_dir / f"pg_dir_{backup_type}_{current_date}"
+        part_dir = target_dir.with_name(target_dir.name + '.part')
+        part_dir.mkdir()
+
+        logger.info(f"Starting PostgreSQL {backup_type} parallel backup to {target_dir} (jobs={jobs})")
+        start_time = time.time()
+
         # 環境変数にパスワードを設定
         env = os.environ.copy()
         env['PGPASSWORD'] = connection_info['password']
-        
-        # pg_repackを実行
-        logger.info(f"Running: {' '.join(cmd)}")
-        result = subprocess.run(
-            cmd,
-            env=env,
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            error_msg = f"pg_repack failed: {result.stderr}"
-            logger.error(error_msg)
-            return False
-        
-        logger.info("pg_repack completed successfully")
-        logger.debug(f"pg_repack output: {result.stdout}")
-        
-        return True
-        
+        source_db_size = get_database_size(connection_info)
+
+        try:
+            # 1. グローバルオブジェクトを一度だけ取得
+            globals_cmd = _build_pg_dumpall_cmd(connection_info) + ['--globals-only']
+            logger.info(f"Running: {' '.join(globals_cmd)}")
+            success, globals_result = stream_command_to_file(globals_cmd, env, part_dir / 'globals.sql.gz', logger)
+            if not success:
+                raise RuntimeError(f"Globals dump failed: {globals_result}")
+
+            # 2. 対象データベースの一覧を取得
+            databases = _list_databases(connection_info)
+            logger.info(f"Databases to dump: {', '.join(databases)}")
+
+            # 3. 各データベースをディレクトリ形式で並列ダンプ
+            database_stats = []
+            for database in databases:
+                db_start = time.time()
+                cmd = [
+                    'pg_dump',
+                    f'--host={connection_info["host"]}',
+                    f'--port={connection_info["port"]}',
+                    f'--username={connection_info["user"]}',
+                    '--format=directory',
+                    f'--jobs={jobs}',
+                    pg_dump_compress_option(codec, level),
+                    f'--file={part_dir / database}',
+                    database
+                ]
+                logger.info(f"Running: {' '.join(cmd)}")
+                returncode, output = run_command_streaming(cmd, env, logger, governor=governor, pausable=True)
+                if returncode != 0:
+                    raise RuntimeError(f"pg_dump of {database} failed: {output}")
+
+                db_size = _directory_size(part_dir / database)
+                database_stats.append({
+                    'name': database,
+                    'size': db_size,
+                    'elapsed': round(time.time() - db_start, 3)
+                })
+                logger.info(f"Dumped database {database} ({db_size} bytes)")
+
+            elapsed = time.time() - start_time
+
+            # 4. 1つの論理バックアップとしてマニフェストを書き出す
+            manifest = {
+                'engine': 'directory',
+                'backup_type': backup_type,
+                'created_at': datetime.now().isoformat(),
+                'jobs': jobs,
+                'codec': codec,
+                'globals': 'globals.sql.gz',
+                'databases': database_stats,
+                'elapsed': round(elapsed, 3)
+            }
+            with open(part_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        except Exception:
+            shutil.rmtree(part_dir, ignore_errors=True)
+            raise
+
+        os.replace(part_dir, target_dir)
+
+        total_size = _directory_size(target_dir)
+        file_size_mb = round(total_size / (1024 * 1024), 2)
+        logger.info(f"Parallel backup complete. Backup saved to: {target_dir} (サイズ: {file_size_mb} MB)")
+
+        stats = {
+            'path': target_dir,
+            'size': total_size,
+            'elapsed': elapsed,
+            'throughput': total_size / elapsed if elapsed > 0 else 0,
+            'jobs': jobs,
+            'codec': codec,
+            'databases': database_stats
+        }
+        _catalog_backup(backup_type, 'directory', stats, source_db_size=source_db_size)
+
+        if s3_target is not None:
+            uploaded, remote = _upload_backup(s3_target, backup_type, 'directory', stats, logger)
+            stats['remote' if uploaded else 'remote_error'] = remote
+
+        # 古いバックアップを削除して世代管理を行う
+        _prune_old_backups(backup_type, logger)
+
+        return True, stats
+
     except Exception as e:
-        error_msg = f"Error during pg_repack operation: {str(e)}"
+        error_msg = f"Error during {backup_type} parallel database backup: {str(e)}"
         logger.error(error_msg)
-        return False
+        return False, None
 
-def pgroonga_reindex(connection_info, logger):
+def auto_backup_postgres_dedup(connection_info, logger, backup_type, repo_dir=DEFAULT_REPO_DIR):
     """
-    CREATE INDEX idx_note_text_with_pgroonga ON note USING pgroonga (text);
-    でインデックスを作成/再作成する。
-    
+    PostgreSQLデータベースの自動バックアップを重複排除リポジトリに保存する
+    pg_dumpallの出力をコンテンツ定義チャンクに分割し、未保存のチャンクだけを書き込む
+    daily/weekly/monthlyで同じリポジトリを共有し、各バックアップは小さなマニフェストになる
+    古いバックアップはマニフェストを削除し、参照されなくなったチャンクを回収して削除する
+
     Args:
         connection_info (dict): PostgreSQL接続情報
         logger: ロガーインスタンス
-        
+        backup_type (str): バックアップタイプ ('daily', 'weekly', 'monthly')
+        repo_dir (Path): リポジトリのディレクトリ
+
     Returns:
-        bool: インデックスの作成/再作成が成功したかどうか
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはNone)
     """
     try:
-        logger.info("Starting PGroonga index creation/recreation process")
-        
+        # バックアップタイプの検証
+        if backup_type not in ['daily', 'weekly', 'monthly']:
+            logger.error(f"Invalid backup type: {backup_type}. Must be one of: daily, weekly, monthly")
+            return False, None
+
+        current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
+        backup_name = f"pg_dump_{backup_type}_{current_date}"
+
+        logger.info(f"Starting PostgreSQL {backup_type} backup into deduplicating repository {repo_dir}")
+
+        # pg_dumpallコマンドの構築（出力は標準出力へ流す）
+        cmd = _build_pg_dumpall_cmd(connection_info)
+
         # 環境変数にパスワードを設定
         env = os.environ.copy()
         env['PGPASSWORD'] = connection_info['password']
-        
-        # 1. まず既存のPGroongaインデックスを確認
-        check_cmd = [
-            'psql',
-            f'--host={connection_info["host"]}',
-            f'--port={connection_info["port"]}',
-            f'--username={connection_info["user"]}',
-            f'--dbname={connection_info["db"]}',
-            '--no-password',
-            '--tuples-only',
-            '-c', "SELECT indexname FROM pg_indexes WHERE indexname = 'idx_note_text_with_pgroonga'"
-        ]
-        
-        logger.info("Checking for existing idx_note_text_with_pgroonga index...")
-        check_result = subprocess.run(
-            check_cmd,
-            env=env,
-            capture_output=True,
-            text=True
-        )
-        
-        if check_result.returncode != 0:
-            error_msg = f"Failed to check existing PGroonga index: {check_result.stderr}"
-            logger.error(error_msg)
+        source_db_size = get_database_size(connection_info)
+
+        logger.info(f"Running: {' '.join(cmd)}")
+        success, result = store_command_output(repo_dir, cmd, env, backup_type, backup_name, logger,
+                                               inspector=DumpInspector())
+
+        if not success:
+            logger.error(f"Database backup failed: {result}")
+            return False, None
+
+        size_mb = round(result['size'] / (1024 * 1024), 2)
+        logger.info(f"Backup {backup_name} stored. {result['new_chunks']}/{result['chunks']} new chunks (追加サイズ: {size_mb} MB)")
+
+        _catalog_backup(backup_type, 'dedup', result, source_db_size=source_db_size)
+
+        # 古いバックアップを削除し、参照されなくなったチャンクを回収する
+        removed_chunks, freed_bytes = _prune_old_backups(backup_type, logger, repo_dir)
+        result.update({'removed_chunks': removed_chunks, 'freed_bytes': freed_bytes})
+
+        return True, result
+
+    except Exception as e:
+        error_msg = f"Error during {backup_type} deduplicated database backup: {str(e)}"
+        logger.error(error_msg)
+        return False, None
+
+# 昇格元のdailyバックアップの保存先
+DAILY_BACKUP_DIR = Path('/backup/postgres/auto/daily/')
+
+
+def _find_daily_backup(engine, repo_dir):
+    """
+    昇格の元にする当日のdailyバックアップを返す
+
+    Returns:
+        Path or str: バックアップのパス（dedupの場合はリポジトリ内のバックアップ名）。見つからない場合はNone
+    """
+    today = datetime.now().strftime('%Y%m%d')
+    if engine == 'dedup':
+        candidates = [name for name in list_dedup_backups(repo_dir, 'daily')
+                      if name.startswith(f"pg_dump_daily_{today}_")]
+        return candidates[-1] if candidates else None
+    candidates = [
+        p for p in DAILY_BACKUP_DIR.glob(f"pg_*_daily_{today}_*")
+        if not p.name.endswith(('.part', '.json'))
+    ] if DAILY_BACKUP_DIR.exists() else []
+    return max(candidates, key=lambda p: p.stat().st_mtime) if candidates else None
+
+
+def _promotion_target(source, backup_type):
+    return Path(f'/backup/postgres/auto/{backup_type}/') / source.name.replace('_daily_', f'_{backup_type}_', 1)
+
+
+def promotion_copy_size(backup_type, engine='dumpall', repo_dir=DEFAULT_REPO_DIR):
+    """
+    当日のdailyバックアップを昇格させる場合に、保存先に必要になりうる容量（バイト）を返す
+    ハードリンクとreflinkが使えないファイルシステムではdailyバックアップ全体をコピーするため、そのサイズになる
+    重複排除リポジトリはマニフェストを複製するだけで、昇格済みの場合も複製しないため0
+
+    Returns:
+        int: 必要になりうる容量。昇格できるdailyバックアップがない場合はNone
+    """
+    source = _find_daily_backup(engine, repo_dir)
+    if source is None:
+        return None
+    if engine == 'dedup' or _promotion_target(source, backup_type).exists():
+        return 0
+    return _directory_size(source) if source.is_dir() else source.stat().st_size
+
+
+def promote_daily_backup(logger, backup_type, engine='dumpall', repo_dir=DEFAULT_REPO_DIR, s3_target=None,
+                         allow_copy=True):
+    """
+    当日のdailyバックアップをweekly/monthlyへ昇格させる（再ダンプを行わない）
+    ファイルはハードリンク、reflink、コピーの順に試し、使えるもっとも軽い方法で複製する
+    種別などのメタデータはバックアップ本体とは別の.meta.jsonに記録する
+    （ハードリンクはdailyと実体を共有するため、本体を書き換えるとdaily側も変わってしまう）
+
+    Args:
+        logger: ロガーインスタンス
+        backup_type (str): 昇格先のバックアップタイプ ('weekly', 'monthly')
+        engine (str): バックアップ方式 ('dumpall', 'directory', 'dedup')
+        repo_dir (Path): 重複排除リポジトリのディレクトリ
+        s3_target (S3Target): 指定した場合はS3互換ストレージ上でも昇格させる
+        allow_copy (bool): ハードリンクとreflinkが使えない場合にコピーしてよいかどうか
+            （コピーが保存先に収まらない見込みの場合はFalseにする）
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはNone)
+            当日のdailyバックアップが見つからない場合は(False, None)
+    """
+    try:
+        if backup_type not in ['weekly', 'monthly']:
+            logger.error(f"Invalid promotion target: {backup_type}. Must be one of: weekly, monthly")
+            return False, None
+
+        start_time = time.time()
+        source = _find_daily_backup(engine, repo_dir)
+        if source is None:
+            logger.info(f"No daily backup from today found in {repo_dir if engine == 'dedup' else DAILY_BACKUP_DIR}")
+            return False, None
+
+        # 重複排除リポジトリの場合はマニフェストを複製するだけでよい
+        if engine == 'dedup':
+            target_name = source.replace('_daily_', f'_{backup_type}_', 1)
+            stats = promote_dedup_backup(repo_dir, 'daily', source, backup_type, target_name, logger)
+            if not is_cataloged(stats['path']):
+                _catalog_backup(backup_type, 'dedup', stats, promoted_from=source)
+            removed_chunks, freed_bytes = _prune_old_backups(backup_type, logger, repo_dir)
+            stats.update({
+                'method': 'manifest',
+                'promoted_from': source,
+                'elapsed': time.time() - start_time,
+                'throughput': 0,
+                'removed_chunks': removed_chunks,
+                'freed_bytes': freed_bytes
+            })
+            return True, stats
+
+        target = _promotion_target(source, backup_type)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part_target = target.with_name(target.name + '.part')
+        target_manifest = target.with_name(target.name + MANIFEST_SUFFIX)
+        part_manifest = target_manifest.with_name(target_manifest.name + '.part')
+        metadata_path = target.with_name(target.name + '.meta.json')
+
+        # 同じ日に再実行した場合は、昇格済みのバックアップをそのまま使う（複製とアップロードをやり直さない）
+        existing = target.exists()
+        if existing:
+            logger.info(f"{target} already exists. Treating {source.name} as already promoted")
+            metadata = {}
+            if metadata_path.exists():
+                with open(metadata_path, encoding='utf-8') as f:
+                    metadata = json.load(f)
+            method = metadata.get('method', 'existing')
+            size = _directory_size(target) if target.is_dir() else target.stat().st_size
+        else:
+            logger.info(f"Promoting {source} to {target}")
+            try:
+                if source.is_dir():
+                    methods = set()
+                    for src_file in source.rglob('*'):
+                        dst_file = part_target / src_file.relative_to(source)
+                        if src_file.is_dir():
+                            dst_file.mkdir(parents=True, exist_ok=True)
+                        else:
+                            dst_file.parent.mkdir(parents=True, exist_ok=True)
+                            methods.add(_link_or_copy(src_file, dst_file, allow_copy))
+                    # 1つでもコピーにフォールバックしたファイルがあればcopyとして記録する
+                    method = next((m for m in ('copy', 'reflink', 'hardlink') if m in methods), 'hardlink')
+                else:
+                    method = _link_or_copy(source, part_target, allow_copy)
+                    # 検証用マニフェストも合わせて複製する（本体を確定してから同じように確定させる）
+                    source_manifest = source.with_name(source.name + MANIFEST_SUFFIX)
+                    if source_manifest.exists():
+                        shutil.copy2(source_manifest, part_manifest)
+                os.replace(part_target, target)
+                if part_manifest.exists():
+                    os.replace(part_manifest, target_manifest)
+            except Exception:
+                if part_target.is_dir():
+                    shutil.rmtree(part_target, ignore_errors=True)
+                else:
+                    part_target.unlink(missing_ok=True)
+                part_manifest.unlink(missing_ok=True)
+                raise
+
+            size = _directory_size(target) if target.is_dir() else target.stat().st_size
+            metadata = {
+                'tier': backup_type,
+                'promoted_from': str(source),
+                'method': method,
+                'promoted_at': datetime.now().isoformat(),
+                'size': size
+            }
+            with open(metadata_path, 'w', encoding='utf-8') as f:
+                json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+            logger.info(f"Promoted {source.name} to {backup_type} using {method}")
+
+        stats = {
+            'path': target,
+            'size': size,
+            'method': method,
+            'promoted_from': source.name,
+            'elapsed': time.time() - start_time,
+            'throughput': 0
+        }
+        engine = 'directory' if target.is_dir() else 'dumpall'
+        if not is_cataloged(target):
+            _catalog_backup(backup_type, engine, stats, promoted_from=source.name)
+
+        if s3_target is not None and not existing:
+            uploaded, remote = _upload_backup(s3_target, backup_type, engine, stats, logger,
+                                              promoted_from=source.name)
+            stats['remote' if uploaded else 'remote_error'] = remote
+
+        # 古いバックアップを削除して世代管理を行う
+        _prune_old_backups(backup_type, logger)
+
+        return True, stats
+
+    except Exception as e:
+        logger.error(f"Error during promotion of daily backup to {backup_type}: {str(e)}")
+        return False, None
+
+def _link_or_copy(src, dst, allow_copy=True):
+    """
+    ハードリンク、reflink、コピーの順に試してファイルを複製する
+
+    Args:
+        allow_copy (bool): Falseの場合はコピーせず、ハードリンクとreflinkが使えなければOSErrorを送出する
+
+    Returns:
+        str: 使用した方法 ('hardlink', 'reflink', 'copy')
+    """
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError as e:
+        # 別ファイルシステムやハードリンク非対応の場合のみ次の方法を試す
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+
+    try:
+        with open(src, 'rb') as f_in, open(dst, 'wb') as f_out:
+            fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+        shutil.copystat(src, dst)
+        return 'reflink'
+    except OSError:
+        Path(dst).unlink(missing_ok=True)
+
+    if not allow_copy:
+        raise OSError(errno.ENOSPC, "Hardlinks and reflinks are not supported, and a full copy is not expected to fit",
+                      str(dst))
+    shutil.copy2(src, dst)
+    return 'copy'
+
+def _list_databases(connection_info):
+    """
+    接続可能なテンプレート以外のデータベース名の一覧を取得する
+    """
+    rows = query(connection_info,
+                 "SELECT datname FROM pg_database WHERE datallowconn AND NOT datistemplate ORDER BY datname")
+    return [row[0] for row in rows]
+
+def _directory_size(path):
+    """
+    ディレクトリ配下のファイルサイズの合計を返す
+    """
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+def _import_legacy_backups(backup_type, logger, repo_dir=DEFAULT_REPO_DIR):
+    """
+    カタログ導入前に作成されたバックアップを一度だけカタログに登録する
+    """
+    if has_backups('postgres', backup_type):
+        return
+
+    backup_dir = Path(f'/backup/postgres/auto/{backup_type}/')
+    legacy = []
+    if backup_dir.exists():
+        legacy += [(f, 'dumpall') for ext in backup_extensions() for f in backup_dir.glob(f"*.sql{ext}")]
+        legacy += [(p, 'directory') for p in backup_dir.glob("pg_dir_*")
+                   if p.is_dir() and not p.name.endswith('.part')]
+    legacy += [(Path(repo_dir) / 'manifests' / backup_type / f"{name}.json", 'dedup')
+               for name in list_dedup_backups(repo_dir, backup_type)]
+
+    for path, engine in legacy:
+        stat = path.stat()
+        record_backup('postgres', backup_type, path, engine=engine,
+                      size=_directory_size(path) if path.is_dir() else stat.st_size,
+                      created_at=datetime.fromtimestamp(stat.st_mtime))
+    if legacy:
+        logger.info(f"Imported {len(legacy)} existing {backup_type} backup(s) into the catalog")
+
+
+def _prune_old_backups(backup_type, logger, repo_dir=DEFAULT_REPO_DIR, retention_count=None):
+    """
+    カタログを元に保持数を超える古いバックアップを削除して世代管理を行う
+    圧縮ファイル、並列ダンプのディレクトリ、重複排除リポジトリのバックアップをすべて1世代として数える
+
+    Returns:
+        tuple: (回収したチャンク数, 解放したバイト数) 重複排除リポジトリ以外は(0, 0)
+    """
+    _import_legacy_backups(backup_type, logger, repo_dir)
+
+    if retention_count is None:
+        retention_count = get_retention_count(backup_type)
+    expired = expired_backups('postgres', backup_type, retention_count)
+    removed_dedup = False
+    for backup in expired:
+        path = Path(backup['path'])
+        logger.info(f"Removing old backup: {path}")
+        if backup['engine'] == 'dedup':
+            delete_dedup_backup(repo_dir, backup_type, path.stem, logger)
+            removed_dedup = True
+        elif path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        # 昇格時のメタデータと検証用マニフェストも合わせて削除する
+        for suffix in ('.meta.json', MANIFEST_SUFFIX):
+            path.with_name(path.name + suffix).unlink(missing_ok=True)
+        mark_deleted(backup['id'])
+
+    if expired:
+        logger.info(f"Removed {len(expired)} old backup(s). Keeping {retention_count} most recent backups.")
+
+    # 参照されなくなったチャンクを回収する
+    if removed_dedup:
+        return collect_garbage(repo_dir, logger)
+    return 0, 0
+
+# 実測値が得られるまでpg_repackの処理速度として仮定する値（バイト/秒）
+DEFAULT_REPACK_THROUGHPUT = 50 * 1024 * 1024
+
+
+def _pg_repack_command(connection_info, *args):
+    return [
+        'pg_repack',
+        f"--host={connection_info['host']}",
+        f"--port={connection_info['port']}",
+        f"--username={connection_info['user']}",
+        f"--dbname={connection_info['db']}",
+        '--wait-timeout=30000', # タイムアウト（秒）
+        *args,
+    ]
+
+
+class RepackProgress:
+    """
+    pg_repackの出力を1行ずつ受け取り、対象ごとの開始・終了と処理時間を記録する
+    pg_repackは対象ごとに「INFO: repacking table "public.note"」のような行を出力するため、
+    次の対象の開始またはコマンドの終了をその対象の終了とみなす
+    """
+
+    _TARGET_PATTERN = re.compile(r'repacking (table|index) "?([^"\s]+)"?')
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.timings = []
+        self._current = None
+
+    def feed(self, line):
+        match = self._TARGET_PATTERN.search(line)
+        if not match:
+            return
+        self.finish()
+        kind, name = match.groups()
+        self._current = {'name': name, 'kind': kind, 'started_at': datetime.now(), 'start': time.time()}
+        self.logger.info(f"Started repacking {kind} {name}")
+
+    def finish(self):
+        """
+        処理中の対象を終了として記録する
+        """
+        if self._current is None:
+            return
+        current, self._current = self._current, None
+        duration = time.time() - current.pop('start')
+        self.timings.append({**current, 'duration': duration})
+        self.logger.info(f"Finished repacking {current['kind']} {current['name']} in {duration:.1f}s")
+
+
+def _run_pg_repack(cmd, connection_info, logger, progress, governor=None):
+    # 環境変数にパスワードを設定
+    env = os.environ.copy()
+    env['PGPASSWORD'] = connection_info['password']
+
+    logger.info(f"Running: {' '.join(cmd)}")
+    # pg_repackはテーブルのロックを持ったまま止まる可能性があるため、一時停止はせず優先度だけを下げる
+    returncode, output = run_command_streaming(cmd, env, logger, on_line=progress.feed, governor=governor)
+    progress.finish()
+    if returncode != 0:
+        return False, output
+    return True, None
+
+
+def repack_jobs(estimate, max_jobs=None):
+    """
+    pg_repackの並列数を決める
+    --jobsはテーブルのインデックスの再作成を並列化するため、インデックス数とCPUコア数の小さい方にする
+    （CPUの半分はMisskey本体のために残す）
+    """
+    if estimate['kind'] != 'table':
+        return 1
+    jobs = min(estimate['index_count'], max(1, (os.cpu_count() or 2) // 2))
+    if max_jobs:
+        jobs = min(jobs, max_jobs)
+    return max(1, jobs)
+
+
+def pg_repack_all_db(connection_info, logger, min_bloat_bytes=100 * 1024 * 1024, min_bloat_ratio=0.2,
+                     time_budget=None, max_jobs=None, mode='targeted', governor=None, defer_wait=600,
+                     stats_connection_info=None):
+    """
+    肥大化したテーブルとインデックスだけにpg_repackを実行し、物理的な再編成を行う
+    回収できる量を見積もってしきい値を超えるものを大きい順に再編成し、時間の上限に収まらないものは次回に回す
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+        min_bloat_bytes (int): 対象にする回収できる量の下限（バイト）
+        min_bloat_ratio (float): 対象にするサイズに対する回収できる割合の下限
+        time_budget (float): 新しい対象の再編成を始める期限（秒）。Noneの場合は上限なし
+        max_jobs (int): pg_repackの並列数の上限。Noneの場合はCPUコア数から決める
+        mode (str): 'targeted'（肥大化したものだけ）または 'all'（従来どおり全テーブル）
+        governor (LoadGovernor): 指定した場合は負荷に応じてpg_repackの優先度を下げ、
+            負荷が高い間は次の対象を始めずに待つ
+        defer_wait (float): 負荷が下がるのを待つ最大時間（秒）。超えた場合は残りの対象を次回に回す
+        stats_connection_info (dict): 肥大化の見積もりに使う接続情報（レプリカなど）。Noneの場合はconnection_info
+            再編成と前後のサイズの計測は常にconnection_infoで行う
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 結果の辞書)
+            結果の辞書には以下が含まれる:
+            - mode: 実行したモード
+            - method: 肥大化の見積もりの方法
+            - candidates: しきい値を超えた対象の数
+            - repacked: 再編成した対象ごとの結果（name, kind, estimated, before, after, reclaimed, elapsed, success）
+            - deferred: 時間の上限や負荷のために次回に回した対象の名前のリスト
+            - reclaimed: 実際に回収できた合計のバイト数
+            - timings: pg_repackの出力から読み取った対象ごとの処理時間
+    """
+    report = {'mode': mode, 'method': None, 'candidates': 0, 'repacked': [], 'deferred': [], 'reclaimed': 0,
+              'timings': []}
+    try:
+        logger.info(f"Starting pg_repack ({mode}) in database: {connection_info['db']}")
+
+        if mode == 'all':
+            jobs = max_jobs or max(1, (os.cpu_count() or 2) // 2)
+            cmd = _pg_repack_command(connection_info, f"--jobs={jobs}", '-a')
+            progress = RepackProgress(logger)
+            success, error = _run_pg_repack(cmd, connection_info, logger, progress, governor)
+            for timing in progress.timings:
+                record_repack_timing(connection_info['db'], timing['name'], timing['kind'],
+                                     timing['started_at'], timing['duration'])
+            report['timings'].extend(progress.timings)
+            if not success:
+                logger.error(f"pg_repack failed: {error}")
+                return False, report
+            logger.info("pg_repack completed successfully")
+            return True, report
+
+        # 1. 肥大化を見積もり、対象を選ぶ
+        report['method'], estimates = estimate_bloat(stats_connection_info or connection_info, logger,
+                                                     min_bytes=min_bloat_bytes)
+        targets = select_repack_targets(estimates, min_bloat_bytes, min_bloat_ratio)
+        report['candidates'] = len(targets)
+        if not targets:
+            logger.info("No table or index exceeds the bloat threshold. Nothing to repack.")
+            return True, report
+
+        # 2. 回収できる量の大きい順に、時間の上限に収まるものから再編成する
+        start_time = time.time()
+        processed_bytes = 0
+        failed = False
+        for index, target in enumerate(targets):
+            name = f"{target['schema']}.{target['name']}"
+            if governor is not None and not governor.wait_for_calm(defer_wait, what=f"pg_repack of {name}"):
+                remaining = [f"{t['schema']}.{t['name']}" for t in targets[index:]]
+                logger.warning(f"Deferring {len(remaining)} object(s) to the next run because of high load")
+                report['deferred'].extend(remaining)
+                break
+            elapsed = time.time() - start_time
+            throughput = processed_bytes / elapsed if processed_bytes and elapsed > 0 else DEFAULT_REPACK_THROUGHPUT
+            if time_budget is not None and elapsed + target['bytes'] / throughput > time_budget:
+                logger.info(f"Deferring {name}: not expected to finish within the time budget")
+                report['deferred'].append(name)
+                continue
+
+            before = relation_size(connection_info, target['schema'], target['name'], target['kind'])
+            if target['kind'] == 'table':
+                jobs = repack_jobs(target, max_jobs)
+                cmd = _pg_repack_command(connection_info, f"--table={name}", f"--jobs={jobs}")
+            else:
+                cmd = _pg_repack_command(connection_info, f"--index={name}")
+            target_started_at = datetime.now()
+            target_start = time.time()
+            progress = RepackProgress(logger)
+            success, error = _run_pg_repack(cmd, connection_info, logger, progress, governor)
+            target_elapsed = time.time() - target_start
+            after = relation_size(connection_info, target['schema'], target['name'], target['kind'])
+            processed_bytes += before
+            report['timings'].extend(progress.timings)
+            record_repack_timing(connection_info['db'], name, target['kind'], target_started_at, target_elapsed,
+                                 reclaimed=max(0, before - after) if success else None)
+
+            report['repacked'].append({
+                'name': name, 'kind': target['kind'], 'estimated': target['reclaimable'],
+                'before': before, 'after': after, 'reclaimed': max(0, before - after),
+                'elapsed': target_elapsed, 'success': success,
+            })
+            if success:
+                report['reclaimed'] += max(0, before - after)
+                logger.info(f"Repacked {name} in {target_elapsed:.1f}s: {before} -> {after} bytes "
+                            f"(estimated reclaimable {target['reclaimable']} bytes)")
+            else:
+                failed = True
+                logger.error(f"pg_repack failed for {name}: {error}")
+
+        logger.info(f"pg_repack completed: {len(report['repacked'])} object(s) repacked, "
+                    f"{report['reclaimed']} bytes reclaimed, {len(report['deferred'])} deferred")
+        return not failed, report
+
+    except Exception as e:
+        error_msg = f"Error during pg_repack operation: {str(e)}"
+        logger.error(error_msg)
+        return False, report
+
+# 全文検索用のPGroongaインデックス
+PGROONGA_INDEX = 'idx_note_text_with_pgroonga'
+PGROONGA_TABLE = 'note'
+# 入れ替え用に作成するインデックスの名前の接尾辞
+PGROONGA_SWAP_SUFFIX = '_swap'
+# 削除してよい残骸のインデックス名（LIKEでは_が任意の1文字になり、似た名前の別のインデックスまで一致するため正規表現で完全一致させる）
+# REINDEX CONCURRENTLYは名前が重複する場合に _ccnew1 のように番号を付ける
+_PGROONGA_LEFTOVER_PATTERN = f"^{re.escape(PGROONGA_INDEX)}({re.escape(PGROONGA_SWAP_SUFFIX)}|_ccnew[0-9]*|_ccold[0-9]*)$"
+# インデックスの作成を待つ最大時間（秒）
+PGROONGA_BUILD_TIMEOUT = 7200
+
+
+def _cleanup_invalid_pgroonga_indexes(connection_info, logger):
+    """
+    失敗したCREATE INDEX CONCURRENTLY / REINDEX CONCURRENTLYが残したインデックスを削除する
+    （入れ替え用の _swap や、REINDEXが作る _ccnew / _ccold が対象）
+
+    Returns:
+        int: 削除したインデックスの数
+    """
+    leftovers = query(connection_info,
+                      """
+                      SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                      WHERE i.indrelid = %s::regclass AND c.relname ~ %s
+                        AND (NOT i.indisvalid OR c.relname = %s)
+                      """,
+                      (PGROONGA_TABLE, _PGROONGA_LEFTOVER_PATTERN, PGROONGA_INDEX + PGROONGA_SWAP_SUFFIX))
+    for (name,) in leftovers:
+        logger.warning(f"Dropping leftover index {name}")
+        execute(connection_info, f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+    return len(leftovers)
+
+
+def _pgroonga_index_state(connection_info):
+    """
+    PGroongaインデックスの定義と有効かどうかを返す。存在しない場合は (None, None)
+    """
+    rows = query(connection_info,
+                 """
+                 SELECT pg_get_indexdef(i.indexrelid), i.indisvalid FROM pg_index i
+                 JOIN pg_class c ON c.oid = i.indexrelid
+                 WHERE i.indrelid = %s::regclass AND c.relname = %s
+                 """,
+                 (PGROONGA_TABLE, PGROONGA_INDEX))
+    return rows[0] if rows else (None, None)
+
+
+def _pgroonga_recreate(connection_info, logger, indexdef):
+    # 従来の方法: 削除してから作成する（作成中は検索が使えず、noteへの書き込みも止まる）
+    if indexdef:
+        logger.info(f"Found existing {PGROONGA_INDEX} index, dropping it first")
+        execute(connection_info, f"DROP INDEX IF EXISTS {PGROONGA_INDEX}")
+        logger.info("Successfully dropped existing PGroonga index")
+    logger.info("Creating PGroonga index on note.text column...")
+    execute(connection_info, f"CREATE INDEX {PGROONGA_INDEX} ON {PGROONGA_TABLE} USING pgroonga (text)",
+            timeout=PGROONGA_BUILD_TIMEOUT)
+
+
+def _pgroonga_swap(connection_info, logger, indexdef):
+    # 別名で並行して作成し、有効になったことを確認してから1つのトランザクションで入れ替える
+    swap_name = PGROONGA_INDEX + PGROONGA_SWAP_SUFFIX
+    if indexdef:
+        # 既存の定義（WITH句のオプションなど）をそのまま引き継ぐ
+        create_sql = re.sub(r'^CREATE (UNIQUE )?INDEX \S+ ON', rf'CREATE \1INDEX CONCURRENTLY {swap_name} ON',
+                            indexdef)
+    else:
+        create_sql = f"CREATE INDEX CONCURRENTLY {swap_name} ON {PGROONGA_TABLE} USING pgroonga (text)"
+    logger.info(f"Building replacement index: {create_sql}")
+    execute(connection_info, create_sql, timeout=PGROONGA_BUILD_TIMEOUT)
+
+    valid = query_value(connection_info,
+                        "SELECT indisvalid AND indisready FROM pg_index WHERE indexrelid = %s::regclass",
+                        (swap_name,))
+    if not valid:
+        raise RuntimeError(f"Replacement index {swap_name} is not valid")
+
+    # DROPとRENAMEの間だけ排他ロックを取る（lock_timeoutを超えて待たされた場合は失敗として片付ける）
+    statements = [f"ALTER INDEX {swap_name} RENAME TO {PGROONGA_INDEX}"]
+    if indexdef:
+        statements.insert(0, f"DROP INDEX {PGROONGA_INDEX}")
+    execute_in_transaction(connection_info, statements)
+    logger.info(f"Swapped {swap_name} in as {PGROONGA_INDEX}")
+
+
+def _pgroonga_reindex_concurrently(connection_info, logger, indexdef):
+    if not indexdef:
+        logger.info("PGroonga index does not exist, creating it concurrently")
+        execute(connection_info,
+                f"CREATE INDEX CONCURRENTLY {PGROONGA_INDEX} ON {PGROONGA_TABLE} USING pgroonga (text)",
+                timeout=PGROONGA_BUILD_TIMEOUT)
+        return
+    logger.info(f"Running REINDEX INDEX CONCURRENTLY {PGROONGA_INDEX}")
+    execute(connection_info, f"REINDEX INDEX CONCURRENTLY {PGROONGA_INDEX}", timeout=PGROONGA_BUILD_TIMEOUT)
+
+
+def _pgroonga_object_disk_usage(connection_info, name):
+    # object_inspectの結果は [ヘッダー, 本体] の配列で、本体にレコード数とディスク使用量が含まれる
+    response = query_value(connection_info, "SELECT pgroonga_command('object_inspect', ARRAY['name', %s])::jsonb",
+                           (name,))
+    body = response[1] if isinstance(response, list) and len(response) > 1 else None
+    return body if isinstance(body, dict) else {}
+
+
+def pgroonga_index_health(connection_info, logger):
+    """
+    PGroongaインデックスの健全性を調べる
+    PGroongaのobject_inspectでGroonga側のレコード数とディスク使用量を取得し、
+    noteテーブルのサイズと不要タプルの数と合わせて返す
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 計測値の辞書またはエラーメッセージ)
+            計測値の辞書には以下が含まれる:
+            - exists / valid: インデックスが存在するか、有効か
+            - index_bytes: インデックスのディスク使用量（Groongaのテーブルと語彙表の合計）
+            - table_bytes: noteテーブルのサイズ（TOASTを含み、インデックスを含まない）
+            - n_records: Groonga側のレコード数
+            - live_tuples / dead_tuples: noteテーブルの有効なタプルと不要なタプルの数
+            - dead_ratio: 不要なタプルの割合
+    """
+    try:
+        indexdef, valid = _pgroonga_index_state(connection_info)
+        health = {'exists': indexdef is not None, 'valid': bool(valid), 'index_bytes': None, 'n_records': None}
+
+        table_bytes, live_tuples, dead_tuples = query(
+            connection_info,
+            """
+            SELECT pg_table_size(relid), n_live_tup, n_dead_tup FROM pg_stat_user_tables
+            WHERE relid = %s::regclass
+            """,
+            (PGROONGA_TABLE,))[0]
+        health.update({
+            'table_bytes': table_bytes, 'live_tuples': live_tuples, 'dead_tuples': dead_tuples,
+            'dead_ratio': dead_tuples / (live_tuples + dead_tuples) if live_tuples + dead_tuples else 0,
+        })
+
+        if health['exists']:
+            # Sources<oid> がレコードを持つテーブル、Lexicon<oid>_0 が語彙表
+            source = query_value(connection_info, "SELECT pgroonga_table_name(%s)", (PGROONGA_INDEX,))
+            table_info = _pgroonga_object_disk_usage(connection_info, source)
+            lexicon_info = _pgroonga_object_disk_usage(connection_info, source.replace('Sources', 'Lexicon') + '_0')
+            health['n_records'] = table_info.get('n_records')
+            if 'disk_usage' in table_info:
+                health['index_bytes'] = table_info['disk_usage'] + lexicon_info.get('disk_usage', 0)
+            else:
+                health['index_bytes'] = query_value(connection_info, "SELECT pg_relation_size(%s::regclass)",
+                                                    (PGROONGA_INDEX,))
+
+        logger.info(f"PGroonga index health: {health}")
+        return True, health
+
+    except Exception as e:
+        error_msg = f"Error during PGroonga health check: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+
+def decide_pgroonga_rebuild(health, baseline, max_dead_ratio=0.2, max_growth=0.3, max_age_days=30):
+    """
+    健全性の計測値と前回の再構築直後の値から、再構築が必要かどうかを判断する
+
+    Args:
+        health (dict): pgroonga_index_healthの計測値
+        baseline (dict): 前回の再構築直後の計測値。Noneの場合は常に再構築する
+        max_dead_ratio (float): noteテーブルの不要なタプルの割合の上限
+        max_growth (float): 1行あたりのインデックスサイズが前回の再構築直後から増えてよい割合
+        max_age_days (int): 前回の再構築から再構築せずにおける最大日数
+
+    Returns:
+        tuple: (再構築するかどうかのブール値, 理由)
+    """
+    if not health['exists']:
+        return True, 'index does not exist'
+    if not health['valid']:
+        return True, 'index is invalid'
+    if baseline is None:
+        return True, 'no baseline from a previous rebuild'
+
+    age = datetime.now() - datetime.fromisoformat(baseline['checked_at'])
+    if age.days >= max_age_days:
+        return True, f"last rebuild was {age.days} days ago"
+    if health['dead_ratio'] > max_dead_ratio:
+        return True, f"dead tuple ratio {health['dead_ratio']:.1%} exceeds {max_dead_ratio:.0%}"
+
+    live_tuples = health['live_tuples']
+    if health['n_records'] is not None and live_tuples and \
+            health['n_records'] > live_tuples * (1 + max_growth):
+        return True, f"{health['n_records']} Groonga records for {live_tuples} live rows"
+
+    # 1行あたりのインデックスサイズで比べ、ノートの増加による自然な成長は肥大化とみなさない
+    if health['index_bytes'] and live_tuples and baseline['index_bytes'] and baseline['live_tuples']:
+        per_row = health['index_bytes'] / live_tuples
+        baseline_per_row = baseline['index_bytes'] / baseline['live_tuples']
+        if per_row > baseline_per_row * (1 + max_growth):
+            return True, f"index grew to {per_row / baseline_per_row:.2f}x bytes per row since the last rebuild"
+
+    return False, 'healthy'
+
+
+def pgroonga_reindex(connection_info, logger, mode='swap', governor=None, defer_wait=600):
+    """
+    idx_note_text_with_pgroonga（note.textのPGroongaインデックス）を作成/再作成する。
+
+    Args:
+        connection_info (dict): PostgreSQL接続情報
+        logger: ロガーインスタンス
+        mode (str): 再作成の方法
+            - 'swap': 別名で並行して作成し、検証してから入れ替える（検索と書き込みを止めない）
+            - 'concurrently': REINDEX INDEX CONCURRENTLYで再作成する
+            - 'recreate': 削除してから作成する（従来の方法）
+        governor (LoadGovernor): 指定した場合は負荷が下がるまでインデックスの作成を始めずに待つ
+            （作成はサーバー内で行われるため、始めた後は抑えられない）
+        defer_wait (float): 負荷が下がるのを待つ最大時間（秒）。超えた場合はそのまま作成する
+
+    Returns:
+        bool: インデックスの作成/再作成が成功したかどうか
+    """
+    try:
+        logger.info(f"Starting PGroonga index creation/recreation process (mode={mode})")
+
+        # 1. 既存のPGroongaインデックスと、前回の失敗で残ったインデックスを確認
+        logger.info(f"Checking for existing {PGROONGA_INDEX} index...")
+        try:
+            _cleanup_invalid_pgroonga_indexes(connection_info, logger)
+            indexdef, valid = _pgroonga_index_state(connection_info)
+        except Exception as e:
+            logger.error(f"Failed to check existing PGroonga index: {str(e)}")
             return False
-        
-        # 2. 既存のインデックスがあれば削除
-        if check_result.stdout.strip():
-            logger.info("Found existing idx_note_text_with_pgroonga index, dropping it first")
-            drop_cmd = [
-                'psql',
-                f'--host={connection_info["host"]}',
-                f'--port={connection_info["port"]}',
-                f'--username={connection_info["user"]}',
-                f'--dbname={connection_info["db"]}',
-                '--no-password',
-                '-c', "DROP INDEX IF EXISTS idx_note_text_with_pgroonga"
-            ]
-            
-            drop_result = subprocess.run(
-                drop_cmd,
-                env=env,
-                capture_output=True,
-                text=True
-            )
-            
-            if drop_result.returncode != 0:
-                error_msg = f"Failed to drop existing PGroonga index: {drop_result.stderr}"
-                logger.error(error_msg)
-                return False
-                
-            logger.info("Successfully dropped existing PGroonga index")
-        
-        # 3. インデックスを作成
-        logger.info("Creating PGroonga index on note.text column...")
-        create_cmd = [
-            'psql',
-            f'--host={connection_info["host"]}',
-            f'--port={connection_info["port"]}',
-            f'--username={connection_info["user"]}',
-            f'--dbname={connection_info["db"]}',
-            '--no-password',
-            '-c', "CREATE INDEX idx_note_text_with_pgroonga ON note USING pgroonga (text)"
-        ]
-        
+
+        # 本来のインデックスが無効な場合は検索に使われないため、削除して作り直す
+        if indexdef and not valid:
+            logger.warning(f"{PGROONGA_INDEX} is invalid, recreating it")
+            execute(connection_info, f"DROP INDEX CONCURRENTLY IF EXISTS {PGROONGA_INDEX}")
+            indexdef = None
+
+        # 2. インデックスを作成（2時間のタイムアウト）
+        if governor is not None:
+            governor.wait_for_calm(defer_wait, what="PGroonga index build")
         try:
-            create_result = subprocess.run(
-                create_cmd,
-                env=env,
-                capture_output=True,
-                text=True,
-                timeout=7200  # 2時間のタイムアウト
-            )
-            
-            if create_result.returncode != 0:
-                error_msg = f"Failed to create PGroonga index: {create_result.stderr}"
-                logger.error(error_msg)
-                return False
-                
-            logger.info("Successfully created PGroonga index on note.text column")
-            return True
-                
-        except subprocess.TimeoutExpired:
-            logger.error("Timeout occurred while creating PGroonga index")
+            if mode == 'recreate':
+                _pgroonga_recreate(connection_info, logger, indexdef)
+            elif mode == 'concurrently':
+                _pgroonga_reindex_concurrently(connection_info, logger, indexdef)
+            else:
+                _pgroonga_swap(connection_info, logger, indexdef)
+        except Exception as e:
+            if isinstance(e, QueryCanceled):
+                logger.error("Timeout occurred while creating PGroonga index")
+            else:
+                logger.error(f"Failed to create PGroonga index: {str(e)}")
+            # 並行作成が途中で失敗すると無効なインデックスが残るため片付ける
+            try:
+                _cleanup_invalid_pgroonga_indexes(connection_info, logger)
+            except Exception as cleanup_error:
+                logger.error(f"Failed to clean up leftover PGroonga indexes: {str(cleanup_error)}")
             return False
-        
+
+        logger.info("Successfully created PGroonga index on note.text column")
+        return True
+
     except Exception as e:
         error_msg = f"Error during PGroonga index creation: {str(e)}"
         logger.error(error_msg)
-        return False
\ No newline at end of file
+        return False
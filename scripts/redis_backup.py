@@ -0,0 +1,192 @@
+import os
+import json
+import subprocess
+import time
+from pathlib import Path
+from datetime import datetime
+from backup_stream import stream_command_to_file
+from backup_catalog import record_backup, expired_backups, mark_deleted
+from compression import codec_extension
+from load_env import get_settings
+
+# Redisのバックアップの保存先
+REDIS_BACKUP_DIR = Path('/backup/redis')
+# LASTSAVEを確認する間隔（秒）
+LASTSAVE_POLL_INTERVAL = 1
+
+
+def _redis_cli_base(redis_info):
+    return ['redis-cli', '-h', redis_info['host'], '-p', str(redis_info['port'])]
+
+
+def _redis_env(redis_info):
+    # パスワードはコマンドライン引数に出さず、REDISCLI_AUTHで渡す
+    env = os.environ.copy()
+    if redis_info.get('password'):
+        env['REDISCLI_AUTH'] = redis_info['password']
+    return env
+
+
+def _redis_command(redis_info, *args):
+    """
+    redis-cliでコマンドを1つ実行し、出力を返す
+    """
+    result = subprocess.run(_redis_cli_base(redis_info) + list(args),
+                            env=_redis_env(redis_info), capture_output=True, text=True, timeout=60)
+    if result.returncode != 0 or result.stdout.startswith(('ERR', '(error)')):
+        raise RuntimeError(f"redis-cli {' '.join(args)} failed: {result.stderr or result.stdout}")
+    return result.stdout.strip()
+
+
+def get_redis_info(redis_info, *sections):
+    """
+    INFOコマンドの結果を辞書で返す
+    """
+    info = {}
+    for section in sections or ('default',):
+        for line in _redis_command(redis_info, 'INFO', section).splitlines():
+            if ':' in line and not line.startswith('#'):
+                key, _, value = line.partition(':')
+                info[key] = value.strip()
+    return info
+
+
+def load_redis_env():
+    """
+    .envからRedisの接続情報を取得する
+    """
+    settings = get_settings()
+    return {
+        'host': settings.get('REDIS_HOST'),
+        'port': settings.get('REDIS_PORT'),
+        'password': settings.get('REDIS_PASSWORD'),
+    }
+
+
+def _wait_for_bgsave(redis_info, lastsave_before, timeout):
+    """
+    LASTSAVEが更新されるまで待つ
+
+    Returns:
+        float: BGSAVEの完了までにかかった時間（秒）
+    """
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        time.sleep(LASTSAVE_POLL_INTERVAL)
+        if int(_redis_command(redis_info, 'LASTSAVE')) > lastsave_before:
+            return time.time() - start_time
+    raise TimeoutError(f"BGSAVE did not finish within {timeout} seconds")
+
+
+def backup_redis(redis_info, logger, codec='gzip', level=None, threads=None, bgsave=True, bgsave_timeout=600,
+                 backup_dir=REDIS_BACKUP_DIR):
+    """
+    Redisのスナップショット（RDB）を取得して圧縮して保存する
+    BGSAVEでサーバー上のスナップショットを更新してLASTSAVEで完了を待ち、
+    redis-cli --rdbで取得したRDBを中間ファイルを作らずに圧縮して書き出す
+
+    Args:
+        redis_info (dict): Redisの接続情報
+        logger: ロガーインスタンス
+        codec (str): 圧縮コーデック ('gzip', 'pgzip', 'zstd')
+        level (int): 圧縮レベル。Noneの場合はコーデックの既定値
+        threads (int): 圧縮スレッド数。Noneの場合はCPUコア数
+        bgsave (bool): 取得前にBGSAVEを実行するかどうか
+        bgsave_timeout (int): BGSAVEの完了を待つ最大時間（秒）
+        backup_dir (Path): バックアップの保存先
+
+    Returns:
+        tuple: (成功したかどうかのブール値, 統計情報の辞書またはエラーメッセージ)
+            stream_command_to_fileの統計情報に加えて以下が含まれる:
+            - rdb_bytes: RDBのサイズ（バイト）
+            - bgsave_fork_ms: BGSAVEのfork時間（ミリ秒）
+            - bgsave_seconds: BGSAVEの完了までにかかった時間（秒）
+            - transfer_fork_ms: --rdbでの転送のためのfork時間（ミリ秒）
+            - used_memory: Redisのメモリ使用量（バイト）
+    """
+    try:
+        backup_dir = Path(backup_dir)
+        backup_dir.mkdir(parents=True, exist_ok=True)
+        metrics = {}
+
+        # 1. BGSAVEでスナップショットを作成し、LASTSAVEの更新を待つ
+        if bgsave:
+            lastsave_before = int(_redis_command(redis_info, 'LASTSAVE'))
+            try:
+                response = _redis_command(redis_info, 'BGSAVE')
+            except RuntimeError as e:
+                # 既に実行中のBGSAVEがあれば、その完了を待てばよい
+                if 'already in progress' not in str(e):
+                    raise
+                response = 'Background save already in progress'
+            logger.info(f"BGSAVE: {response}")
+            metrics['bgsave_seconds'] = _wait_for_bgsave(redis_info, lastsave_before, bgsave_timeout)
+            info = get_redis_info(redis_info, 'persistence', 'stats')
+            if info.get('rdb_last_bgsave_status') != 'ok':
+                return False, f"BGSAVE failed: rdb_last_bgsave_status={info.get('rdb_last_bgsave_status')}"
+            metrics['bgsave_fork_ms'] = int(info.get('latest_fork_usec', 0)) / 1000
+            metrics['rdb_cow_bytes'] = int(info.get('rdb_last_cow_size', 0))
+
+        # 2. --rdbでRDBを取得し、そのまま圧縮して書き出す
+        current_date = datetime.now().strftime('%Y%m%d_%H%M%S')
+        rdb_file = backup_dir / f"redis_dump_{current_date}.rdb{codec_extension(codec)}"
+        cmd = _redis_cli_base(redis_info) + ['--rdb', '-']
+        logger.info(f"Running: {' '.join(cmd)} (codec={codec})")
+        success, result = stream_command_to_file(cmd, _redis_env(redis_info), rdb_file, logger,
+                                                 codec=codec, level=level, threads=threads)
+        if not success:
+            error_msg = f"Redis backup failed: {result}"
+            logger.error(error_msg)
+            return False, error_msg
+
+        # 転送のために行われたforkの時間とメモリ使用量を記録する
+        info = get_redis_info(redis_info, 'stats', 'memory')
+        metrics['transfer_fork_ms'] = int(info.get('latest_fork_usec', 0)) / 1000
+        metrics['used_memory'] = int(info.get('used_memory', 0))
+        metrics['rdb_bytes'] = result['raw_bytes']
+        result.update(metrics)
+
+        with open(rdb_file.with_name(rdb_file.name + '.meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'created_at': datetime.now().isoformat(), 'sha256': result['sha256'], **metrics},
+                      f, ensure_ascii=False, indent=2)
+
+        record_backup('redis', 'daily', rdb_file, engine='rdb', size=result['size'], raw_bytes=result['raw_bytes'],
+                      duration=result['elapsed'], codec=codec, sha256=result['sha256'],
+                      source_db_size=metrics['used_memory'])
+        logger.info(
+            f"Redis backup saved to {rdb_file}: RDB {metrics['rdb_bytes']} bytes, "
+            f"fork {metrics.get('bgsave_fork_ms', 0):.1f}ms (BGSAVE) / {metrics['transfer_fork_ms']:.1f}ms (--rdb)"
+        )
+        return True, result
+
+    except Exception as e:
+        error_msg = f"Error during Redis backup: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+
+def read_redis_backup_metrics(rdb_file):
+    """
+    バックアップと一緒に保存したRDBサイズやfork時間を読み込む。存在しない場合はNone
+    """
+    meta_path = Path(rdb_file).with_name(Path(rdb_file).name + '.meta.json')
+    if not meta_path.exists():
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def prune_redis_backups(retention_count, logger):
+    """
+    カタログを元に保持数を超える古いRedisのバックアップを削除する
+    """
+    expired = expired_backups('redis', 'daily', retention_count)
+    for backup in expired:
+        path = Path(backup['path'])
+        logger.info(f"Removing old backup: {path}")
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + '.meta.json').unlink(missing_ok=True)
+        mark_deleted(backup['id'])
+    if expired:
+        logger.info(f"Removed {len(expired)} old Redis backup(s). Keeping {retention_count} most recent backups.")
+    return len(expired)
@@ -51,8 +51,6 @@ def format_bytes(bytes_value):
     Returns:
         str: 変換された文字列（例：'1.23 GB'）
     """
-    logger = setup_logger(name='format_bytes')
-    logger.info(f"Formatting bytes: {bytes_value}")
     for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
         if bytes_value < 1024.0 or unit == 'TB':
             return f"{bytes_value:.2f} {unit}"
@@ -0,0 +1,192 @@
+import sqlite3
+import statistics
+from pathlib import Path
+from datetime import datetime
+
+# タスクの実行履歴（SQLite）の配置先。コンテナを再起動しても残るようにバックアップ先に置く
+HISTORY_PATH = Path('/backup/task_history.db')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL,            -- 'success', 'failed', 'skipped'
+    started_at TEXT,
+    finished_at TEXT NOT NULL,
+    duration REAL,                   -- 秒
+    bytes_processed INTEGER,
+    throughput REAL,                 -- バイト/秒
+    details TEXT,
+    method TEXT                      -- 処理の方法（'promotion'など）。通常の実行はNULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_runs_task
+    ON task_runs (task, finished_at);
+"""
+
+
+def _connect(history_path=HISTORY_PATH):
+    history_path = Path(history_path)
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(history_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # 後から追加した列を既存の履歴にも追加する
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(task_runs)")}
+    if 'method' not in columns:
+        conn.execute("ALTER TABLE task_runs ADD COLUMN method TEXT")
+    return conn
+
+
+def record_task_run(task, status, started_at=None, finished_at=None, bytes_processed=None, details=None,
+                    method=None, history_path=HISTORY_PATH):
+    """
+    タスクの実行結果を記録する
+
+    Args:
+        task (str): タスク名
+        status (str): 'success', 'failed', 'skipped' のいずれか
+        started_at (datetime): 開始時刻。不明な場合はNone（処理時間も記録しない）
+        finished_at (datetime): 終了時刻。Noneの場合は現在時刻
+        bytes_processed (int): 処理したバイト数（バックアップのサイズなど）
+        details (str): 通知などに使う補足
+        method (str): 処理の方法。処理時間が大きく異なる方法（dailyからの昇格など）を区別し、
+            同じ方法の実行どうしだけを比べる。通常の実行はNone
+
+    Returns:
+        dict: 記録した実行結果
+    """
+    finished_at = finished_at or datetime.now()
+    duration = (finished_at - started_at).total_seconds() if started_at else None
+    throughput = bytes_processed / duration if bytes_processed and duration else None
+    run = {
+        'task': task, 'status': status,
+        'started_at': started_at.isoformat() if started_at else None,
+        'finished_at': finished_at.isoformat(), 'duration': duration,
+        'bytes_processed': bytes_processed, 'throughput': throughput, 'details': details, 'method': method,
+    }
+    conn = _connect(history_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO task_runs (task, status, started_at, finished_at, duration, bytes_processed,
+                                       throughput, details, method)
+                VALUES (:task, :status, :started_at, :finished_at, :duration, :bytes_processed, :throughput, :details,
+                        :method)
+                """,
+                run
+            )
+        run['id'] = cursor.lastrowid
+        return run
+    finally:
+        conn.close()
+
+
+def latest_task_runs(history_path=HISTORY_PATH):
+    """
+    タスクごとの最新の実行結果を返す
+
+    Returns:
+        dict: タスク名をキーにした実行結果の辞書
+    """
+    conn = _connect(history_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT * FROM task_runs t
+            WHERE id = (SELECT max(id) FROM task_runs WHERE task = t.task)
+            """
+        )
+        return {row['task']: dict(row) for row in rows}
+    finally:
+        conn.close()
+
+
+def task_baseline(task, limit=20, exclude_id=None, method=None, history_path=HISTORY_PATH):
+    """
+    直近の成功した実行から、処理時間とスループットの中央値を求める
+
+    Args:
+        task (str): タスク名
+        limit (int): 対象にする直近の実行数
+        exclude_id (int): 対象から除く実行のID（比較する今回の実行）
+        method (str): 対象にする処理の方法（Noneの場合は通常の実行だけ）
+
+    Returns:
+        dict: samples（件数）, median_duration, median_throughput を含む辞書
+    """
+    conn = _connect(history_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT duration, throughput FROM task_runs
+            WHERE task = ? AND status = 'success' AND duration IS NOT NULL AND id IS NOT ? AND method IS ?
+            ORDER BY finished_at DESC LIMIT ?
+            """,
+            (task, exclude_id, method, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    durations = [row['duration'] for row in rows]
+    throughputs = [row['throughput'] for row in rows if row['throughput']]
+    return {
+        'samples': len(durations),
+        'median_duration': statistics.median(durations) if durations else None,
+        'median_throughput': statistics.median(throughputs) if throughputs else None,
+    }
+
+
+def detect_regression(run, factor=1.5, min_samples=5, min_seconds=60, limit=20, history_path=HISTORY_PATH):
+    """
+    実行結果が直近の中央値より大きく遅くなっていないかを調べる
+    ストレージの劣化やテーブルの肥大化を、メンテナンスの時間枠を超える前に見つけるために使う
+
+    Args:
+        run (dict): record_task_runで記録した実行結果
+        factor (float): 中央値の何倍を超えたら遅延とみなすか（スループットは何分の1を下回ったら）
+        min_samples (int): 判断に必要な過去の実行数
+        min_seconds (float): 中央値との差がこれ未満の場合は遅延とみなさない（短いタスクの揺らぎを除く）
+
+    Returns:
+        str: 遅延の内容。遅延していない場合はNone
+    """
+    if run['status'] != 'success' or run['duration'] is None:
+        return None
+    baseline = task_baseline(run['task'], limit=limit, exclude_id=run.get('id'), method=run.get('method'),
+                             history_path=history_path)
+    if baseline['samples'] < min_samples:
+        return None
+
+    median_duration = baseline['median_duration']
+    if run['duration'] > median_duration * factor and run['duration'] - median_duration >= min_seconds:
+        return (f"処理時間が直近{baseline['samples']}回の中央値の{run['duration'] / median_duration:.1f}倍です"
+                f"（今回 {run['duration']:.0f}秒 / 中央値 {median_duration:.0f}秒）")
+
+    median_throughput = baseline['median_throughput']
+    if run['throughput'] and median_throughput and run['duration'] >= min_seconds and \
+            run['throughput'] * factor < median_throughput:
+        return (f"スループットが直近の中央値の{run['throughput'] / median_throughput:.0%}に低下しています"
+                f"（今回 {run['throughput'] / (1024 * 1024):.1f}MB/s / 中央値 {median_throughput / (1024 * 1024):.1f}MB/s）")
+    return None
+
+
+def last_successful_runs(history_path=HISTORY_PATH):
+    """
+    タスクごとの最後に成功した実行結果を返す
+
+    Returns:
+        dict: タスク名をキーにした実行結果の辞書
+    """
+    conn = _connect(history_path)
+    try:
+        rows = conn.execute(
+            """
+            SELECT * FROM task_runs t
+            WHERE id = (SELECT max(id) FROM task_runs WHERE task = t.task AND status = 'success')
+            """
+        )
+        return {row['task']: dict(row) for row in rows}
+    finally:
+        conn.close()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# scripts/のモジュールは互いに名前だけでimportしているため、scripts/をパスに加える
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'scripts'))
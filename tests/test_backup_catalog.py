@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+
+from backup_catalog import record_backup, has_backups, is_cataloged, expired_backups, mark_deleted, list_backups
+
+
+def _record(catalog, tier, days_ago, kind='postgres', **kwargs):
+    created_at = datetime(2026, 1, 31) - timedelta(days=days_ago)
+    return record_backup(kind, tier, f"/backup/{kind}/{tier}/{days_ago}.sql.gz", created_at=created_at,
+                         catalog_path=catalog, **kwargs)
+
+
+def test_expired_backups_are_the_oldest_beyond_retention(tmp_path):
+    catalog = tmp_path / 'catalog.db'
+    for days_ago in range(5):
+        _record(catalog, 'daily', days_ago)
+    _record(catalog, 'weekly', 10)
+
+    expired = expired_backups('postgres', 'daily', 3, catalog_path=catalog)
+
+    assert [backup['path'] for backup in expired] == ['/backup/postgres/daily/3.sql.gz',
+                                                      '/backup/postgres/daily/4.sql.gz']
+
+
+def test_deleted_backups_leave_retention_but_stay_in_history(tmp_path):
+    catalog = tmp_path / 'catalog.db'
+    ids = [_record(catalog, 'daily', days_ago, size=100) for days_ago in range(3)]
+
+    mark_deleted(ids[2], catalog_path=catalog)
+
+    assert expired_backups('postgres', 'daily', 1, catalog_path=catalog)[0]['id'] == ids[1]
+    assert len(list_backups('postgres', 'daily', catalog_path=catalog)) == 2
+    assert len(list_backups('postgres', 'daily', include_deleted=True, catalog_path=catalog)) == 3
+    assert has_backups('postgres', 'daily', catalog_path=catalog)
+    assert not has_backups('postgres', 'monthly', catalog_path=catalog)
+
+
+def test_list_backups_filters_by_kind_and_limit(tmp_path):
+    catalog = tmp_path / 'catalog.db'
+    _record(catalog, 'daily', 1)
+    _record(catalog, 'daily', 0)
+    _record(catalog, 'weekly', 0, kind='basebackup')
+
+    latest = list_backups('postgres', limit=1, catalog_path=catalog)
+
+    assert [backup['path'] for backup in latest] == ['/backup/postgres/daily/0.sql.gz']
+    assert len(list_backups(catalog_path=catalog)) == 3
+
+
+def test_overwriting_a_path_replaces_its_live_row(tmp_path):
+    catalog = tmp_path / 'catalog.db'
+    first = record_backup('postgres', 'manual', '/backup/postgres/manual/x.sql.gz', size=1, catalog_path=catalog)
+    second = record_backup('postgres', 'manual', '/backup/postgres/manual/x.sql.gz', size=2, catalog_path=catalog)
+
+    live = list_backups('postgres', 'manual', catalog_path=catalog)
+    assert [(backup['id'], backup['size']) for backup in live] == [(second, 2)]
+    history = list_backups('postgres', 'manual', include_deleted=True, catalog_path=catalog)
+    assert {backup['id'] for backup in history} == {first, second}
+
+
+def test_is_cataloged_ignores_deleted_rows(tmp_path):
+    catalog = tmp_path / 'catalog.db'
+    backup_id = record_backup('postgres', 'weekly', '/backup/postgres/weekly/x.sql.gz', catalog_path=catalog)
+    assert is_cataloged('/backup/postgres/weekly/x.sql.gz', catalog_path=catalog)
+
+    mark_deleted(backup_id, catalog_path=catalog)
+    assert not is_cataloged('/backup/postgres/weekly/x.sql.gz', catalog_path=catalog)
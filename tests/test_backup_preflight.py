@@ -0,0 +1,132 @@
+import functools
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+
+import backup_catalog
+import backup_preflight
+from backup_preflight import plan_backup, estimate_backup_size, prediction_error
+
+logger = logging.getLogger('test_backup_preflight')
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def volume(tmp_path, monkeypatch):
+    # カタログは一時ディレクトリに置き、保存先の空き容量はテストごとに決める
+    catalog = tmp_path / 'catalog.db'
+    for name in ('compression_history', 'expired_backups', 'list_backups'):
+        monkeypatch.setattr(backup_preflight, name,
+                            functools.partial(getattr(backup_catalog, name), catalog_path=catalog))
+    disk = {'total': 100 * GB, 'used': 50 * GB, 'free': 50 * GB, 'percent': 50.0}
+    monkeypatch.setattr(backup_preflight, 'get_disk_usage', lambda path: disk)
+    return catalog, disk
+
+
+def _record(catalog, days_ago, size, source_db_size=None, tier='daily'):
+    backup_catalog.record_backup('postgres', tier, f"/backup/{tier}/{days_ago}.sql.gz", engine='dumpall',
+                                 codec='gzip', size=size, source_db_size=source_db_size,
+                                 created_at=datetime.now() - timedelta(days=days_ago), catalog_path=catalog)
+
+
+def test_default_ratio_is_used_without_history(volume):
+    estimate = estimate_backup_size(10 * GB, 'dumpall', 'gzip')
+
+    assert estimate['samples'] == 0
+    assert estimate['predicted_size'] == 5 * GB
+    assert estimate['peak_bytes'] == 6 * GB
+
+
+def test_worst_recent_ratio_is_used(volume):
+    catalog, _ = volume
+    _record(catalog, 2, 2 * GB, 10 * GB)
+    _record(catalog, 1, 3 * GB, 10 * GB)
+
+    estimate = estimate_backup_size(10 * GB, 'dumpall', 'gzip')
+
+    assert estimate['samples'] == 2
+    assert estimate['ratio'] == pytest.approx(0.3)
+
+
+def test_backup_runs_when_it_fits(volume):
+    plan = plan_backup('daily', 10 * GB, 'dumpall', 'gzip', 7, logger)
+
+    assert plan['decision'] == 'run'
+    assert plan['predicted_size'] == 5 * GB
+
+
+def test_old_generations_are_pruned_first_when_that_makes_room(volume):
+    catalog, disk = volume
+    disk['free'] = 8 * GB
+    for days_ago in range(4):
+        _record(catalog, days_ago, 2 * GB)
+
+    # 6GBの出力と5GBの予備に対して空きは8GB。保持3世代なら古い2世代(4GB)を先に削除できる
+    plan = plan_backup('daily', 10 * GB, 'dumpall', 'gzip', 3, logger)
+
+    assert plan['decision'] == 'prune'
+    assert plan['reclaimable'] == 4 * GB
+
+
+def test_backup_is_skipped_when_pruning_is_not_enough(volume):
+    catalog, disk = volume
+    disk['free'] = 8 * GB
+    for days_ago in range(4):
+        _record(catalog, days_ago, 1 * GB)
+
+    plan = plan_backup('daily', 10 * GB, 'dumpall', 'gzip', 3, logger)
+
+    assert plan['decision'] == 'skip'
+    assert plan['reclaimable'] == 2 * GB
+
+
+def test_dedup_reclaimable_counts_only_chunks_no_longer_referenced(volume, tmp_path, monkeypatch):
+    catalog, disk = volume
+    disk['free'] = 8 * GB
+    for days_ago in range(4):
+        backup_catalog.record_backup('postgres', 'daily', f"/backup/postgres/repo/manifests/daily/{days_ago}.json",
+                                     engine='dedup', size=2 * GB,
+                                     created_at=datetime.now() - timedelta(days=days_ago), catalog_path=catalog)
+    released = []
+
+    def _reclaimable_bytes(repo_dir, backups):
+        released.extend(backups)
+        return 1 * GB
+    monkeypatch.setattr(backup_preflight, 'reclaimable_bytes', _reclaimable_bytes)
+
+    # カタログ上の合計(4GB)ではなく、参照されなくなるチャンクの量(1GB)で判定する
+    plan = plan_backup('daily', 10 * GB, 'dedup', None, 3, logger, repo_dir=tmp_path)
+
+    assert sorted(released) == [('daily', '2'), ('daily', '3')]
+    assert plan['reclaimable'] == 1 * GB
+    assert plan['decision'] == 'skip'
+
+
+def test_previous_backup_size_is_used_without_database_size(volume):
+    catalog, disk = volume
+    _record(catalog, 1, 4 * GB, tier='weekly')
+
+    plan = plan_backup('weekly', None, 'dumpall', 'gzip', 5, logger)
+    assert plan['predicted_size'] == 4 * GB
+
+    disk['percent'] = 97.0
+    assert plan_backup('monthly', None, 'dumpall', 'gzip', 5, logger)['decision'] == 'skip'
+
+
+def test_prediction_error():
+    assert prediction_error({'predicted_size': 100}, 120) == pytest.approx(20)
+    assert prediction_error(None, 120) is None
+
+
+def test_known_size_is_used_without_margin(volume):
+    catalog, disk = volume
+    disk['free'] = 10 * GB
+
+    # 昇格でコピーするdailyバックアップのサイズは分かっているため、安全率を掛けない
+    plan = plan_backup('weekly', None, 'dumpall', None, 5, logger, known_size=5 * GB)
+    assert plan['decision'] == 'run'
+    assert plan['peak_bytes'] == 5 * GB
+
+    assert plan_backup('weekly', None, 'dumpall', None, 5, logger, known_size=6 * GB)['decision'] == 'skip'
@@ -0,0 +1,68 @@
+from backup_verify import DumpInspector, write_manifest, read_manifest, unexpected_restore_errors
+
+DUMP = b"""--
+-- PostgreSQL database cluster dump
+--
+\\connect template1
+\\connect -reuse-previous=on "dbname='misskey'"
+COPY public.note (id, text) FROM stdin;
+1\thello
+2\tCOPY public.fake FROM stdin;
+3\tworld
+\\.
+COPY public."user" (id) FROM stdin;
+\\.
+\\connect other
+COPY public.meta (id) FROM stdin;
+1
+\\.
+"""
+
+
+def _inspect(data, size):
+    inspector = DumpInspector()
+    for offset in range(0, len(data), size):
+        inspector.feed(data[offset:offset + size])
+    return inspector.row_counts
+
+
+def test_rows_are_counted_per_database_and_table():
+    assert _inspect(DUMP, len(DUMP)) == {
+        'misskey': {'public.note': 3, 'public."user"': 0},
+        'other': {'public.meta': 1},
+    }
+
+
+def test_counts_do_not_depend_on_how_the_stream_is_split():
+    expected = _inspect(DUMP, len(DUMP))
+    for size in (1, 2, 3, 7, 16, 64):
+        assert _inspect(DUMP, size) == expected
+
+
+def test_manifest_sits_next_to_the_artifact(tmp_path):
+    artifact = tmp_path / 'pg_dump_daily_20260101.sql.gz'
+    assert read_manifest(artifact) is None
+
+    path = write_manifest(artifact, {'sha256': 'abc', 'size': 10, 'raw_bytes': 100,
+                                     'row_counts': {'misskey': {'public.note': 3}}})
+
+    assert path.name == 'pg_dump_daily_20260101.sql.gz.manifest.json'
+    manifest = read_manifest(artifact)
+    assert manifest['sha256'] == 'abc'
+    assert manifest['row_counts'] == {'misskey': {'public.note': 3}}
+
+
+def test_only_unavoidable_restore_errors_are_allowed():
+    allowed = [
+        'psql:<stdin>:14: ERROR:  role "postgres" already exists',
+        'psql:<stdin>:80: ERROR:  extension "pgroonga" is not available',
+        'psql:<stdin>:80: ERROR:  could not open extension control file '
+        '"/usr/share/postgresql/16/extension/pgroonga.control": No such file or directory',
+        'psql:<stdin>:92: ERROR:  extension "pgroonga" does not exist',
+        'psql:<stdin>:950: ERROR:  access method "pgroonga" does not exist',
+    ]
+    unexpected = [
+        'psql:<stdin>:300: ERROR:  relation "public.note" does not exist',
+        'psql:<stdin>:310: ERROR:  role "misskey" already exists',
+    ]
+    assert unexpected_restore_errors(allowed + unexpected) == unexpected
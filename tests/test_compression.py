@@ -0,0 +1,63 @@
+import gzip
+import io
+import logging
+
+import pytest
+
+import compression
+from compression import (open_compressor, codec_extension, pg_dump_compress_option, benchmark_codecs,
+                         ParallelGzipWriter)
+
+logger = logging.getLogger('test_compression')
+
+DATA = b''.join(f"INSERT INTO note VALUES ({i}, 'hello');\n".encode() for i in range(20000))
+
+
+@pytest.mark.parametrize('codec', ['gzip', 'pgzip'])
+def test_gzip_codecs_produce_standard_gzip(codec):
+    out = io.BytesIO()
+    with open_compressor(codec, out, threads=2) as writer:
+        for offset in range(0, len(DATA), 10000):
+            writer.write(DATA[offset:offset + 10000])
+
+    assert not out.closed
+    assert gzip.decompress(out.getvalue()) == DATA
+
+
+def test_pgzip_blocks_are_written_in_order():
+    out = io.BytesIO()
+    # ブロックを小さくして、複数のgzipメンバーを並列に圧縮させる
+    with ParallelGzipWriter(out, threads=4, block_size=4096) as writer:
+        writer.write(DATA)
+
+    assert gzip.decompress(out.getvalue()) == DATA
+
+
+def test_pgzip_empty_input_is_a_valid_gzip_file():
+    out = io.BytesIO()
+    open_compressor('pgzip', out).close()
+    assert gzip.decompress(out.getvalue()) == b''
+
+
+@pytest.mark.skipif(compression.zstandard is None, reason='zstandard is not installed')
+def test_zstd_round_trip():
+    out = io.BytesIO()
+    with open_compressor('zstd', out, threads=2) as writer:
+        writer.write(DATA)
+    assert compression.zstandard.ZstdDecompressor().decompressobj().decompress(out.getvalue()) == DATA
+
+
+def test_codec_options():
+    assert codec_extension('pgzip') == '.gz'
+    assert pg_dump_compress_option('pgzip') == '--compress=gzip:6'
+    assert pg_dump_compress_option('zstd', 9) == '--compress=zstd:9'
+    with pytest.raises(ValueError):
+        codec_extension('lz4')
+
+
+def test_benchmark_reports_every_candidate():
+    results = benchmark_codecs(DATA, [('gzip', 1, 1), ('pgzip', None, 2)], logger)
+
+    assert [result['codec'] for result in results] == ['gzip', 'pgzip']
+    assert results[1]['level'] == 6
+    assert all(result['ratio'] > 1 for result in results)
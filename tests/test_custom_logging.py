@@ -0,0 +1,54 @@
+import json
+import logging
+import queue
+import sys
+
+from custom_logging import JsonFormatter, task_context, _ContextFilter, _QueueHandler
+
+
+def _record(msg, *args, **extra):
+    record = logging.LogRecord('auto_backup_postgres', logging.INFO, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_lines_carry_the_message_and_context():
+    line = JsonFormatter().format(_record("Backup completed: %s", 'daily', duration=12.5))
+    entry = json.loads(line)
+
+    assert entry['level'] == 'INFO'
+    assert entry['logger'] == 'auto_backup_postgres'
+    assert entry['message'] == 'Backup completed: daily'
+    assert entry['duration'] == 12.5
+    assert 'task' not in entry
+
+
+def test_task_context_is_attached_to_records():
+    context_filter = _ContextFilter()
+    with task_context('pg_repack', run_id='abc123'):
+        record = _record("started")
+        context_filter.filter(record)
+    outside = _record("idle")
+    context_filter.filter(outside)
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert (entry['task'], entry['run_id']) == ('pg_repack', 'abc123')
+    assert getattr(outside, 'task', None) is None
+
+
+def test_exceptions_survive_the_queue():
+    try:
+        raise RuntimeError("pg_dump died")
+    except RuntimeError:
+        record = logging.LogRecord('auto_backup_postgres', logging.ERROR, __file__, 1, "Backup failed: %s",
+                                   ('daily',), sys.exc_info())
+    handler = _QueueHandler(queue.Queue())
+
+    entry = json.loads(JsonFormatter().format(handler.prepare(record)))
+
+    assert entry['message'] == 'Backup failed: daily'
+    assert entry['exception'].startswith('Traceback')
+    assert 'RuntimeError: pg_dump died' in entry['exception']
+    # テキスト形式では従来通りメッセージの後に例外を出力する
+    text = logging.Formatter('%(message)s').format(handler.prepare(record))
+    assert text.startswith('Backup failed: daily\nTraceback')
@@ -0,0 +1,188 @@
+import io
+import logging
+import random
+import sqlite3
+import sys
+
+import pytest
+
+import dedup_store
+from dedup_store import (iter_chunks, store_stream, store_command_output, promote_backup, delete_backup,
+                         collect_garbage, restore_backup, list_backups, reclaimable_bytes)
+
+logger = logging.getLogger('test_dedup_store')
+
+
+def _dump(lines=4000, seed=0):
+    # SQLダンプに似た行指向のデータ
+    rng = random.Random(seed)
+    return b''.join(f"INSERT INTO note VALUES ({i}, '{rng.getrandbits(64):x}');\n".encode() for i in range(lines))
+
+
+def _refcounts(repo):
+    conn = sqlite3.connect(repo / 'index.db')
+    try:
+        return dict(conn.execute("SELECT hash, refcount FROM chunks"))
+    finally:
+        conn.close()
+
+
+def _chunk_files(repo):
+    return {p.name for p in (repo / 'chunks').rglob('*') if p.is_file()}
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # 小さなデータでも複数のチャンクに分かれるようにする
+    original = dedup_store.iter_chunks
+
+    def _iter_chunks(stream, cut_bits=4, min_size=1024, max_size=8 * 1024):
+        return original(stream, cut_bits, min_size, max_size)
+    monkeypatch.setattr(dedup_store, 'iter_chunks', _iter_chunks)
+
+
+def test_iter_chunks_reassembles_input_and_respects_max_size():
+    data = _dump()
+    chunks = list(iter_chunks(io.BytesIO(data), cut_bits=4, min_size=1024, max_size=8 * 1024))
+    assert b''.join(chunks) == data
+    assert len(chunks) > 1
+    # 境界は行の後にだけ置く
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    # 最大サイズは最後の1行の分だけ超えることがある
+    longest_line = max(len(line) for line in data.splitlines(keepends=True))
+    assert all(len(chunk) < 8 * 1024 + longest_line for chunk in chunks)
+
+
+def test_iter_chunks_boundaries_survive_an_insertion():
+    data = _dump()
+    lines = data.splitlines(keepends=True)
+    edited = b''.join(lines[:100] + [b"INSERT INTO note VALUES (-1, 'new');\n"] + lines[100:])
+    kwargs = {'cut_bits': 4, 'min_size': 1024, 'max_size': 8 * 1024}
+    before = list(iter_chunks(io.BytesIO(data), **kwargs))
+    after = list(iter_chunks(io.BytesIO(edited), **kwargs))
+    # 挿入位置より後ろのチャンクはほとんど変わらない
+    assert len(set(before) & set(after)) >= len(before) - 2
+
+
+def test_store_and_restore_round_trip(tmp_path, small_chunks):
+    data = _dump()
+    stats = store_stream(tmp_path, io.BytesIO(data), 'daily', 'a', logger)
+    assert stats['raw_bytes'] == len(data)
+    assert stats['chunks'] > 1
+    assert stats['new_chunks'] == len(set(_refcounts(tmp_path)))
+
+    out = io.BytesIO()
+    assert restore_backup(tmp_path, 'daily', 'a', out) == len(data)
+    assert out.getvalue() == data
+
+
+def test_storing_the_same_data_twice_shares_chunks(tmp_path, small_chunks):
+    data = _dump()
+    store_stream(tmp_path, io.BytesIO(data), 'daily', 'a', logger)
+    files = _chunk_files(tmp_path)
+    stats = store_stream(tmp_path, io.BytesIO(data), 'daily', 'b', logger)
+
+    assert stats['new_chunks'] == 0
+    assert stats['size'] == 0
+    assert _chunk_files(tmp_path) == files
+    assert set(_refcounts(tmp_path).values()) == {2}
+
+
+def test_promote_shares_chunks_with_the_source(tmp_path, small_chunks):
+    data = _dump()
+    store_stream(tmp_path, io.BytesIO(data), 'daily', 'pg_dump_daily_x', logger)
+    files = _chunk_files(tmp_path)
+
+    stats = promote_backup(tmp_path, 'daily', 'pg_dump_daily_x', 'weekly', 'pg_dump_weekly_x', logger)
+    assert stats['raw_bytes'] == len(data)
+    assert stats['new_chunks'] == 0
+    assert _chunk_files(tmp_path) == files
+    assert set(_refcounts(tmp_path).values()) == {2}
+
+    # 昇格元を削除しても、昇格先から復元できる
+    delete_backup(tmp_path, 'daily', 'pg_dump_daily_x', logger)
+    assert collect_garbage(tmp_path, logger) == (0, 0)
+    out = io.BytesIO()
+    restore_backup(tmp_path, 'weekly', 'pg_dump_weekly_x', out)
+    assert out.getvalue() == data
+
+
+def test_promoting_twice_adds_only_one_reference(tmp_path, small_chunks):
+    store_stream(tmp_path, io.BytesIO(_dump()), 'daily', 'pg_dump_daily_x', logger)
+
+    first = promote_backup(tmp_path, 'daily', 'pg_dump_daily_x', 'weekly', 'pg_dump_weekly_x', logger)
+    assert first['existing'] is False
+    assert set(_refcounts(tmp_path).values()) == {2}
+
+    # 同じ日に再実行しても参照カウントは増えない
+    second = promote_backup(tmp_path, 'daily', 'pg_dump_daily_x', 'weekly', 'pg_dump_weekly_x', logger)
+    assert second['existing'] is True
+    assert set(_refcounts(tmp_path).values()) == {2}
+    assert list_backups(tmp_path, 'weekly') == ['pg_dump_weekly_x']
+
+
+def test_promote_replacing_another_manifest_releases_its_chunks(tmp_path, small_chunks):
+    store_stream(tmp_path, io.BytesIO(_dump(seed=1)), 'daily', 'old', logger)
+    store_stream(tmp_path, io.BytesIO(_dump(seed=2)), 'daily', 'new', logger)
+    promote_backup(tmp_path, 'daily', 'old', 'weekly', 'w', logger)
+    promote_backup(tmp_path, 'daily', 'new', 'weekly', 'w', logger)
+
+    delete_backup(tmp_path, 'daily', 'old', logger)
+    removed, _ = collect_garbage(tmp_path, logger)
+    # oldのチャンクはweekly/wからも参照されなくなっている
+    assert removed > 0
+    out = io.BytesIO()
+    restore_backup(tmp_path, 'weekly', 'w', out)
+    assert out.getvalue() == _dump(seed=2)
+
+
+def test_delete_and_gc_reclaim_only_unreferenced_chunks(tmp_path, small_chunks):
+    store_stream(tmp_path, io.BytesIO(_dump(seed=1)), 'daily', 'a', logger)
+    store_stream(tmp_path, io.BytesIO(_dump(seed=1)), 'weekly', 'a', logger)
+    store_stream(tmp_path, io.BytesIO(_dump(seed=2)), 'daily', 'b', logger)
+
+    # 同じ内容のweekly/aが残っている間はaのチャンクを回収しない
+    delete_backup(tmp_path, 'daily', 'a', logger)
+    assert collect_garbage(tmp_path, logger) == (0, 0)
+
+    delete_backup(tmp_path, 'weekly', 'a', logger)
+    removed, freed = collect_garbage(tmp_path, logger)
+    assert removed > 0 and freed > 0
+    assert all(count > 0 for count in _refcounts(tmp_path).values())
+    assert len(_chunk_files(tmp_path)) == len(_refcounts(tmp_path))
+
+    out = io.BytesIO()
+    restore_backup(tmp_path, 'daily', 'b', out)
+    assert out.getvalue() == _dump(seed=2)
+
+    delete_backup(tmp_path, 'daily', 'b', logger)
+    collect_garbage(tmp_path, logger)
+    assert _refcounts(tmp_path) == {}
+    assert _chunk_files(tmp_path) == set()
+
+
+def test_reclaimable_bytes_matches_what_gc_frees(tmp_path, small_chunks):
+    store_stream(tmp_path, io.BytesIO(_dump(seed=1)), 'daily', 'a', logger)
+    store_stream(tmp_path, io.BytesIO(_dump(seed=1)), 'daily', 'b', logger)
+    store_stream(tmp_path, io.BytesIO(_dump(seed=2)), 'daily', 'c', logger)
+
+    # 同じ内容のbが残るため、aを削除しても解放されない
+    assert reclaimable_bytes(tmp_path, [('daily', 'a')]) == 0
+
+    expected = reclaimable_bytes(tmp_path, [('daily', 'a'), ('daily', 'b')])
+    assert expected > 0
+    delete_backup(tmp_path, 'daily', 'a', logger)
+    delete_backup(tmp_path, 'daily', 'b', logger)
+    assert collect_garbage(tmp_path, logger)[1] == expected
+
+
+def test_failed_command_leaves_no_manifest_or_references(tmp_path, small_chunks):
+    cmd = [sys.executable, '-c', "import sys; sys.stdout.write('x\\n' * 5000); sys.exit(3)"]
+    success, error = store_command_output(tmp_path, cmd, None, 'daily', 'broken', logger)
+
+    assert not success
+    assert 'status 3' in error
+    assert list_backups(tmp_path, 'daily') == []
+    assert set(_refcounts(tmp_path).values()) <= {0}
+    collect_garbage(tmp_path, logger)
+    assert _chunk_files(tmp_path) == set()
@@ -0,0 +1,118 @@
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import pytest
+
+import compression
+import load_env
+from load_env import parse_settings, get_settings
+
+logger = logging.getLogger('test_load_env')
+
+EXAMPLE_ENV = Path(__file__).resolve().parent.parent / 'example.env'
+
+
+@pytest.fixture(autouse=True)
+def isolated_environ(monkeypatch):
+    # parse_settingsは子プロセス向けにos.environを更新するため、テストごとに元に戻す
+    saved = dict(os.environ)
+    monkeypatch.setattr(load_env, '_BASE_ENVIRON', {})
+    monkeypatch.setattr(load_env, '_SETTINGS', None)
+    yield
+    os.environ.clear()
+    os.environ.update(saved)
+
+
+def _write_env(tmp_path, *lines):
+    env_path = tmp_path / '.env'
+    shutil.copy(EXAMPLE_ENV, env_path)
+    with open(env_path, 'a', encoding='utf-8') as f:
+        f.write('\n' + '\n'.join(lines) + '\n')
+    return env_path
+
+
+def test_example_env_is_valid(tmp_path):
+    settings = parse_settings(_write_env(tmp_path), logger)
+
+    assert settings['PG_BACKUP_DAILY'] is True
+    assert settings['PG_BACKUP_DAILY_GENERATION'] == 7
+    assert settings['MISSKEY_NOTICE_COALESCE_SECONDS'] == 5.0
+    # 空の値は未設定として既定値を使う
+    assert settings['REDIS_HOST'] == 'localhost'
+    assert settings.get('MINIO_HOST', 'fallback') == 'fallback'
+    assert settings.connection_info()['port'] == '15432'
+
+
+def test_all_invalid_values_are_reported_at_once(tmp_path):
+    env_path = _write_env(tmp_path, 'PG_REPACK=maybe', 'REDIS_BACKUP_TIME=25:00', 'DB_POOL_SIZE=four')
+
+    with pytest.raises(ValueError) as excinfo:
+        parse_settings(env_path, logger)
+
+    message = str(excinfo.value)
+    assert 'PG_REPACK' in message
+    assert 'REDIS_BACKUP_TIME' in message
+    assert 'DB_POOL_SIZE' in message
+
+
+def test_environment_overrides_the_env_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(load_env, '_BASE_ENVIRON', {'POSTGRES_HOST': 'db.internal'})
+
+    settings = parse_settings(_write_env(tmp_path), logger)
+
+    assert settings['POSTGRES_HOST'] == 'db.internal'
+
+
+def test_unknown_keys_are_rejected(tmp_path):
+    settings = parse_settings(_write_env(tmp_path), logger)
+
+    with pytest.raises(KeyError):
+        settings.get('PG_BACKUP_DIALY')
+
+
+def test_changed_env_is_reloaded_and_invalid_changes_are_ignored(tmp_path, monkeypatch):
+    env_path = _write_env(tmp_path, 'DB_POOL_SIZE=4')
+    monkeypatch.setattr(load_env, 'ENV_PATHS', [env_path])
+    assert get_settings()['DB_POOL_SIZE'] == 4
+
+    env_path.write_text(env_path.read_text().replace('DB_POOL_SIZE=4', 'DB_POOL_SIZE=8'))
+    os.utime(env_path, (1000, 1000))
+    assert get_settings()['DB_POOL_SIZE'] == 8
+
+    env_path.write_text(env_path.read_text().replace('DB_POOL_SIZE=8', 'DB_POOL_SIZE=eight'))
+    os.utime(env_path, (2000, 2000))
+    assert get_settings()['DB_POOL_SIZE'] == 8
+
+
+def test_codecs_are_checked_when_settings_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, 'zstandard', None)
+    env_path = _write_env(tmp_path, 'PG_BACKUP_CODEC=lz4', 'PG_BACKUP_WEEKLY_CODEC=zstd')
+
+    with pytest.raises(ValueError) as excinfo:
+        parse_settings(env_path, logger)
+
+    assert 'PG_BACKUP_CODEC' in str(excinfo.value)
+    assert 'PG_BACKUP_WEEKLY_CODEC: zstd requires the zstandard package' in str(excinfo.value)
+
+
+def test_frequencies_accept_only_the_documented_values(tmp_path):
+    env_path = _write_env(tmp_path, 'PG_REPACK_FREQUENCY=weekly', 'PG_BACKUP_WEEKLY_FREQUENCY=every_third')
+
+    with pytest.raises(ValueError) as excinfo:
+        parse_settings(env_path, logger)
+
+    assert 'PG_REPACK_FREQUENCY' in str(excinfo.value)
+    assert 'PG_BACKUP_WEEKLY_FREQUENCY' in str(excinfo.value)
+
+
+def test_everyday_is_accepted_as_every(tmp_path):
+    env_path = _write_env(tmp_path, 'PG_BACKUP_DAILY_FREQUENCY=everyday', 'PG_BACKUP_MONTHLY_FREQUENCY=every_second',
+                          'MINIO_BACKUP_FREQUENCY=everyday')
+
+    settings = parse_settings(env_path, logger)
+
+    assert settings['PG_BACKUP_DAILY_FREQUENCY'] == 'every'
+    assert settings['PG_BACKUP_MONTHLY_FREQUENCY'] == 'every_second'
+    assert settings['MINIO_BACKUP_FREQUENCY'] == 'every'
@@ -0,0 +1,67 @@
+import logging
+import time
+
+import load_governor
+from load_governor import LoadGovernor, NORMAL, THROTTLE, PAUSE
+
+logger = logging.getLogger('test_load_governor')
+
+
+def _governor(**kwargs):
+    return LoadGovernor({}, logger, **kwargs)
+
+
+def test_levels_follow_the_thresholds():
+    governor = _governor()
+
+    assert governor.assess({'active_sessions': 5, 'cpu_percent': 40}) == (NORMAL, [])
+    level, reasons = governor.assess({'active_sessions': 25, 'cpu_percent': 40})
+    assert level == THROTTLE
+    assert reasons == ['active_sessions=25>=20']
+    assert governor.assess({'active_sessions': 25, 'lock_waits': 10})[0] == PAUSE
+
+
+def test_percent_metrics_can_still_reach_the_pause_level():
+    # 85% x 2 は100%を超えるため、一時停止のしきい値は100%で頭打ちにする
+    governor = _governor()
+
+    assert governor.assess({'cpu_percent': 99})[0] == THROTTLE
+    assert governor.assess({'cpu_percent': 100})[0] == PAUSE
+
+
+def test_missing_or_disabled_metrics_are_ignored():
+    governor = _governor(thresholds={'replication_lag': None})
+
+    assert governor.assess({'replication_lag': 1000, 'io_pressure': None}) == (NORMAL, [])
+
+
+def test_level_drops_only_after_consecutive_calm_samples(monkeypatch):
+    samples = iter([{'active_sessions': 30}, {'active_sessions': 1}, {'active_sessions': 1}])
+    monkeypatch.setattr(load_governor, 'sample_load', lambda connection_info: next(samples))
+    governor = _governor()
+
+    assert governor.update() == THROTTLE
+    assert governor.update() == THROTTLE
+    assert governor.update() == NORMAL
+
+
+def test_monitoring_restarts_when_a_job_attaches_after_a_detach(monkeypatch):
+    samples = []
+    monkeypatch.setattr(load_governor, 'sample_load', lambda connection_info: samples.append(1) or {})
+    monkeypatch.setattr(load_governor, '_process_tree', lambda pid: [])
+    governor = _governor(interval=0.01)
+
+    governor.attach(1001)
+    first = governor._monitor
+    governor.detach(1001)
+    assert governor._monitor is None
+
+    # 前のスレッドが終了する前に次のコマンドを監視し始めても、監視は止まらない
+    governor.attach(1002)
+    assert governor._monitor is not first and governor._monitor.is_alive()
+    first.join(1)
+    count = len(samples)
+    time.sleep(0.1)
+    assert len(samples) > count
+
+    governor.detach(1002)
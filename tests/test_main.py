@@ -0,0 +1,39 @@
+import logging
+from datetime import date, timedelta
+
+import pytest
+
+import main
+from main import is_interval_day
+
+
+def _run_days(frequency, days=12, start=date(2026, 1, 25)):
+    return [start + timedelta(days=i) for i in range(days) if is_interval_day(frequency, start + timedelta(days=i))]
+
+
+def test_every_runs_daily():
+    assert len(_run_days('every')) == 12
+    assert len(_run_days(None)) == 12
+
+
+def test_intervals_stay_even_across_month_ends():
+    # 1/31と2/1のように奇数日が続いても、間隔は常に同じ日数になる
+    for frequency, interval in (('every_second', 2), ('every_third', 3)):
+        days = _run_days(frequency)
+        assert len(days) == 12 // interval
+        assert all((b - a).days == interval for a, b in zip(days, days[1:]))
+
+
+def test_minio_backup_reports_missing_connection_settings(monkeypatch):
+    settings = {'MINIO_BACKUP': True, 'MINIO_BACKUP_FREQUENCY': 'every', 'MINIO_HOST': 'minio:9000',
+                'MINIO_ACCESS_KEY': None, 'MINIO_SECRET_KEY': 'secret', 'MINIO_BUCKET': 'files'}
+    sent, recorded = [], []
+    monkeypatch.setattr(main, 'get_settings', lambda: settings)
+    monkeypatch.setattr(main, 'setup_logger', lambda name: logging.getLogger(name))
+    monkeypatch.setattr(main, 'sendDM_misskey_notification', sent.append)
+    monkeypatch.setattr(main, 'record_task_result', lambda *args, **kwargs: recorded.append(args))
+    monkeypatch.setattr(main, 'backup_minio_bucket', lambda *args, **kwargs: pytest.fail("backup should not run"))
+
+    assert main.minio_backup() is False
+    assert sent == ["環境変数MINIO_ACCESS_KEYが設定されていません。"]
+    assert recorded == [('minio_backup', False, "環境変数MINIO_ACCESS_KEYが設定されていません。")]
@@ -0,0 +1,54 @@
+import logging
+
+from notice import MisskeyNotifier, COALESCE_SEPARATOR, MAX_NOTE_LENGTH
+
+logger = logging.getLogger('test_notice')
+
+
+class _RecordingNotifier(MisskeyNotifier):
+    """
+    送信する代わりにノートの内容を記録する
+    """
+
+    def __init__(self, coalesce_seconds=5):
+        self.payloads = []
+        super().__init__('misskey.example', 'token', 'admin', logger, coalesce_seconds=coalesce_seconds)
+
+    def post(self, payload):
+        self.payloads.append(payload)
+        return {}
+
+
+def test_notifications_to_the_same_recipient_are_coalesced():
+    notifier = _RecordingNotifier()
+    notifier.send("backup done")
+    notifier.send("repack done")
+    notifier.send("maintenance finished", visibility="public")
+
+    assert notifier.flush(5)
+    assert [p['text'] for p in notifier.payloads] == [
+        f"backup done{COALESCE_SEPARATOR}repack done",
+        "maintenance finished",
+    ]
+    assert notifier.payloads[0]['visibility'] == 'specified'
+    assert notifier.payloads[0]['visibleUserIds'] == ['admin']
+    assert notifier.payloads[1]['visibility'] == 'public'
+
+
+def test_coalesced_note_stays_within_the_length_limit():
+    notifier = _RecordingNotifier()
+    text = 'x' * (MAX_NOTE_LENGTH // 2)
+    for _ in range(3):
+        notifier.send(text)
+
+    assert notifier.flush(5)
+    assert [len(p['text']) for p in notifier.payloads] == [MAX_NOTE_LENGTH // 2] * 3
+
+
+def test_coalescing_can_be_disabled():
+    notifier = _RecordingNotifier(coalesce_seconds=0)
+    notifier.send("first")
+    notifier.send("second")
+
+    assert notifier.flush(5)
+    assert [p['text'] for p in notifier.payloads] == ["first", "second"]
@@ -0,0 +1,19 @@
+import pytest
+
+import object_storage
+from object_storage import endpoint_url, create_s3_client
+
+
+def test_endpoint_url_defaults_to_http():
+    assert endpoint_url('minio') == 'http://minio'
+    assert endpoint_url('minio', '9000') == 'http://minio:9000'
+    assert endpoint_url('https://s3.example.com') == 'https://s3.example.com'
+
+
+@pytest.mark.skipif(object_storage.boto3 is None, reason="boto3 is not installed")
+def test_client_uses_the_normalized_endpoint():
+    client = create_s3_client('minio:9000', 'access', 'secret')
+    assert client.meta.endpoint_url == 'http://minio:9000'
+
+    # エンドポイントを指定しない場合はAWSのS3を使う
+    assert 'amazonaws.com' in create_s3_client(None, 'access', 'secret').meta.endpoint_url
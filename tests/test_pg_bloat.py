@@ -0,0 +1,48 @@
+from pg_bloat import select_repack_targets, _estimate_table_from_stats, _estimate_index_from_stats
+
+MB = 1024 * 1024
+
+
+def _table(name, reclaimable, size=1000 * MB, has_unique=True):
+    return {'kind': 'table', 'schema': 'public', 'name': name, 'table': name, 'bytes': size,
+            'reclaimable': reclaimable, 'ratio': reclaimable / size, 'index_count': 1, 'has_unique': has_unique}
+
+
+def _index(name, table, reclaimable, size=500 * MB):
+    return {'kind': 'index', 'schema': 'public', 'name': name, 'table': table, 'bytes': size,
+            'reclaimable': reclaimable, 'ratio': reclaimable / size}
+
+
+def test_targets_must_pass_both_thresholds():
+    estimates = [_table('note', 400 * MB), _table('user', 50 * MB, size=100 * MB), _table('meta', 150 * MB)]
+
+    targets = select_repack_targets(estimates, min_bytes=100 * MB, min_ratio=0.2)
+
+    # userは割合は大きいが量が少なく、metaは量は多いが割合が小さい
+    assert [t['name'] for t in targets] == ['note']
+
+
+def test_tables_without_a_unique_key_are_skipped():
+    estimates = [_table('note', 400 * MB, has_unique=False), _index('note_pkey', 'note', 300 * MB)]
+
+    targets = select_repack_targets(estimates, min_bytes=100 * MB, min_ratio=0.2)
+
+    # テーブルは再編成できなくても、インデックスだけは再作成できる
+    assert [t['name'] for t in targets] == ['note_pkey']
+
+
+def test_indexes_of_repacked_tables_are_not_repeated():
+    estimates = [_table('note', 400 * MB), _index('note_pkey', 'note', 300 * MB),
+                 _index('user_pkey', 'user', 200 * MB)]
+
+    targets = select_repack_targets(estimates, min_bytes=100 * MB, min_ratio=0.2)
+
+    assert [t['name'] for t in targets] == ['note', 'user_pkey']
+
+
+def test_statistics_estimates():
+    # 1ページ(8KB)に100行入る幅の行が1000行なら10ページで足りる
+    assert _estimate_table_from_stats(100 * 8192, 1000, 100, 53, 8192) == 90 * 8192
+    assert _estimate_table_from_stats(100 * 8192, 0, 100, 53, 8192) == 0
+    # 詰め直したほうが大きくなる場合は回収できる量を0とする
+    assert _estimate_index_from_stats(8192, 100000, 8, 8192) == 0
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+
+from pipeline import MaintenancePipeline, PipelineTask, DB_IO
+
+logger = logging.getLogger('test_pipeline')
+
+
+class _Recorder:
+    """
+    タスクの開始と終了の順序、同時に実行していた数を記録する
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = []
+        self.running = {}
+        self.max_running = {}
+
+    def task(self, name, resource=None, duration=0.05, fail=False):
+        def _run():
+            with self.lock:
+                self.events.append(('start', name))
+                self.running[resource] = self.running.get(resource, 0) + 1
+                self.max_running[resource] = max(self.max_running.get(resource, 0), self.running[resource])
+            time.sleep(duration)
+            with self.lock:
+                self.running[resource] -= 1
+                self.events.append(('end', name))
+            if fail:
+                raise RuntimeError(f"{name} failed")
+        return _run
+
+    def started(self):
+        return [name for event, name in self.events if event == 'start']
+
+    def index(self, event, name):
+        return self.events.index((event, name))
+
+
+def test_tasks_start_after_their_dependencies_finish():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask('backup', recorder.task('backup'), after=['repack']),
+        PipelineTask('repack', recorder.task('repack')),
+        PipelineTask('verify', recorder.task('verify'), after=['backup']),
+    ], logger)
+
+    results = pipeline.run()
+
+    assert {name: result['status'] for name, result in results.items()} == \
+        {'repack': 'done', 'backup': 'done', 'verify': 'done'}
+    assert recorder.index('end', 'repack') < recorder.index('start', 'backup')
+    assert recorder.index('end', 'backup') < recorder.index('start', 'verify')
+
+
+def test_failed_dependency_does_not_block_successors():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask('repack', recorder.task('repack', fail=True)),
+        PipelineTask('backup', recorder.task('backup'), after=['repack']),
+    ], logger)
+
+    results = pipeline.run()
+
+    assert results['repack']['status'] == 'failed'
+    assert results['backup']['status'] == 'done'
+
+
+def test_condition_skip_lets_successors_run():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask('weekly', recorder.task('weekly'), when=lambda: False),
+        PipelineTask('monthly', recorder.task('monthly'), after=['weekly']),
+    ], logger)
+
+    results = pipeline.run()
+
+    assert results['weekly'] == {'status': 'skipped', 'reason': 'condition'}
+    assert results['monthly']['status'] == 'done'
+    assert recorder.started() == ['monthly']
+
+
+def test_tasks_are_skipped_once_the_window_has_ended():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask('first', recorder.task('first', duration=0.1)),
+        PipelineTask('second', recorder.task('second'), after=['first']),
+        PipelineTask('report', recorder.task('report'), after=['first'], window=False),
+    ], logger, window_length=timedelta(seconds=0.05))
+
+    results = pipeline.run()
+
+    # 開始済みのタスクは最後まで実行し、ウィンドウの外でもよいタスクは実行する
+    assert results['first']['status'] == 'done'
+    assert results['second'] == {'status': 'skipped', 'reason': 'window'}
+    assert results['report']['status'] == 'done'
+
+
+def test_db_io_tasks_never_overlap_but_others_run_alongside():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask('repack', recorder.task('repack', DB_IO, duration=0.1), resource=DB_IO),
+        PipelineTask('pgroonga', recorder.task('pgroonga', DB_IO, duration=0.1), resource=DB_IO),
+        PipelineTask('backup', recorder.task('backup', DB_IO, duration=0.1), resource=DB_IO),
+        PipelineTask('redis', recorder.task('redis', duration=0.2)),
+        PipelineTask('minio', recorder.task('minio', duration=0.2)),
+    ], logger, max_workers=4)
+
+    results = pipeline.run()
+
+    assert all(result['status'] == 'done' for result in results.values())
+    assert recorder.max_running[DB_IO] == 1
+    # 資源クラスのないタスクはDB_IOのタスクと並行して実行する
+    assert recorder.max_running[None] == 2
+    assert recorder.index('start', 'redis') < recorder.index('end', 'repack')
+
+
+def test_resource_limits_can_be_raised():
+    recorder = _Recorder()
+    pipeline = MaintenancePipeline([
+        PipelineTask(name, recorder.task(name, DB_IO, duration=0.1), resource=DB_IO) for name in ('a', 'b', 'c')
+    ], logger, max_workers=3, resource_limits={DB_IO: 2})
+
+    pipeline.run()
+
+    assert recorder.max_running[DB_IO] == 2
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match='unknown task'):
+        MaintenancePipeline([PipelineTask('backup', lambda: None, after=['missing'])], logger)
+
+
+def test_dependency_cycle_is_rejected():
+    with pytest.raises(ValueError, match='cycle'):
+        MaintenancePipeline([
+            PipelineTask('a', lambda: None, after=['c']),
+            PipelineTask('b', lambda: None, after=['a']),
+            PipelineTask('c', lambda: None, after=['b']),
+        ], logger)
+
+
+def test_overlapping_run_is_skipped():
+    release = threading.Event()
+    pipeline = MaintenancePipeline([PipelineTask('slow', lambda: release.wait(5))], logger)
+
+    thread = pipeline.start_background()
+    deadline = time.time() + 5
+    while not pipeline.running and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert pipeline.run() is None
+    release.set()
+    thread.join(5)
+    assert not pipeline.running
@@ -0,0 +1,90 @@
+import errno
+import os
+import re
+from datetime import datetime, timedelta
+
+import pytest
+
+import postgres
+from postgres import decide_pgroonga_rebuild, _link_or_copy, _PGROONGA_LEFTOVER_PATTERN
+
+
+def _health(**overrides):
+    health = {
+        'exists': True, 'valid': True, 'index_bytes': 1000 * 1024, 'table_bytes': 10 * 1024 * 1024,
+        'n_records': 10000, 'live_tuples': 10000, 'dead_tuples': 500, 'dead_ratio': 0.05,
+    }
+    health.update(overrides)
+    return health
+
+
+def _baseline(days_ago=3, **overrides):
+    baseline = {'checked_at': (datetime.now() - timedelta(days=days_ago)).isoformat(),
+                'index_bytes': 1000 * 1024, 'live_tuples': 10000}
+    baseline.update(overrides)
+    return baseline
+
+
+def test_healthy_index_is_not_rebuilt():
+    assert decide_pgroonga_rebuild(_health(), _baseline()) == (False, 'healthy')
+
+
+def test_missing_invalid_or_unmeasured_index_is_rebuilt():
+    assert decide_pgroonga_rebuild(_health(exists=False), _baseline())[0]
+    assert decide_pgroonga_rebuild(_health(valid=False), _baseline())[0]
+    assert decide_pgroonga_rebuild(_health(), None)[0]
+
+
+def test_old_rebuild_is_refreshed():
+    rebuild, reason = decide_pgroonga_rebuild(_health(), _baseline(days_ago=30), max_age_days=30)
+    assert rebuild
+    assert '30 days' in reason
+
+
+def test_dead_tuples_trigger_a_rebuild():
+    assert decide_pgroonga_rebuild(_health(dead_ratio=0.25), _baseline(), max_dead_ratio=0.2)[0]
+
+
+def test_stale_groonga_records_trigger_a_rebuild():
+    assert decide_pgroonga_rebuild(_health(n_records=14000), _baseline(), max_growth=0.3)[0]
+
+
+def test_growth_is_measured_per_row():
+    # ノートが倍に増えてインデックスも倍になった場合は自然な成長
+    grown = _health(index_bytes=2000 * 1024, live_tuples=20000, n_records=20000)
+    assert decide_pgroonga_rebuild(grown, _baseline(), max_growth=0.3) == (False, 'healthy')
+
+    # 行数が同じままインデックスだけが大きくなった場合は肥大化
+    bloated = _health(index_bytes=1400 * 1024)
+    rebuild, reason = decide_pgroonga_rebuild(bloated, _baseline(), max_growth=0.3)
+    assert rebuild
+    assert 'bytes per row' in reason
+
+
+def test_only_leftovers_of_the_pgroonga_index_are_cleaned_up():
+    leftovers = ['idx_note_text_with_pgroonga_swap', 'idx_note_text_with_pgroonga_ccnew',
+                 'idx_note_text_with_pgroonga_ccnew2', 'idx_note_text_with_pgroonga_ccold1']
+    others = ['idx_note_text_with_pgroonga', 'idx_note_text_with_pgroonga_swap_old',
+              'idx_note_text_with_pgroongaX_ccnew', 'my_idx_note_text_with_pgroonga_swap', 'IDX_note_userId']
+
+    # PostgreSQLの~と同じく、部分一致ではなくパターンのアンカーで判定する
+    assert all(re.search(_PGROONGA_LEFTOVER_PATTERN, name) for name in leftovers)
+    assert not any(re.search(_PGROONGA_LEFTOVER_PATTERN, name) for name in others)
+
+
+def test_copy_fallback_can_be_disabled(tmp_path, monkeypatch):
+    # ハードリンクもreflinkも使えないファイルシステムを想定する
+    def no_link(*args):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+    monkeypatch.setattr(postgres.os, 'link', no_link)
+    monkeypatch.setattr(postgres.fcntl, 'ioctl', no_link)
+    src = tmp_path / 'daily.sql.gz'
+    src.write_bytes(b'backup')
+
+    with pytest.raises(OSError) as excinfo:
+        _link_or_copy(src, tmp_path / 'weekly.sql.gz', allow_copy=False)
+    assert excinfo.value.errno == errno.ENOSPC
+    assert not (tmp_path / 'weekly.sql.gz').exists()
+
+    assert _link_or_copy(src, tmp_path / 'weekly.sql.gz') == 'copy'
+    assert (tmp_path / 'weekly.sql.gz').read_bytes() == b'backup'
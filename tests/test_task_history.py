@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from task_history import record_task_run, task_baseline, detect_regression
+
+
+def _record(history_path, duration, task='auto_backup_weekly', status='success', method=None, bytes_processed=None):
+    finished_at = datetime.now()
+    return record_task_run(task, status, started_at=finished_at - timedelta(seconds=duration),
+                           finished_at=finished_at, bytes_processed=bytes_processed, method=method,
+                           history_path=history_path)
+
+
+def test_no_regression_without_enough_samples(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(4):
+        _record(history, 600)
+    run = _record(history, 6000)
+
+    assert detect_regression(run, min_samples=5, history_path=history) is None
+
+
+def test_slow_run_is_reported(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(5):
+        _record(history, 600)
+    run = _record(history, 1200)
+
+    assert '2.0倍' in detect_regression(run, history_path=history)
+
+
+def test_short_tasks_ignore_small_differences(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(5):
+        _record(history, 10)
+    run = _record(history, 40)
+
+    # 中央値の4倍でも差がmin_seconds未満なら遅延とみなさない
+    assert detect_regression(run, min_seconds=60, history_path=history) is None
+
+
+def test_failed_runs_are_not_part_of_the_baseline(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(5):
+        _record(history, 600)
+        _record(history, 5, status='failed')
+
+    assert task_baseline('auto_backup_weekly', history_path=history)['median_duration'] == 600
+
+
+def test_throughput_drop_is_reported(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(5):
+        _record(history, 600, bytes_processed=600 * 100 * 1024 * 1024)
+    run = _record(history, 620, bytes_processed=620 * 10 * 1024 * 1024)
+
+    assert 'スループット' in detect_regression(run, history_path=history)
+
+
+def test_baseline_is_kept_per_task(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(5):
+        _record(history, 600)
+        _record(history, 30, task='redis_backup')
+
+    assert task_baseline('redis_backup', history_path=history)['median_duration'] == 30
+    assert detect_regression(_record(history, 650), history_path=history) is None
+
+
+def test_promotions_do_not_set_the_baseline_for_full_dumps(tmp_path):
+    history = tmp_path / 'history.db'
+    for _ in range(10):
+        _record(history, 3, method='promotion')
+    full_dump = _record(history, 3600)
+
+    # 昇格だけの履歴ではフルダンプの基準がなく、遅延とみなさない
+    assert detect_regression(full_dump, history_path=history) is None
+
+    for _ in range(5):
+        _record(history, 3600)
+    assert task_baseline('auto_backup_weekly', history_path=history)['median_duration'] == 3600
+    assert task_baseline('auto_backup_weekly', method='promotion', history_path=history)['median_duration'] == 3
+    assert detect_regression(_record(history, 3700), history_path=history) is None